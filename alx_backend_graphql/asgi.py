@@ -2,6 +2,8 @@
 ASGI config for alx_backend_graphql project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+WebSocket connections to ``/graphql`` are served by ``crm.websocket`` (GraphQL
+subscriptions over ``graphql-transport-ws``); everything else goes to Django.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +15,26 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_backend_graphql.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up
+from django.conf import settings  # noqa: E402
+
+from alx_backend_graphql.schema import get_schema  # noqa: E402
+from crm import catalog  # noqa: E402
+from crm.websocket import GraphQLWebSocket  # noqa: E402
+
+if settings.CRM_SCHEMA_PRELOAD:
+    get_schema()
+catalog.preload()
+
+graphql_websocket = GraphQLWebSocket(get_schema)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        if scope['path'].rstrip('/') == '/graphql':
+            return await graphql_websocket(scope, receive, send)
+        await receive()
+        return await send({'type': 'websocket.close', 'code': 1000})
+    return await django_application(scope, receive, send)
@@ -1,14 +1,40 @@
+"""
+Project schema: the CRM root types plus ``hello``.
+
+Building it imports every type in ``crm.schema`` and creates the GraphQL
+type map, so it happens on first use (``get_schema()`` or the ``schema``
+attribute, which is what ``GRAPHENE['SCHEMA']`` names) and is cached for the
+life of the process. ``wsgi.py``/``asgi.py`` build it while the worker boots
+when ``CRM_SCHEMA_PRELOAD`` is set; management commands and import workers
+that never execute GraphQL skip it.
+"""
+from functools import lru_cache
+
 import graphene
-from crm.schema import Query as CRMQuery, Mutation as CRMMutation
 
 
-class Query(CRMQuery, graphene.ObjectType):
-    hello = graphene.String(default_value="Hello, GraphQL!")
+@lru_cache(maxsize=None)
+def get_schema():
+    from crm import incremental
+    from crm.schema import Query as CRMQuery, Mutation as CRMMutation, Subscription as CRMSubscription
+
+    class Query(CRMQuery, graphene.ObjectType):
+        hello = graphene.String(default_value="Hello, GraphQL!")
 
+    class Mutation(CRMMutation, graphene.ObjectType):
+        pass
 
-class Mutation(CRMMutation, graphene.ObjectType):
-    pass
+    class Subscription(CRMSubscription, graphene.ObjectType):
+        pass
 
+    return graphene.Schema(
+        query=Query, mutation=Mutation, subscription=Subscription, directives=incremental.DIRECTIVES
+    )
 
-schema = graphene.Schema(query=Query, mutation=Mutation)
 
+def __getattr__(name):
+    if name == 'schema':
+        return get_schema()
+    if name in ('Query', 'Mutation', 'Subscription'):
+        return getattr(get_schema(), name.lower())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
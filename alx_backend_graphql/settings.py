@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,12 +45,15 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'crm.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'crm.middleware.PrimaryPinningMiddleware',
+    'crm.middleware.GraphQLTrafficCaptureMiddleware',
 ]
 
 ROOT_URLCONF = 'alx_backend_graphql.urls'
@@ -75,13 +79,152 @@ WSGI_APPLICATION = 'alx_backend_graphql.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# CRM_DB_PROFILE selects how SQLite connections are tuned:
+#   default    - Django's defaults (rollback journal, new connection per request)
+#   production - WAL journaling so readers don't block on writers, tuned pragmas
+#                applied on every new connection and persistent connections
+CRM_DB_PROFILE = os.environ.get('CRM_DB_PROFILE', 'default')
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',    # durable at checkpoints; safe with WAL
+    'cache_size': -64000,       # negative = KiB, i.e. 64 MB page cache
+    'mmap_size': 268435456,     # 256 MB memory-mapped I/O
+    'busy_timeout': 5000,       # ms to wait for a lock before SQLITE_BUSY
+    'temp_store': 'MEMORY',
+}
+
+DATABASE_PROFILES = {
+    'default': {},
+    'production': {
+        'OPTIONS': {
+            'init_command': '; '.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+            # Take the write lock at BEGIN so concurrent writers queue on
+            # busy_timeout instead of failing on a lock upgrade
+            'transaction_mode': 'IMMEDIATE',
+        },
+        'CONN_MAX_AGE': int(os.environ.get('CRM_DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+    },
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        **DATABASE_PROFILES[CRM_DB_PROFILE],
     }
 }
 
+# Read replicas: comma separated SQLite paths. Query operations read from the
+# replicas, mutations and anything after a write in the same request use
+# 'default'. CRM_REPLICA_REPLAY keeps local replicas in sync by replaying
+# committed writes (see crm/replication.py and `manage.py sync_replicas`).
+CRM_READ_REPLICAS = []
+for index, replica_path in enumerate(filter(None, os.environ.get('CRM_REPLICA_DATABASES', '').split(',')), 1):
+    alias = f'replica_{index}'
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': replica_path.strip(),
+        'TEST': {'MIRROR': 'default'},
+        **DATABASE_PROFILES[CRM_DB_PROFILE],
+    }
+    CRM_READ_REPLICAS.append(alias)
+
+CRM_REPLICA_REPLAY = os.environ.get('CRM_REPLICA_REPLAY', '') == '1'
+
+# Optional sharding: comma separated SQLite paths. Customers and their orders
+# are partitioned across the shards by id, products are copied to every shard
+# (see crm/sharding.py). Migrate each with `manage.py migrate --database shard_N`.
+CRM_SHARDS = []
+for index, shard_path in enumerate(filter(None, os.environ.get('CRM_SHARD_DATABASES', '').split(','))):
+    alias = f'shard_{index}'
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': shard_path.strip(),
+        **DATABASE_PROFILES[CRM_DB_PROFILE],
+    }
+    CRM_SHARDS.append(alias)
+
+# Orders older than this are moved to the archive table by
+# `manage.py archive_orders`; date-filtered allOrders queries reaching further
+# back transparently include the archive.
+CRM_ARCHIVE_AFTER_DAYS = int(os.environ.get('CRM_ARCHIVE_AFTER_DAYS', 365))
+
+# Mutations called with an idempotencyKey store their result for
+# CRM_IDEMPOTENCY_TTL_HOURS. Duplicates wait up to CRM_IDEMPOTENCY_WAIT_SECONDS
+# for a concurrent first request; unfinished claims expire after
+# CRM_IDEMPOTENCY_LOCK_SECONDS.
+CRM_IDEMPOTENCY_TTL_HOURS = int(os.environ.get('CRM_IDEMPOTENCY_TTL_HOURS', 24))
+CRM_IDEMPOTENCY_WAIT_SECONDS = 10
+CRM_IDEMPOTENCY_LOCK_SECONDS = 30
+
+# Bulk import jobs (startImportJob) run on CRM_IMPORT_WORKERS threads inside
+# each web process; set it to 0 and run `manage.py run_import_workers` to
+# process them elsewhere. Jobs whose worker stops heartbeating for
+# CRM_IMPORT_JOB_STALE_SECONDS resume from their last committed chunk.
+CRM_IMPORT_WORKERS = int(os.environ.get('CRM_IMPORT_WORKERS', 2))
+CRM_IMPORT_CHUNK_SIZE = 1000
+CRM_IMPORT_JOB_STALE_SECONDS = 60
+CRM_IMPORT_POLL_INTERVAL = 1.0
+
+# Change feed: `manage.py compact_outbox` deletes events every registered
+# consumer has acknowledged, and anything older than the retention period.
+CRM_OUTBOX_RETENTION_DAYS = int(os.environ.get('CRM_OUTBOX_RETENTION_DAYS', 7))
+CRM_OUTBOX_STREAM_MAX_SECONDS = 30
+
+# GraphQL subscriptions (WebSocket /graphql under asgi.py) are fed by this
+# publish/subscribe backend; the in-memory broker reaches one process only.
+CRM_PUBSUB_BACKEND = 'crm.pubsub.InMemoryBroker'
+
+# @stream on a root connection's edges fetches this many edges per chunk (at
+# most RELAY_CONNECTION_MAX_LIMIT) and up to CRM_STREAM_MAX_ITEMS in total.
+CRM_STREAM_CHUNK_SIZE = 100
+CRM_STREAM_MAX_ITEMS = 10000
+
+# Encoder for /graphql responses: a callable (data, pretty) -> bytes. The
+# default uses orjson when installed and json.dumps otherwise.
+CRM_JSON_ENCODER = 'crm.encoding.orjson_encode'
+
+# Build the GraphQL schema while wsgi.py/asgi.py boot instead of on the
+# first request; the schema is lazy everywhere else.
+CRM_SCHEMA_PRELOAD = os.environ.get('CRM_SCHEMA_PRELOAD', '1') == '1'
+
+# Responses of at least this many bytes are compressed (brotli when the
+# package is installed and accepted, gzip otherwise); None disables it.
+CRM_COMPRESSION_MIN_BYTES = 1024
+
+# Phone numbers entered without a leading + are national numbers in this
+# country when normalized to E.164 (Customer.phone_e164).
+CRM_PHONE_DEFAULT_COUNTRY_CODE = '1'
+
+# totalCount on the root connections: exact counts are cached for
+# CRM_COUNT_CACHE_TTL seconds (and dropped on any write they depend on) when
+# CACHES is shared by the workers; with a per-process cache (the default
+# LocMemCache) writes in other workers go unseen, so they are cached for
+# CRM_COUNT_LOCAL_CACHE_TTL seconds instead (0: counted on every request).
+# approximate: true counts tables under CRM_COUNT_APPROXIMATE_MIN_ROWS rows,
+# uses a row counter recounted every CRM_COUNT_APPROXIMATE_TTL seconds above
+# that, and estimates filtered counts from the newest CRM_COUNT_SAMPLE_SIZE rows.
+CRM_COUNT_CACHE_TTL = 300
+CRM_COUNT_LOCAL_CACHE_TTL = 0
+CRM_COUNT_APPROXIMATE_TTL = 600
+CRM_COUNT_APPROXIMATE_MIN_ROWS = 10000
+CRM_COUNT_SAMPLE_SIZE = 1000
+
+# Keep every product in an in-process catalog (crm/catalog.py) to render
+# Order.products; orders are priced from the database, never from it.
+# wsgi.py/asgi.py load it at worker start. It follows this process's writes
+# as they commit and is reloaded in full every
+# CRM_PRODUCT_CATALOG_FULL_REFRESH seconds to pick up other processes' edits.
+CRM_PRODUCT_CATALOG = os.environ.get('CRM_PRODUCT_CATALOG', '1') == '1'
+CRM_PRODUCT_CATALOG_FULL_REFRESH = 60
+
+DATABASE_ROUTERS = [
+    'crm.sharding.ShardRouter',
+    'crm.routers.PrimaryReplicaRouter',
+]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -126,5 +269,60 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Graphene settings
 GRAPHENE = {
-    'SCHEMA': 'alx_backend_graphql.schema.schema'
+    'SCHEMA': 'alx_backend_graphql.schema.schema',
+    'MIDDLEWARE': [
+        'crm.metrics.FieldMetricsMiddleware',
+    ],
+}
+
+# CRM instrumentation settings
+
+# Append every /graphql request to this JSONL file (replayed by benchmarks/replay_traffic.py)
+CRM_TRAFFIC_CAPTURE_PATH = os.environ.get('CRM_TRAFFIC_CAPTURE_PATH')
+
+# Maximum SQL queries per GraphQL operation label (operation name, or the root
+# fields of an anonymous operation). Enforced by crm.query_budget in tests and
+# logged at runtime when exceeded.
+CRM_QUERY_BUDGETS = {
+    'allCustomers': 2,
+    'allProducts': 2,
+    'allOrders': 3,
+}
+
+# Runtime logging threshold for operations without a declared budget
+CRM_QUERY_BUDGET_DEFAULT = 50
+
+# Slow operation log: operations slower than CRM_SLOW_OPERATION_MS (from a
+# CRM_SLOW_OPERATION_SAMPLE_RATE fraction of requests) are written with their
+# SQL statements and query plans. Inspect with `python manage.py slow_operations`.
+CRM_SLOW_OPERATION_MS = float(os.environ.get('CRM_SLOW_OPERATION_MS', 500))
+CRM_SLOW_OPERATION_SAMPLE_RATE = float(os.environ.get('CRM_SLOW_OPERATION_SAMPLE_RATE', 0.1))
+CRM_SLOW_OPERATION_EXPLAIN_TOP = 3
+CRM_SLOW_OPERATION_LOG = os.environ.get('CRM_SLOW_OPERATION_LOG', str(BASE_DIR / 'slow_operations.log'))
+
+# Metrics exposed at /metrics. With multiple worker processes point this at a
+# directory shared by all workers so any of them can serve the merged metrics.
+# It needs working flock() locks (a local filesystem or NFSv4).
+CRM_METRICS_MULTIPROCESS_DIR = os.environ.get('CRM_METRICS_MULTIPROCESS_DIR')
+CRM_METRICS_FLUSH_INTERVAL = 1.0
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'slow_operations': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': CRM_SLOW_OPERATION_LOG,
+            'maxBytes': 5 * 1024 * 1024,
+            'backupCount': 5,
+            'delay': True,
+        },
+    },
+    'loggers': {
+        'crm.slow_operations': {
+            'handlers': ['slow_operations'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
 }
@@ -14,3 +14,15 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_backend_graphql.settings')
 
 application = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.CRM_SCHEMA_PRELOAD:
+    # Build the schema before the worker takes traffic (and, with a
+    # preloading server, once in the parent for every forked worker)
+    from alx_backend_graphql.schema import get_schema
+    get_schema()
+
+# Load the product catalog before taking traffic (a no-op when disabled)
+from crm import catalog  # noqa: E402
+catalog.preload()
@@ -0,0 +1,5 @@
+"""
+Benchmark scripts for the CRM GraphQL API.
+
+Each module is a standalone runner, e.g. ``python -m benchmarks.schema_benchmark``.
+"""
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Benchmark the in-process product catalog (``crm/catalog.py``).
+
+Reports, for ``--products`` products:
+
+- how long a full catalog load takes and the memory it holds (its own
+  ``footprint()`` and the allocations traced while loading it), next to
+  the same products held as ``Product`` instances
+- latency of ``allOrders`` rendering every order's ``products``, with the
+  catalog enabled and with ``CRM_PRODUCT_CATALOG`` off
+
+Usage:
+    python -m benchmarks.catalog_benchmark --products 100000
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+
+from benchmarks.harness import measure, print_table, setup_django
+
+ORDER_PRODUCTS = '{ allOrders(first: 50) { edges { node { id products { edges { node { name price } } } } } } }'
+
+
+def traced(func):
+    """``(result, bytes allocated and still held)`` for ``func()``"""
+    tracemalloc.start()
+    try:
+        result = func()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--database', help='SQLite file to use (defaults to a temporary file)')
+    args = parser.parse_args(argv)
+
+    setup_django(args.database)
+    from django.test import override_settings
+
+    from alx_backend_graphql.schema import schema
+    from benchmarks.dataset import generate_dataset
+    from crm import catalog
+    from crm.models import Product
+
+    generate_dataset(customers=500, products=args.products, orders=2000)
+
+    start = time.perf_counter()
+    loaded = catalog.ProductCatalog.load(catalog.database(), version=0)
+    load_ms = (time.perf_counter() - start) * 1000
+    del loaded
+    loaded, catalog_bytes = traced(lambda: catalog.ProductCatalog.load(catalog.database(), version=0))
+    instances, instance_bytes = traced(lambda: list(Product.objects.order_by('id')))
+    footprint = loaded.footprint()
+
+    print(f"{len(loaded)} products, full load {load_ms:.0f} ms")
+    print(f"{'structure':<24} {'MiB':>8}")
+    print('-' * 33)
+    for name, size in footprint.items():
+        print(f"{'catalog ' + name:<24} {size / 2 ** 20:>8.2f}")
+    print(f"{'catalog (traced)':<24} {catalog_bytes / 2 ** 20:>8.2f}")
+    print(f"{'Product instances':<24} {instance_bytes / 2 ** 20:>8.2f}")
+    print()
+    del loaded, instances
+
+    def order_products(i):
+        result = schema.execute(ORDER_PRODUCTS)
+        assert not result.errors, result.errors
+
+    results = {}
+    for enabled in (False, True):
+        label = 'catalog' if enabled else 'database'
+        with override_settings(CRM_PRODUCT_CATALOG=enabled):
+            catalog.reset()
+            catalog.get_catalog()
+            results[f'order products ({label})'] = measure(order_products, max(1, args.iterations // 10))
+    print_table(results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
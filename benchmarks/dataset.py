@@ -0,0 +1,88 @@
+"""
+Synthetic CRM datasets of configurable size for benchmarking.
+"""
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+FIRST_NAMES = ['Alice', 'Bob', 'Carol', 'David', 'Eve', 'Frank', 'Grace', 'Heidi', 'Ivan', 'Judy']
+LAST_NAMES = ['Johnson', 'Smith', 'Williams', 'Brown', 'Davis', 'Miller', 'Wilson', 'Moore']
+PRODUCT_NAMES = ['Laptop', 'Mouse', 'Keyboard', 'Monitor', 'Headphones', 'Webcam', 'USB Cable', 'External SSD']
+
+
+def generate_dataset(customers=1000, products=200, orders=5000, max_products_per_order=5,
+                     history_days=730, seed=42, batch_size=1000):
+    """Populate the database with customers, products and orders.
+
+    Order dates are spread over the last ``history_days`` days so date range
+    filters and the ``-order_date`` ordering behave like real data.
+    """
+    from crm.models import Customer, Product, Order, OrderLine
+    from crm.phones import to_e164
+
+    rng = random.Random(seed)
+    now = timezone.now()
+
+    with transaction.atomic():
+        customer_rows = []
+        for i in range(customers):
+            first = rng.choice(FIRST_NAMES)
+            last = rng.choice(LAST_NAMES)
+            if i % 3 == 0:
+                phone = f"+1{rng.randint(100000000, 999999999)}"
+            elif i % 3 == 1:
+                phone = f"{rng.randint(200, 999)}-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}"
+            else:
+                phone = ''
+            customer_rows.append(Customer(
+                name=f"{first} {last}",
+                email=f"{first.lower()}.{last.lower()}.{i}@example.com",
+                phone=phone,
+                phone_e164=to_e164(phone),
+            ))
+        Customer.objects.bulk_create(customer_rows, batch_size=batch_size)
+
+        product_rows = [
+            Product(
+                name=f"{rng.choice(PRODUCT_NAMES)} {i}",
+                price=Decimal(rng.randint(100, 200000)) / 100,
+                stock=rng.randint(0, 120),
+            )
+            for i in range(products)
+        ]
+        Product.objects.bulk_create(product_rows, batch_size=batch_size)
+
+        customer_ids = list(Customer.objects.values_list('id', flat=True))
+        catalog = list(Product.objects.values_list('id', 'price'))
+
+        order_rows = []
+        order_lines = []
+        for i in range(orders):
+            chosen = rng.sample(catalog, rng.randint(1, min(max_products_per_order, len(catalog))))
+            lines = [(product_id, rng.randint(1, 3), price) for product_id, price in chosen]
+            order_rows.append(Order(
+                customer_id=rng.choice(customer_ids),
+                total_amount=sum((price * quantity for _, quantity, price in lines), Decimal('0.00')),
+            ))
+            order_lines.append(lines)
+        Order.objects.bulk_create(order_rows, batch_size=batch_size)
+
+        # auto_now_add stamps every row with "now"; spread the dates afterwards
+        created = [order.pk for order in order_rows]
+        dated = []
+        for order_id in created:
+            order = Order(id=order_id)
+            order.order_date = now - timedelta(minutes=rng.randint(0, history_days * 24 * 60))
+            dated.append(order)
+        Order.objects.bulk_update(dated, ['order_date'], batch_size=batch_size)
+
+        OrderLine.objects.bulk_create([
+            OrderLine(order_id=order_id, product_id=product_id, quantity=quantity, unit_price=price)
+            for order_id, lines in zip(created, order_lines)
+            for product_id, quantity, price in lines
+        ], batch_size=batch_size)
+
+    return {'customers': customers, 'products': products, 'orders': orders}
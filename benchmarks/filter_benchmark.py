@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+Benchmark the per-request cost of the connection filters.
+
+Two stages, each measured with the FilterSet plan cache
+(``crm.filters.FilterPlanMixin``) and with it bypassed, which is what every
+request paid before:
+
+- ``filterset``: build the FilterSet for a ``test_filters.py``-style set of
+  arguments, validate it and compile the filtered queryset to SQL, without
+  running it; this is the overhead the plan cache targets
+- ``execute``: the matching ``allCustomers``/``allProducts``/``allOrders``
+  query from ``schema_benchmark`` end to end, database included
+
+Usage:
+    python -m benchmarks.filter_benchmark --iterations 2000
+"""
+import argparse
+import sys
+import time
+from contextlib import contextmanager
+
+from benchmarks.harness import percentile, setup_django
+
+# (FilterSet, arguments as graphene-django passes them, schema_benchmark query)
+CASES = {
+    'customers_by_name': ('CustomerFilter', {'name': "Ali"}, 'customers_by_name'),
+    'customers_phone_pattern': ('CustomerFilter', {'phone_pattern': "+1"}, 'customers_phone_pattern'),
+    'products_by_price_range': ('ProductFilter', {'price__gte': 50, 'price__lte': 1000}, 'products_by_price_range'),
+    'products_low_stock': ('ProductFilter', {'low_stock': True}, 'products_low_stock'),
+    'orders_by_customer_name': ('OrderFilter', {'customer_name': "Alice"}, 'orders_by_customer_name'),
+    'orders_by_total_range': ('OrderFilter', {'total_amount__gte': 100, 'total_amount__lte': 500},
+                              'orders_by_total_range'),
+    'orders_by_product_name': ('OrderFilter', {'product_name': "Laptop"}, 'orders_by_product_name'),
+}
+
+
+@contextmanager
+def plans_disabled():
+    from crm.filters import FilterPlanMixin
+
+    get_plan = FilterPlanMixin.__dict__['get_plan']
+    FilterPlanMixin.get_plan = classmethod(lambda cls, names: None)
+    try:
+        yield
+    finally:
+        FilterPlanMixin.get_plan = get_plan
+
+
+def time_us(func, iterations):
+    for _ in range(min(iterations, 50)):
+        func()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1_000_000)
+    return percentile(samples, 50), percentile(samples, 90)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--database', help='SQLite file to use (defaults to a temporary file)')
+    args = parser.parse_args(argv)
+
+    setup_django(args.database)
+    from alx_backend_graphql.schema import schema
+    from benchmarks.dataset import generate_dataset
+    from benchmarks.schema_benchmark import CONNECTION_QUERIES
+    from crm import filters
+
+    generate_dataset(customers=500, products=100, orders=2000)
+
+    def filterset_stage(filterset_class, data):
+        def run():
+            filterset = filterset_class(data=data, queryset=filterset_class._meta.model.objects.all())
+            assert filterset.is_valid(), filterset.errors
+            str(filterset.qs.query)
+        return run
+
+    def execute_stage(query):
+        def run():
+            result = schema.execute(query)
+            assert not result.errors, result.errors
+        return run
+
+    header = f"{'case':<26} {'stage':<10} {'before p50 us':>14} {'after p50 us':>13} {'after p90 us':>13} {'saved':>7}"
+    print(header)
+    print('-' * len(header))
+    for name, (filterset_name, data, query_name) in CASES.items():
+        filterset_class = getattr(filters, filterset_name)
+        stages = {
+            'filterset': filterset_stage(filterset_class, data),
+            'execute': execute_stage(CONNECTION_QUERIES[query_name]),
+        }
+        for stage, func in stages.items():
+            iterations = args.iterations if stage == 'filterset' else max(1, args.iterations // 10)
+            with plans_disabled():
+                before, _ = time_us(func, iterations)
+            after, after_p90 = time_us(func, iterations)
+            print(f"{name:<26} {stage:<10} {before:>14.1f} {after:>13.1f} {after_p90:>13.1f} "
+                  f"{1 - after / before:>7.0%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""
+Shared helpers for the benchmark runners: Django setup against a scratch
+database and latency/query-count measurement.
+"""
+import atexit
+import os
+import statistics
+import tempfile
+import time
+
+import django
+
+
+def setup_django(database_path=None, migrate=True):
+    """Configure Django against a scratch SQLite file and apply migrations.
+
+    Benchmarks never touch the project's ``db.sqlite3``; when no path is
+    given a fresh file is created in the temp directory.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_backend_graphql.settings')
+    from django.conf import settings
+
+    if database_path is None:
+        handle, database_path = tempfile.mkstemp(prefix='crm-bench-', suffix='.sqlite3')
+        os.close(handle)
+        atexit.register(_remove_quietly, database_path)
+    settings.DATABASES['default']['NAME'] = str(database_path)
+    django.setup()
+
+    if migrate:
+        from django.core.management import call_command
+        call_command('migrate', verbosity=0)
+    return database_path
+
+
+def _remove_quietly(path):
+    for suffix in ('', '-wal', '-shm'):
+        try:
+            os.remove(f"{path}{suffix}")
+        except OSError:
+            pass
+
+
+def percentile(values, pct):
+    """Return the ``pct`` percentile of ``values`` using nearest-rank"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def summarize(samples_ms, query_counts):
+    """Collapse raw samples into the latency distribution we report"""
+    return {
+        'iterations': len(samples_ms),
+        'min_ms': round(min(samples_ms), 3),
+        'mean_ms': round(statistics.fmean(samples_ms), 3),
+        'p50_ms': round(percentile(samples_ms, 50), 3),
+        'p90_ms': round(percentile(samples_ms, 90), 3),
+        'p99_ms': round(percentile(samples_ms, 99), 3),
+        'max_ms': round(max(samples_ms), 3),
+        'queries': max(query_counts) if query_counts else 0,
+    }
+
+
+def measure(func, iterations=50, warmup=5):
+    """Run ``func(i)`` repeatedly, recording wall time and SQL query count"""
+    from django.db import connection
+
+    executed = []
+
+    def count_queries(execute, sql, params, many, context):
+        executed.append(sql)
+        return execute(sql, params, many, context)
+
+    for i in range(warmup):
+        func(i)
+
+    samples_ms = []
+    query_counts = []
+    with connection.execute_wrapper(count_queries):
+        for i in range(warmup, warmup + iterations):
+            executed.clear()
+            start = time.perf_counter()
+            func(i)
+            samples_ms.append((time.perf_counter() - start) * 1000)
+            query_counts.append(len(executed))
+    return summarize(samples_ms, query_counts)
+
+
+def print_table(results):
+    """Print benchmark results as an aligned table"""
+    header = f"{'scenario':<32} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9} {'queries':>8}"
+    print(header)
+    print('-' * len(header))
+    for name, stats in results.items():
+        print(
+            f"{name:<32} {stats['p50_ms']:>9.2f} {stats['p90_ms']:>9.2f} "
+            f"{stats['p99_ms']:>9.2f} {stats['max_ms']:>9.2f} {stats['queries']:>8}"
+        )
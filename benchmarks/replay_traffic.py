@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+"""
+Replay recorded GraphQL traffic and report throughput and latency.
+
+Reads JSONL written by ``crm.middleware.GraphQLTrafficCaptureMiddleware``
+(one object per line with ``query``, ``variables``, ``operationName`` and
+``timestamp``) and replays it in-process through the Django test client or
+over HTTP against a running server.
+
+Usage:
+    python -m benchmarks.replay_traffic traffic.jsonl --concurrency 8
+    python -m benchmarks.replay_traffic traffic.jsonl --speed 2 --url http://localhost:8000/graphql
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from benchmarks.harness import percentile
+
+
+def parse_timestamp(value):
+    """Accept epoch seconds or ISO 8601 strings"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        return None
+
+
+def load_operations(path):
+    """Read recorded operations, skipping lines that are not GraphQL requests"""
+    operations = []
+    skipped = 0
+    with open(path, encoding='utf-8') as source:
+        for line in source:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                skipped += 1
+                continue
+            if not isinstance(record, dict) or not record.get('query'):
+                skipped += 1
+                continue
+            operations.append({
+                'query': record['query'],
+                'variables': record.get('variables'),
+                'operationName': record.get('operationName'),
+                'timestamp': parse_timestamp(record.get('timestamp')),
+            })
+
+    if operations and all(op['timestamp'] is not None for op in operations):
+        operations.sort(key=lambda op: op['timestamp'])
+    return operations, skipped
+
+
+class InProcessTransport:
+    """Send operations through the full Django stack with the test client"""
+
+    def __init__(self, path='/graphql'):
+        from django.test import Client
+        self.path = path
+        self.local = threading.local()
+        self.client_class = Client
+
+    def __call__(self, body):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.client_class(HTTP_HOST='localhost')
+        response = client.post(self.path, data=body, content_type='application/json')
+        return response.status_code, response.content
+
+    def close(self):
+        from django.db import connections
+        connections.close_all()
+
+
+class HttpTransport:
+    """POST operations to a running server"""
+
+    def __init__(self, url, timeout=30):
+        self.url = url
+        self.timeout = timeout
+
+    def __call__(self, body):
+        request = urllib.request.Request(
+            self.url, data=body.encode('utf-8'), headers={'Content-Type': 'application/json'}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def close(self):
+        pass
+
+
+def replay(operations, transport, concurrency=4, speed=0.0):
+    """Replay ``operations`` and return per-operation samples.
+
+    ``speed`` scales the recorded inter-arrival times (2 = twice as fast);
+    0 sends every operation as fast as the worker pool allows.
+    """
+    from crm.instrumentation import operation_label
+
+    samples = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+
+    def send(operation):
+        label = operation_label(operation['query'], operation['operationName'])
+        body = json.dumps({
+            'query': operation['query'],
+            'variables': operation['variables'],
+            'operationName': operation['operationName'],
+        })
+        start = time.perf_counter()
+        try:
+            status, content = transport(body)
+            failed = status >= 400 or b'"errors"' in content
+        except Exception:
+            failed = True
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            samples[label].append(elapsed)
+            if failed:
+                errors[label] += 1
+
+    first_ts = operations[0]['timestamp'] if operations else None
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for operation in operations:
+            if speed and first_ts is not None and operation['timestamp'] is not None:
+                due = (operation['timestamp'] - first_ts) / speed
+                delay = due - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(send, operation)
+    transport.close()
+    return samples, errors, time.perf_counter() - started
+
+
+def print_report(samples, errors, elapsed):
+    total = sum(len(values) for values in samples.values())
+    failed = sum(errors.values())
+    print(f"Replayed {total} operations in {elapsed:.2f}s "
+          f"({total / elapsed if elapsed else 0:.1f} ops/s), error rate {failed / total if total else 0:.1%}\n")
+
+    header = f"{'operation':<36} {'count':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'errors':>8}"
+    print(header)
+    print('-' * len(header))
+    for label in sorted(samples, key=lambda name: -len(samples[name])):
+        values = samples[label]
+        print(
+            f"{label[:36]:<36} {len(values):>7} {percentile(values, 50):>9.2f} "
+            f"{percentile(values, 90):>9.2f} {percentile(values, 99):>9.2f} "
+            f"{errors[label] / len(values):>8.1%}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', nargs='?', default='traffic.jsonl', help='Recorded traffic (JSONL)')
+    parser.add_argument('--url', help='Replay over HTTP against this endpoint instead of in-process')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--speed', type=float, default=0.0,
+                        help='Time-scaling of recorded arrival times; 0 replays as fast as possible')
+    parser.add_argument('--repeat', type=int, default=1, help='Replay the recording this many times')
+    parser.add_argument('--database', help='SQLite file for in-process replay (defaults to the configured one)')
+    args = parser.parse_args(argv)
+
+    operations, skipped = load_operations(args.path)
+    if skipped:
+        print(f"Skipped {skipped} lines without a GraphQL query")
+    if not operations:
+        print(f"No operations found in {args.path}")
+        return 1
+
+    if args.url:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_backend_graphql.settings')
+        transport = HttpTransport(args.url)
+    else:
+        from benchmarks.harness import setup_django
+        if args.database:
+            setup_django(args.database, migrate=False)
+        else:
+            os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_backend_graphql.settings')
+            import django
+            django.setup()
+        transport = InProcessTransport()
+
+    if args.repeat > 1 and operations[0]['timestamp'] is not None:
+        span = operations[-1]['timestamp'] - operations[0]['timestamp'] + 1
+        operations = [
+            dict(op, timestamp=op['timestamp'] + span * round_)
+            for round_ in range(args.repeat)
+            for op in operations
+        ]
+    else:
+        operations = operations * args.repeat
+
+    samples, errors, elapsed = replay(operations, transport, args.concurrency, args.speed)
+    print_report(samples, errors, elapsed)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+"""
+Benchmark the GraphQL schema hot paths against a generated dataset.
+
+Covers the connection and filter queries from ``test_connection_fields.py`` /
+``test_filters.py``, the mutations from ``test_all_mutations.py``, nested
+relation queries and deep pagination. Results are compared against a stored
+baseline and the runner exits non-zero on a regression.
+
+Usage:
+    python -m benchmarks.schema_benchmark --customers 2000 --orders 10000
+    python -m benchmarks.schema_benchmark --save-baseline
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from benchmarks.harness import measure, print_table, setup_django
+
+BASELINE_PATH = Path(__file__).resolve().parent / 'baseline.json'
+
+CONNECTION_QUERIES = {
+    'customers_by_name': '''
+        query { allCustomers(name: "Ali", first: 50) { edges { node { id name email createdAt } } } }
+    ''',
+    'products_by_price_range': '''
+        query {
+            allProducts(price_Gte: "50.0", price_Lte: "1000.0", first: 50) {
+                edges { node { id name price stock } }
+            }
+        }
+    ''',
+    'products_low_stock': '''
+        query { allProducts(lowStock: true, first: 50) { edges { node { id name stock } } } }
+    ''',
+    'customers_phone_pattern': '''
+        query { allCustomers(phonePattern: "+1", first: 50) { edges { node { id name phone } } } }
+    ''',
+    'orders_by_customer_name': '''
+        query {
+            allOrders(customerName: "Alice", first: 50) {
+                edges { node { id totalAmount orderDate customer { name } } }
+            }
+        }
+    ''',
+    'orders_by_total_range': '''
+        query {
+            allOrders(totalAmount_Gte: "100.0", totalAmount_Lte: "500.0", first: 50) {
+                edges { node { id totalAmount customer { name } } }
+            }
+        }
+    ''',
+    'orders_by_product_name': '''
+        query {
+            allOrders(productName: "Laptop", first: 50) {
+                edges { node { id totalAmount products { edges { node { name } } } } }
+            }
+        }
+    ''',
+}
+
+NESTED_QUERIES = {
+    'orders_nested_relations': '''
+        query {
+            allOrders(first: 50) {
+                edges {
+                    node {
+                        id
+                        totalAmount
+                        orderDate
+                        customer { id name email }
+                        products { edges { node { id name price } } }
+                    }
+                }
+            }
+        }
+    ''',
+    'customers_with_orders': '''
+        query {
+            allCustomers(first: 20) {
+                edges {
+                    node {
+                        id
+                        name
+                        orders(first: 5) { edges { node { id totalAmount } } }
+                    }
+                }
+            }
+        }
+    ''',
+}
+
+DEEP_PAGINATION_QUERY = '''
+    query DeepPage($offset: Int!) {
+        allOrders(first: 20, offset: $offset) {
+            edges { cursor node { id totalAmount orderDate } }
+            pageInfo { hasNextPage endCursor }
+        }
+    }
+'''
+
+CREATE_CUSTOMER = '''
+    mutation CreateCustomer($email: String!) {
+        createCustomer(input: {name: "Bench Customer", email: $email, phone: "+1234567890"}) {
+            customer { id } success message
+        }
+    }
+'''
+
+BULK_CREATE_CUSTOMERS = '''
+    mutation BulkCreate($input: [CustomerInput]!) {
+        bulkCreateCustomers(input: $input) { customers { id } errors { email message } success }
+    }
+'''
+
+CREATE_PRODUCT = '''
+    mutation { createProduct(input: {name: "Bench Product", price: "19.99", stock: 5}) { product { id } success } }
+'''
+
+CREATE_ORDER = '''
+    mutation CreateOrder($customerId: ID!, $productIds: [ID]!) {
+        createOrder(input: {customerId: $customerId, productIds: $productIds}) {
+            order { id totalAmount } success message
+        }
+    }
+'''
+
+
+def build_scenarios(schema, sizes):
+    """Return a mapping of scenario name to a callable taking the iteration index"""
+    from crm.models import Customer, Product
+
+    def run(query, variables=None):
+        result = schema.execute(query, variable_values=variables)
+        if result.errors:
+            raise RuntimeError(f"Benchmark query failed: {result.errors}")
+        return result
+
+    scenarios = {}
+    for name, query in {**CONNECTION_QUERIES, **NESTED_QUERIES}.items():
+        scenarios[name] = lambda i, query=query: run(query)
+
+    deep_offset = max(0, int(sizes['orders'] * 0.9))
+    scenarios['orders_deep_pagination'] = lambda i: run(DEEP_PAGINATION_QUERY, {'offset': deep_offset})
+
+    customer_id = str(Customer.objects.order_by('id').values_list('id', flat=True).first())
+    product_ids = [str(pk) for pk in Product.objects.order_by('id').values_list('id', flat=True)[:3]]
+
+    scenarios['mutation_create_customer'] = lambda i: run(
+        CREATE_CUSTOMER, {'email': f"bench.single.{i}@example.com"}
+    )
+    scenarios['mutation_bulk_create_customers'] = lambda i: run(BULK_CREATE_CUSTOMERS, {'input': [
+        {'name': 'Bench Bulk', 'email': f"bench.bulk.{i}.{j}@example.com", 'phone': '123-456-7890'}
+        for j in range(10)
+    ]})
+    scenarios['mutation_create_product'] = lambda i: run(CREATE_PRODUCT)
+    scenarios['mutation_create_order'] = lambda i: run(
+        CREATE_ORDER, {'customerId': customer_id, 'productIds': product_ids}
+    )
+    return scenarios
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Return a list of human readable regressions versus ``baseline``"""
+    regressions = []
+    for name, stats in results.items():
+        expected = baseline.get('scenarios', {}).get(name)
+        if not expected:
+            continue
+        if stats['queries'] > expected['queries']:
+            regressions.append(
+                f"{name}: {stats['queries']} SQL queries (baseline {expected['queries']})"
+            )
+        limit = expected['p50_ms'] * (1 + tolerance)
+        if stats['p50_ms'] > limit:
+            regressions.append(
+                f"{name}: p50 {stats['p50_ms']:.2f}ms exceeds baseline "
+                f"{expected['p50_ms']:.2f}ms by more than {tolerance:.0%}"
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--customers', type=int, default=1000)
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--only', help='Comma separated scenario names to run')
+    parser.add_argument('--database', help='SQLite file to use (defaults to a temporary file)')
+    parser.add_argument('--baseline', default=str(BASELINE_PATH))
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='Allowed p50 slowdown versus baseline (0.5 = 50%%)')
+    parser.add_argument('--save-baseline', action='store_true', help='Write results as the new baseline')
+    parser.add_argument('--output', help='Also write raw results as JSON to this path')
+    args = parser.parse_args(argv)
+
+    setup_django(args.database)
+
+    from benchmarks.dataset import generate_dataset
+    from alx_backend_graphql.schema import schema
+
+    sizes = generate_dataset(customers=args.customers, products=args.products, orders=args.orders)
+    print(f"Dataset: {sizes['customers']} customers, {sizes['products']} products, {sizes['orders']} orders\n")
+
+    scenarios = build_scenarios(schema, sizes)
+    if args.only:
+        wanted = set(args.only.split(','))
+        scenarios = {name: func for name, func in scenarios.items() if name in wanted}
+
+    results = {
+        name: measure(func, iterations=args.iterations, warmup=args.warmup)
+        for name, func in scenarios.items()
+    }
+    print_table(results)
+
+    report = {'dataset': sizes, 'scenarios': results}
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        Path(args.baseline).write_text(json.dumps(report, indent=2) + '\n')
+        print(f"\nBaseline written to {args.baseline}")
+        return 0
+
+    baseline_path = Path(args.baseline)
+    if not baseline_path.exists():
+        print("\nNo baseline found; run with --save-baseline to create one.")
+        return 0
+
+    baseline = json.loads(baseline_path.read_text())
+    if baseline.get('dataset') != sizes:
+        print(f"\nBaseline was recorded with dataset {baseline.get('dataset')}; skipping comparison.")
+        return 0
+
+    regressions = compare_to_baseline(results, baseline, args.tolerance)
+    if regressions:
+        print("\n❌ Regressions versus baseline:")
+        for line in regressions:
+            print(f"  - {line}")
+        return 1
+
+    print("\n✅ No regressions versus baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
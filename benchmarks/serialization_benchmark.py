@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Benchmark the cost of turning a GraphQL result into response bytes.
+
+Executes ``allOrders`` pages until ``--edges`` edges are collected (orders
+with their customer and products, so ``Decimal`` and ``DateTime`` scalars
+dominate), then times encoding the response per 1,000 edges with every
+encoder in ``crm.encoding``. The stdlib row is what ``GraphQLView`` did
+before ``CRM_JSON_ENCODER``.
+
+Usage:
+    python -m benchmarks.serialization_benchmark --edges 1000 --iterations 50
+"""
+import argparse
+import sys
+import time
+
+from benchmarks.harness import percentile, setup_django
+
+PAGE_QUERY = '''
+    query Page($first: Int!, $offset: Int!) {
+        allOrders(first: $first, offset: $offset) {
+            edges {
+                cursor
+                node {
+                    id totalAmount orderDate
+                    customer { id name email createdAt }
+                    products { edges { node { id name price stock } } }
+                }
+            }
+        }
+    }
+'''
+
+
+def collect_result(schema, edges, page_size=100):
+    """Return one ExecutionResult holding ``edges`` edges, built from pages"""
+    result = None
+    for offset in range(0, edges, page_size):
+        page = schema.execute(PAGE_QUERY, variable_values={
+            'first': min(page_size, edges - offset), 'offset': offset,
+        })
+        if page.errors:
+            raise RuntimeError(f"Benchmark query failed: {page.errors}")
+        if result is None:
+            result = page
+        else:
+            result.data['allOrders']['edges'].extend(page.data['allOrders']['edges'])
+    return result
+
+
+def time_per_thousand(func, edges, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000 * 1000 / edges)
+    return percentile(samples, 50), percentile(samples, 90)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--edges', type=int, default=1000)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--database', help='SQLite file to use (defaults to a temporary file)')
+    args = parser.parse_args(argv)
+
+    setup_django(args.database)
+    from alx_backend_graphql.schema import schema
+    from benchmarks.dataset import generate_dataset
+    from crm import encoding
+
+    generate_dataset(customers=200, products=100, orders=args.edges)
+    result = collect_result(schema, args.edges)
+    edges = len(result.data['allOrders']['edges'])
+    data = result.formatted
+
+    stages = {'stdlib json (before)': lambda: encoding.stdlib_encode(data)}
+    if encoding.orjson is not None:
+        stages['orjson'] = lambda: encoding.orjson_encode(data)
+    else:
+        print("orjson is not installed; only the stdlib encoder is measured\n")
+
+    print(f"{edges} edges, {len(encoding.stdlib_encode(data)) / 1024:.0f} KiB of JSON\n")
+    header = f"{'stage':<28} {'p50 ms/1k edges':>16} {'p90 ms/1k edges':>16}"
+    print(header)
+    print('-' * len(header))
+    for name, func in stages.items():
+        func()
+        p50, p90 = time_per_thousand(func, edges, args.iterations)
+        print(f"{name:<28} {p50:>16.3f} {p90:>16.3f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
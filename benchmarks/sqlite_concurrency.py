@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+Concurrent read/write benchmark for the SQLite database profiles.
+
+Reader threads run nested ``allOrders`` queries while a writer thread runs
+``createOrder`` mutations. Each profile (see ``CRM_DB_PROFILE`` in settings)
+runs in its own subprocess against a fresh database file, and the results
+are compared side by side.
+
+Usage:
+    python -m benchmarks.sqlite_concurrency --readers 8 --duration 10
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from benchmarks.harness import percentile, setup_django
+
+READ_QUERY = '''
+    query {
+        allOrders(first: 50) {
+            edges { node { id totalAmount orderDate customer { name email } } }
+        }
+    }
+'''
+
+WRITE_MUTATION = '''
+    mutation CreateOrder($customerId: ID!, $productIds: [ID]!) {
+        createOrder(input: {customerId: $customerId, productIds: $productIds}) { success message }
+    }
+'''
+
+
+def run_workload(readers, duration, write_interval):
+    """Run the mixed workload and return latency samples and error counts"""
+    from django.db import connection
+    from alx_backend_graphql.schema import schema
+    from crm.models import Customer, Product
+
+    customer_id = str(Customer.objects.values_list('id', flat=True).first())
+    product_ids = [str(pk) for pk in Product.objects.values_list('id', flat=True)[:3]]
+    connection.close()
+
+    stop = threading.Event()
+    lock = threading.Lock()
+    stats = {'read_ms': [], 'write_ms': [], 'read_errors': 0, 'write_errors': 0}
+
+    def worker(kind):
+        from django.db import connection as thread_connection
+        try:
+            while not stop.is_set():
+                start = time.perf_counter()
+                if kind == 'read':
+                    result = schema.execute(READ_QUERY)
+                    failed = bool(result.errors)
+                else:
+                    result = schema.execute(WRITE_MUTATION, variable_values={
+                        'customerId': customer_id, 'productIds': product_ids,
+                    })
+                    failed = bool(result.errors) or not result.data['createOrder']['success']
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    stats[f'{kind}_ms'].append(elapsed)
+                    if failed:
+                        stats[f'{kind}_errors'] += 1
+                if kind == 'write' and write_interval:
+                    time.sleep(write_interval)
+        finally:
+            thread_connection.close()
+
+    threads = [threading.Thread(target=worker, args=('read',)) for _ in range(readers)]
+    threads.append(threading.Thread(target=worker, args=('write',)))
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return stats
+
+
+def child(args):
+    setup_django()
+    from benchmarks.dataset import generate_dataset
+    generate_dataset(customers=args.customers, products=args.products, orders=args.orders)
+
+    stats = run_workload(args.readers, args.duration, args.write_interval)
+    report = {'profile': os.environ.get('CRM_DB_PROFILE', 'default')}
+    for kind in ('read', 'write'):
+        samples = stats[f'{kind}_ms']
+        report[kind] = {
+            'ops': len(samples),
+            'ops_per_sec': round(len(samples) / args.duration, 1),
+            'p50_ms': round(percentile(samples, 50), 2),
+            'p99_ms': round(percentile(samples, 99), 2),
+            'errors': stats[f'{kind}_errors'],
+        }
+    print(json.dumps(report))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', default='default,production')
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds per profile')
+    parser.add_argument('--write-interval', type=float, default=0.0, help='Pause between writes (seconds)')
+    parser.add_argument('--customers', type=int, default=1000)
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(args)
+        return 0
+
+    passthrough = [
+        '--readers', str(args.readers), '--duration', str(args.duration),
+        '--write-interval', str(args.write_interval), '--customers', str(args.customers),
+        '--products', str(args.products), '--orders', str(args.orders),
+    ]
+    reports = []
+    for profile in args.profiles.split(','):
+        env = dict(os.environ, CRM_DB_PROFILE=profile)
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.sqlite_concurrency', '--child', *passthrough],
+            env=env, check=True, capture_output=True, text=True,
+        ).stdout
+        reports.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{args.readers} reader threads + 1 writer, {args.duration:.0f}s per profile\n")
+    header = (f"{'profile':<12} {'reads/s':>9} {'read p50':>9} {'read p99':>9} {'read err':>9} "
+              f"{'writes/s':>9} {'write p50':>10} {'write p99':>10} {'write err':>10}")
+    print(header)
+    print('-' * len(header))
+    for report in reports:
+        read, write = report['read'], report['write']
+        print(
+            f"{report['profile']:<12} {read['ops_per_sec']:>9.1f} {read['p50_ms']:>9.2f} "
+            f"{read['p99_ms']:>9.2f} {read['errors']:>9} {write['ops_per_sec']:>9.1f} "
+            f"{write['p50_ms']:>10.2f} {write['p99_ms']:>10.2f} {write['errors']:>10}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
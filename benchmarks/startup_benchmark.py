@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Measure worker cold start: from a fresh interpreter to the first served
+``/graphql`` request.
+
+Each run is a new subprocess (nothing is shared between runs, like a newly
+scaled-out worker) that records:
+
+- ``boot``: interpreter start to ``alx_backend_graphql.wsgi`` being imported
+  (includes building the schema when ``CRM_SCHEMA_PRELOAD`` is on)
+- ``first request``: the first ``allOrders`` request through the WSGI stack
+  (includes building the schema when it was not preloaded)
+- ``second request``: the same request again, for reference
+- ``total``: interpreter start to the end of the first request
+
+Compare ``CRM_SCHEMA_PRELOAD=0`` and ``=1`` to see where the schema cost lands.
+
+Usage:
+    python -m benchmarks.startup_benchmark --runs 10
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.harness import setup_django
+
+QUERY = '{ allOrders(first: 20) { edges { node { id totalAmount customer { name } } } } }'
+
+
+def child(database, started):
+    from io import BytesIO
+
+    setup_django(database, migrate=False)
+    from alx_backend_graphql.wsgi import application
+    boot = time.time() - started
+
+    body = json.dumps({'query': QUERY}).encode('utf-8')
+
+    def request():
+        environ = {
+            'REQUEST_METHOD': 'POST', 'PATH_INFO': '/graphql', 'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80', 'HTTP_HOST': 'localhost', 'wsgi.url_scheme': 'http',
+            'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': BytesIO(body), 'wsgi.errors': sys.stderr,
+        }
+        statuses = []
+        start = time.perf_counter()
+        b''.join(application(environ, lambda status, headers: statuses.append(status)))
+        if not statuses[0].startswith('200'):
+            raise RuntimeError(f"Request failed: {statuses[0]}")
+        return time.perf_counter() - start
+
+    first = request()
+    second = request()
+    print(json.dumps({
+        'boot': boot, 'first request': first, 'second request': second,
+        'total': boot + first,
+    }))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--child', nargs=2, metavar=('DATABASE', 'STARTED'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(args.child[0], float(args.child[1]))
+        return 0
+
+    database = setup_django()
+    from benchmarks.dataset import generate_dataset
+    generate_dataset(customers=100, products=50, orders=500)
+
+    samples = []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.startup_benchmark', '--child', database, repr(time.time())],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    header = f"{'phase':<16} {'median ms':>10} {'min ms':>10} {'max ms':>10}"
+    print(header)
+    print('-' * len(header))
+    for phase in ('boot', 'first request', 'second request', 'total'):
+        values = [sample[phase] * 1000 for sample in samples]
+        print(f"{phase:<16} {statistics.median(values):>10.1f} {min(values):>10.1f} {max(values):>10.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
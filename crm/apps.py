@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class CrmConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'crm'
+
+    def ready(self):
+        from django.conf import settings
+
+        from . import catalog, counting, pubsub
+        catalog.connect()
+        counting.connect()
+        pubsub.connect()
+
+        if getattr(settings, 'CRM_REPLICA_REPLAY', False):
+            from . import replication
+            replication.install()
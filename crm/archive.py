@@ -0,0 +1,80 @@
+"""
+Hot/cold archival of old orders.
+
+``archive_orders`` moves orders older than a cutoff, together with their
+line items, from ``Order`` into ``ArchivedOrder`` in small batches.
+``OrderFilter`` only adds the archive to a query when its ``order_date``
+bounds reach back before the archive boundary.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import counting
+from .models import ArchivedOrder, ArchivedOrderLine, Order, OrderLine
+
+WATERMARK_CACHE_KEY = 'crm:archive:watermark:{}'
+WATERMARK_CACHE_TTL = 60
+
+
+def archive_cutoff():
+    """Orders placed before this moment are eligible for archival"""
+    return timezone.now() - timedelta(days=settings.CRM_ARCHIVE_AFTER_DAYS)
+
+
+def archive_watermark(using='default'):
+    """Newest archived ``order_date`` on ``using`` (cached), or None"""
+    key = WATERMARK_CACHE_KEY.format(using)
+    watermark = cache.get(key)
+    if watermark is None:
+        watermark = ArchivedOrder.objects.using(using).aggregate(top=Max('order_date'))['top'] or False
+        cache.set(key, watermark, WATERMARK_CACHE_TTL)
+    return watermark or None
+
+
+def archive_boundary(using='default'):
+    """Any date filter at or before this point may match archived orders.
+
+    The configured cutoff keeps this correct without a query even while the
+    cached watermark is stale; the watermark covers archives run with an
+    explicit, more recent cutoff.
+    """
+    boundary = archive_cutoff()
+    watermark = archive_watermark(using)
+    if watermark is not None and watermark > boundary:
+        return watermark
+    return boundary
+
+
+def archive_batch(cutoff, batch_size=500, using='default'):
+    """Move up to ``batch_size`` orders older than ``cutoff``; return the count moved"""
+    with transaction.atomic(using=using):
+        orders = list(
+            Order.objects.using(using)
+            .filter(order_date__lt=cutoff)
+            .order_by('order_date', 'id')
+            .values('id', 'customer_id', 'total_amount', 'order_date')[:batch_size]
+        )
+        if not orders:
+            return 0
+        order_ids = [order['id'] for order in orders]
+
+        ArchivedOrder.objects.using(using).bulk_create(
+            [ArchivedOrder(**order) for order in orders]
+        )
+        lines = OrderLine.objects.using(using).filter(order_id__in=order_ids)
+        ArchivedOrderLine.objects.using(using).bulk_create([
+            ArchivedOrderLine(**line)
+            for line in lines.values('order_id', 'product_id', 'quantity', 'unit_price')
+        ])
+        lines.delete()
+        Order.objects.using(using).filter(id__in=order_ids).delete()
+        # Order deletes are recorded by their signals; the bulk writes are not
+        counting.written(ArchivedOrder, using)
+
+    cache.set(WATERMARK_CACHE_KEY.format(using), orders[-1]['order_date'], WATERMARK_CACHE_TTL)
+    return len(orders)
@@ -0,0 +1,294 @@
+"""
+In-process product catalog.
+
+Every order query renders products, yet the product table is small and
+rarely written. With ``CRM_PRODUCT_CATALOG`` on, each process keeps all
+products in parallel arrays (ids sorted, prices in cents, stock, creation
+time in microseconds) plus one list of names: about a tenth of the memory
+of model instances. ``OrderType.products`` reads it instead of the database
+and builds ``Product`` instances on demand.
+
+It is for display only. Other processes' edits reach it late (see below),
+so anything that charges a price (``createOrder``, order imports) reads the
+products in its own transaction instead.
+
+The catalog follows the product write version from ``crm.counting``:
+
+- when the version moves it reloads the products this process changed
+  (recorded when their transaction commits) and any product with a higher
+  id than it holds; other processes' edits to existing products are picked
+  up by the full reload every ``CRM_PRODUCT_CATALOG_FULL_REFRESH`` seconds
+- an id it does not hold is looked up in the database (and added), so a
+  product created by another worker is never reported missing
+- it is never (re)loaded inside a transaction, which could see uncommitted
+  rows; callers then read the database
+
+A catalog is immutable once built: refreshing builds a new one and swaps it
+in, so readers on other threads never see half-applied changes.
+"""
+import logging
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.db.models.signals import post_delete, post_save
+
+from . import counting, metrics, sharding
+from .models import Product
+from .routers import PRIMARY
+
+FIELDS = ('id', 'name', 'price', 'stock', 'created_at')
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+logger = logging.getLogger('crm.catalog')
+
+_catalog = None
+_lock = threading.Lock()
+# Ids written by this process since the catalog was built
+_changed = set()
+
+
+def to_cents(price):
+    return int(price.scaleb(2))
+
+
+def to_microseconds(moment):
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+
+class ProductCatalog:
+    """Products as parallel arrays, ordered by id"""
+
+    def __init__(self, ids, names, prices, stocks, created, version):
+        self.ids = ids
+        self.names = names
+        self.prices = prices
+        self.stocks = stocks
+        self.created = created
+        self.version = version
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def build(cls, rows, version):
+        ids, prices, stocks, created = array('q'), array('q'), array('q'), array('q')
+        names = []
+        for pk, name, price, stock, created_at in rows:
+            ids.append(pk)
+            names.append(sys.intern(name))
+            prices.append(to_cents(price))
+            stocks.append(stock)
+            created.append(to_microseconds(created_at))
+        return cls(ids, names, prices, stocks, created, version)
+
+    @classmethod
+    def load(cls, using, version):
+        rows = Product.objects.using(using).order_by('id').values_list(*FIELDS).iterator(chunk_size=5000)
+        return cls.build(rows, version)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def position(self, pk):
+        index = bisect_left(self.ids, pk)
+        if index < len(self.ids) and self.ids[index] == pk:
+            return index
+        return None
+
+    def __contains__(self, pk):
+        return self.position(pk) is not None
+
+    def product(self, pk, using=None):
+        """A ``Product`` for ``pk`` (as if loaded from ``using``), or None"""
+        index = self.position(pk)
+        if index is None:
+            return None
+        return Product.from_db(using, FIELDS, (
+            pk,
+            self.names[index],
+            Decimal(self.prices[index]).scaleb(-2),
+            self.stocks[index],
+            EPOCH + timedelta(microseconds=self.created[index]),
+        ))
+
+    def rows(self):
+        for index, pk in enumerate(self.ids):
+            yield (pk, self.names[index], Decimal(self.prices[index]).scaleb(-2), self.stocks[index],
+                   EPOCH + timedelta(microseconds=self.created[index]))
+
+    def replace(self, rows, removed=(), version=None):
+        """A new catalog with ``rows`` added or updated and the ids in ``removed`` dropped"""
+        rows = {row[0]: row for row in rows}
+        removed = set(removed) - rows.keys()
+        version = self.version if version is None else version
+        if not rows and not removed:
+            return ProductCatalog(self.ids, self.names, self.prices, self.stocks, self.created, version)
+        if not removed and (not self.ids or min(rows) > self.ids[-1]):
+            # Only new products: extend copies of the arrays
+            catalog = ProductCatalog(
+                array('q', self.ids), list(self.names), array('q', self.prices),
+                array('q', self.stocks), array('q', self.created), self.version,
+            )
+            for pk, name, price, stock, created_at in sorted(rows.values()):
+                catalog.ids.append(pk)
+                catalog.names.append(sys.intern(name))
+                catalog.prices.append(to_cents(price))
+                catalog.stocks.append(stock)
+                catalog.created.append(to_microseconds(created_at))
+        else:
+            merged = {row[0]: row for row in self.rows() if row[0] not in removed}
+            merged.update(rows)
+            catalog = ProductCatalog.build((merged[pk] for pk in sorted(merged)), version)
+        catalog.version = version
+        return catalog
+
+    def footprint(self):
+        """Approximate bytes held, by structure"""
+        arrays = {
+            'ids': self.ids, 'prices': self.prices, 'stocks': self.stocks, 'created': self.created,
+        }
+        sizes = {name: sys.getsizeof(values) for name, values in arrays.items()}
+        sizes['names'] = sys.getsizeof(self.names) + sum(sys.getsizeof(name) for name in set(self.names))
+        sizes['total'] = sum(sizes.values())
+        return sizes
+
+
+# Access
+
+def database():
+    """Database the catalog is read from: the primary (or first shard), never a lagging replica"""
+    return sharding.any_shard() or PRIMARY
+
+
+def get_catalog():
+    """The current catalog, or None when it is disabled or cannot be refreshed now"""
+    global _catalog
+    if not settings.CRM_PRODUCT_CATALOG:
+        return None
+    catalog = _catalog
+    version = counting.version(Product)
+    expired = (
+        catalog is not None
+        and time.monotonic() - catalog.loaded_at > settings.CRM_PRODUCT_CATALOG_FULL_REFRESH
+    )
+    if catalog is not None and catalog.version == version and not expired:
+        return catalog
+
+    using = database()
+    if connections[using].in_atomic_block:
+        return None
+    with _lock:
+        catalog = _catalog
+        if catalog is None or expired:
+            _changed.clear()
+            catalog = ProductCatalog.load(using, version)
+            metrics.record_cache('product_catalog', hit=False)
+        elif catalog.version != version:
+            changed = set(_changed)
+            _changed.difference_update(changed)
+            catalog = refresh(catalog, changed, using, version)
+        _catalog = catalog
+    return catalog
+
+
+def refresh(catalog, changed, using, version):
+    """Apply the products changed here and the ones created since ``catalog`` was built"""
+    products = Product.objects.using(using).values_list(*FIELDS)
+    rows = list(products.filter(id__in=changed)) if changed else []
+    if len(catalog):
+        rows += products.filter(id__gt=catalog.ids[-1]).exclude(id__in=changed)
+    else:
+        rows += products.exclude(id__in=changed)
+    found = {row[0] for row in rows}
+    return catalog.replace(rows, removed=changed - found, version=version)
+
+
+def preload():
+    """Load the catalog at worker start (called by wsgi.py/asgi.py)"""
+    if not settings.CRM_PRODUCT_CATALOG:
+        return
+    try:
+        get_catalog()
+    except DatabaseError:
+        logger.exception("Could not preload the product catalog; loading it on first use")
+    # A preloading server forks workers after this; they open their own connections
+    connections.close_all()
+
+
+def reset():
+    global _catalog
+    with _lock:
+        _catalog = None
+        _changed.clear()
+
+
+def lookup(pks, using=None):
+    """``{pk: Product}`` for the ``pks`` that exist, from the catalog when it is available"""
+    catalog = get_catalog()
+    if catalog is None:
+        return Product.objects.using(using).in_bulk(pks)
+    found = {}
+    for pk in pks:
+        product = catalog.product(pk, using)
+        if product is not None:
+            found[pk] = product
+    missing = set(pks) - found.keys()
+    metrics.record_cache('product_catalog', hit=not missing)
+    if missing:
+        # Created by another process since the last refresh
+        loaded = Product.objects.using(using).in_bulk(missing)
+        found.update(loaded)
+        if loaded and not connections[database()].in_atomic_block:
+            add(loaded.values(), catalog)
+    return found
+
+
+def order_products(order):
+    """The products of ``order`` in ``Product`` order, from its prefetched lines.
+
+    Products prefetched with the lines are used as they are, others come from
+    the catalog. None when the lines were not prefetched (loading them would
+    cost the query the catalog saves).
+    """
+    lines = getattr(order, '_prefetched_objects_cache', {}).get('line_items')
+    if lines is None:
+        return None
+    if all(type(line).product.is_cached(line) for line in lines):
+        products = {line.product_id: line.product for line in lines}
+    else:
+        products = lookup({line.product_id for line in lines}, using=order._state.db)
+    return sorted(products.values(), key=lambda product: (product.name, product.pk))
+
+
+def add(products, catalog):
+    global _catalog
+    rows = [tuple(getattr(product, name) for name in FIELDS) for product in products]
+    with _lock:
+        if _catalog is catalog:
+            _catalog = catalog.replace(rows)
+
+
+# Change tracking
+
+def product_written(sender, instance, using, **kwargs):
+    if sharding.is_replicated(Product) and using != sharding.shards()[0]:
+        return
+    pk = instance.pk
+
+    def committed():
+        # Refreshing before the commit would read the old row. Bump the
+        # version again once the id is recorded, in case a refresh ran
+        # between the write's own version bump and this callback.
+        _changed.add(pk)
+        counting.bump(Product)
+    transaction.on_commit(committed, using=using)
+
+
+def connect():
+    post_save.connect(product_written, sender=Product, dispatch_uid='crm.catalog.product_saved')
+    post_delete.connect(product_written, sender=Product, dispatch_uid='crm.catalog.product_deleted')
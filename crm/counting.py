@@ -0,0 +1,234 @@
+"""
+``totalCount`` for the root connections.
+
+Exact counts are cached under a key made of the model, the write version of
+every model the count depends on and the normalized filter arguments. A
+write bumps its model's version (immediately and again when it commits), so
+a cached count is only served while nothing it depends on has changed; the
+entry itself expires after ``CRM_COUNT_CACHE_TTL`` seconds in case a write
+bypassed the signals. Counts are not cached from inside a transaction,
+which may see its own uncommitted rows.
+
+``totalCount(approximate: true)`` avoids counting large tables:
+
+- a cached exact count for the current versions is returned as is
+- below ``CRM_COUNT_APPROXIMATE_MIN_ROWS`` rows the exact count is used
+- unfiltered, it is the model's maintained row counter: counted once per
+  ``CRM_COUNT_APPROXIMATE_TTL`` and adjusted by committed creates and deletes
+- filtered, the filter is applied to the newest ``CRM_COUNT_SAMPLE_SIZE``
+  rows and the matching fraction scaled to the row counter
+
+Versions and counters live in Django's cache, which is per process unless
+``CACHES`` names a shared backend. A per-process cache never learns about
+other workers' writes, so exact counts are then only cached for
+``CRM_COUNT_LOCAL_CACHE_TTL`` seconds (0, not at all, by default); the
+row counters behind approximate counts still are.
+"""
+import hashlib
+import time
+from datetime import date, datetime, time as time_of_day
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save
+from django.utils.functional import cached_property
+
+from . import metrics, sharding
+from .merging import MergedQuerySet
+from .models import ArchivedOrder, Customer, Order, OrderLine, Product
+
+# Connection arguments that do not change which rows match
+NON_FILTER_ARGS = frozenset(['first', 'last', 'before', 'after', 'offset', 'order_by'])
+
+# Models whose writes can change a count of the key model (its filters join them)
+DEPENDENCIES = {
+    Customer: (Customer,),
+    Product: (Product,),
+    Order: (Order, OrderLine, Customer, Product, ArchivedOrder),
+}
+
+# Cache backends whose entries only the worker process itself sees
+LOCAL_CACHE_BACKENDS = frozenset([
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+])
+
+VERSION_KEY = 'crm:count:version:{}'
+ROWS_KEY = 'crm:count:rows:{}'
+
+
+def shared_cache():
+    """True when the default cache is shared by every worker process"""
+    return settings.CACHES['default']['BACKEND'] not in LOCAL_CACHE_BACKENDS
+
+
+def exact_ttl():
+    """Seconds an exact count may be served from the cache; 0 when it must not be"""
+    if shared_cache():
+        return settings.CRM_COUNT_CACHE_TTL
+    return settings.CRM_COUNT_LOCAL_CACHE_TTL
+
+
+# Write versions
+
+def version(model):
+    key = VERSION_KEY.format(model._meta.label_lower)
+    value = cache.get(key)
+    if value is None:
+        # A fresh start value never matches counts cached under an evicted version
+        cache.add(key, time.time_ns(), None)
+        value = cache.get(key)
+    return value
+
+
+def bump(model):
+    key = VERSION_KEY.format(model._meta.label_lower)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def adjust_rows(model, delta):
+    try:
+        cache.incr(ROWS_KEY.format(model._meta.label_lower), delta)
+    except ValueError:
+        pass  # Not counted yet; the next approximate count does it
+
+
+def written(model, using=None, created=0, deleted=0):
+    """Invalidate counts after writing ``model`` on ``using`` (inside the write's transaction)
+
+    Call this for writes that send no model signals (``bulk_create``,
+    ``QuerySet.update``); saves and deletes are recorded automatically.
+    """
+    bump(model)
+
+    def committed():
+        # Counts cached between the write and its commit saw the old rows
+        bump(model)
+        if created != deleted:
+            adjust_rows(model, created - deleted)
+    transaction.on_commit(committed, using=using)
+
+
+def model_saved(sender, instance, created, using, **kwargs):
+    if sharding.is_replicated(sender) and using != sharding.shards()[0]:
+        return
+    written(sender, using, created=int(created))
+
+
+def model_deleted(sender, instance, using, **kwargs):
+    if sharding.is_replicated(sender) and using != sharding.shards()[0]:
+        return
+    written(sender, using, deleted=1)
+
+
+def connect():
+    for model in (Customer, Product, Order, OrderLine):
+        post_save.connect(model_saved, sender=model, dispatch_uid=f'crm.counting.saved.{model.__name__}')
+    # Not OrderLine: archive_batch deletes lines in bulk and records the write itself
+    for model in (Customer, Product, Order):
+        post_delete.connect(model_deleted, sender=model, dispatch_uid=f'crm.counting.deleted.{model.__name__}')
+
+
+# Counting
+
+def normalize(value):
+    """A filter argument in a form that compares equal when it filters the same"""
+    if isinstance(value, Decimal):
+        return str(value.normalize())
+    if isinstance(value, (datetime, date, time_of_day)):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return [normalize(item) for item in value]
+    return value
+
+
+def filter_arguments(args):
+    """The filtering part of connection ``args``, normalized and without no-op values"""
+    return {
+        name: normalize(value) for name, value in sorted(args.items())
+        if name not in NON_FILTER_ARGS and value not in (None, '', [])
+    }
+
+
+def databases(iterable):
+    if isinstance(iterable, MergedQuerySet):
+        return [alias for queryset in iterable.querysets for alias in databases(queryset)]
+    return [iterable.db]
+
+
+def in_transaction(iterable):
+    return any(connections[alias].in_atomic_block for alias in databases(iterable))
+
+
+def count_rows(iterable):
+    return iterable.count() if isinstance(iterable, QuerySet) else len(iterable)
+
+
+class TotalCount:
+    """The number of rows of a root connection, before pagination"""
+
+    def __init__(self, model, iterable, args):
+        self.model = model
+        self.iterable = iterable
+        self.filters = filter_arguments(args)
+
+    @cached_property
+    def key(self):
+        versions = '.'.join(str(version(model)) for model in DEPENDENCIES.get(self.model, (self.model,)))
+        digest = hashlib.sha1(repr(sorted(self.filters.items())).encode('utf-8')).hexdigest()
+        return f'crm:count:{self.model._meta.label_lower}:{versions}:{digest}'
+
+    def cached(self):
+        if not exact_ttl():
+            return None
+        count = cache.get(self.key)
+        metrics.record_cache('count', hit=count is not None)
+        return count
+
+    def exact(self):
+        count = self.cached()
+        if count is None:
+            count = count_rows(self.iterable)
+            ttl = exact_ttl()
+            if ttl and not in_transaction(self.iterable):
+                cache.set(self.key, count, ttl)
+        return count
+
+    def rows(self):
+        """The model's maintained row counter (what an unfiltered count returns)"""
+        key = ROWS_KEY.format(self.model._meta.label_lower)
+        count = cache.get(key)
+        if count is None:
+            if self.filters:
+                count = count_rows(self.model._default_manager.using(self.iterable.db))
+            else:
+                count = count_rows(self.iterable)
+            cache.set(key, count, settings.CRM_COUNT_APPROXIMATE_TTL)
+        return count
+
+    def approximate(self):
+        count = self.cached()
+        if count is not None:
+            return count
+        # Sampling needs one queryset; merged shards and archives are counted
+        if self.filters and not isinstance(self.iterable, QuerySet):
+            return self.exact()
+        total = self.rows()
+        if total < settings.CRM_COUNT_APPROXIMATE_MIN_ROWS:
+            return self.exact()
+        if not self.filters:
+            return total
+        return self.estimate(total)
+
+    def estimate(self, total):
+        """Scale the share of the newest rows matching the filters to ``total``"""
+        size = settings.CRM_COUNT_SAMPLE_SIZE
+        sample = self.model._default_manager.using(self.iterable.db).order_by('-pk').values('pk')[:size]
+        matched = self.iterable.filter(pk__in=sample).count()
+        return round(total * matched / min(size, total))
@@ -0,0 +1,125 @@
+import graphene
+from django.db.models.query import QuerySet
+from graphene_django.filter import DjangoFilterConnectionField
+from graphene_django.utils import maybe_queryset
+from graphql_relay import get_offset_with_default
+
+from . import counting, sharding
+from .merging import MergedQuerySet
+
+
+class CountedConnection(graphene.relay.Connection):
+    """Connection with a ``totalCount`` of the rows matching the filters"""
+
+    class Meta:
+        abstract = True
+
+    total_count = graphene.Int(
+        required=True,
+        approximate=graphene.Boolean(
+            default_value=False,
+            description="Allow an estimate for large tables instead of counting them",
+        ),
+    )
+
+    def resolve_total_count(root, info, approximate=False):
+        total = getattr(root, 'total', None)
+        if total is None:
+            # Nested connections are counted by graphene-django itself
+            return root.length
+        return total.approximate() if approximate else total.exact()
+
+
+class FetchedPage:
+    """Rows from ``start`` on, posing as a sequence of ``start + len(rows)`` items.
+
+    Rows before ``start`` are never accessed by graphene-django, and one row
+    past the page is enough for it to set ``hasNextPage``.
+    """
+
+    def __init__(self, start, rows):
+        self.start = start
+        self.rows = rows
+
+    def __len__(self):
+        return self.start + len(self.rows)
+
+    def __getitem__(self, item):
+        stop = None if item.stop is None else item.stop - self.start
+        return self.rows[item.start - self.start:stop]
+
+
+class CountedRows:
+    """``iterable`` with a length known in advance"""
+
+    def __init__(self, iterable, length):
+        self.iterable = iterable
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, item):
+        return self.iterable[item]
+
+
+class CRMFilterConnectionField(DjangoFilterConnectionField):
+    """Filter connection field aware of how CRM rows are stored.
+
+    With sharding enabled, partitioned models are filtered on every shard and
+    merged in the queryset's ordering, so cursors and offsets behave exactly
+    as they do against a single database.
+
+    Forward pages are fetched with one extra row instead of counting every
+    match; ``totalCount`` and backward pagination use the cached count from
+    ``crm.counting``.
+    """
+
+    @classmethod
+    def resolve_queryset(cls, connection, iterable, info, args, filtering_args, filterset_class):
+        queryset = maybe_queryset(iterable)
+        model = connection._meta.node._meta.model
+        resolve = super().resolve_queryset
+        if not (sharding.is_sharded(model) and isinstance(queryset, QuerySet)):
+            return resolve(connection, iterable, info, args, filtering_args, filterset_class)
+
+        return MergedQuerySet(
+            resolve(connection, queryset.using(alias), info, args, filtering_args, filterset_class)
+            for alias in sharding.shards()
+        )
+
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable, max_limit=None):
+        iterable = maybe_queryset(iterable)
+        if not isinstance(iterable, (QuerySet, MergedQuerySet)):
+            return super().resolve_connection(connection, args, iterable, max_limit)
+
+        total = counting.TotalCount(connection._meta.node._meta.model, iterable, args)
+        first = args.get('first')
+        if first is None and args.get('last') is None:
+            first = max_limit
+        if first is not None and first >= 0 and args.get('last') is None and args.get('before') is None:
+            # Same start as graphene-django: offset counts from after the cursor
+            start = get_offset_with_default(args.get('after'), -1) + 1 + (args.get('offset') or 0)
+            rows = FetchedPage(start, list(iterable[start:start + first + 1]))
+        else:
+            rows = CountedRows(iterable, total.exact())
+
+        resolved = super().resolve_connection(connection, args, rows, max_limit)
+        resolved.iterable = iterable
+        resolved.total = total
+        return resolved
+
+
+class LoadedFilterConnectionField(DjangoFilterConnectionField):
+    """Filter connection field whose resolver may return rows already loaded.
+
+    A list from the resolver is paginated as it is: the resolver only returns
+    one when no filter applies and it is already in the connection's order.
+    """
+
+    @classmethod
+    def resolve_queryset(cls, connection, iterable, info, args, filtering_args, filterset_class):
+        if isinstance(iterable, list):
+            return iterable
+        return super().resolve_queryset(connection, iterable, info, args, filtering_args, filterset_class)
@@ -1,9 +1,153 @@
+import copy
+from functools import lru_cache
+
 import django_filters
+from django import forms
+from django_filters.filters import QuerySetRequestMixin
 from django.db.models import Q
-from .models import Customer, Product, Order
+from .archive import archive_boundary
+from .merging import MergedQuerySet
+from .phones import prefix_bounds
+from .models import Customer, Product, Order, ArchivedOrder
+
+
+class FilterPlan:
+    """What a FilterSet needs for one set of provided arguments.
+
+    ``form_class`` validates only those arguments; ``filters`` are the
+    filters that apply them, bound to each request's FilterSet by ``bind``.
+    """
+
+    def __init__(self, form_class, filters):
+        self.form_class = form_class
+        self.filters = filters
+
+    def bind(self, filterset, model):
+        bound = {}
+        for name, template in self.filters.items():
+            filter_ = copy.copy(template)
+            filter_.model = model
+            filter_.parent = filterset
+            if filter_.method is not None:
+                # Point the method proxy at this copy (and so this FilterSet)
+                filter_.method = template.method
+            bound[name] = filter_
+        return bound
+
+
+class FilterPlanMixin:
+    """Reuse the form class and filters built for an argument shape.
+
+    django-filter deep-copies every declared filter, builds a form field for
+    each and creates a new form class on every instantiation. With this
+    mixin a bound FilterSet looks up the plan for the names in ``data``
+    (cached per class and name set), validates a form holding only those
+    fields and copies only the filters that will run. Unbound or prefixed
+    FilterSets, and argument sets using request-dependent choice filters,
+    take django-filter's path unchanged.
+    """
+
+    @classmethod
+    @lru_cache(maxsize=512)
+    def get_plan(cls, names):
+        """The cached ``FilterPlan`` for the argument names ``names`` (a frozenset)"""
+        filters = {}
+        for name, base in cls.base_filters.items():
+            if name not in names:
+                continue
+            if isinstance(base, QuerySetRequestMixin):
+                return None
+            filters[name] = template = copy.deepcopy(base)
+            template.model = cls._meta.model
+        fields = {name: filter_.field for name, filter_ in filters.items()}
+        form_class = type(f'{cls.__name__}Form', (cls._meta.form,), fields)
+        return FilterPlan(form_class, filters)
+
+    def __init__(self, data=None, queryset=None, *, request=None, prefix=None):
+        plan = None
+        if data is not None and prefix is None:
+            plan = self.get_plan(frozenset(data))
+        self._plan = plan
+        if plan is None:
+            super().__init__(data, queryset, request=request, prefix=prefix)
+            return
+
+        # BaseFilterSet.__init__ without deep-copying every filter
+        if queryset is None:
+            queryset = self._meta.model._default_manager.all()
+        self.is_bound = True
+        self.data = data
+        self.queryset = queryset
+        self.request = request
+        self.form_prefix = None
+        self.filters = plan.bind(self, queryset.model)
+
+    def get_form_class(self):
+        if self._plan is None:
+            return super().get_form_class()
+        return self._plan.form_class
+
+
+def reverse_ordering(ordering):
+    return tuple(name[1:] if name.startswith('-') else f'-{name}' for name in ordering)
+
 
+class OrderingField(forms.CharField):
+    """Comma-separated field names (``-`` for descending) cleaned to an allowed ordering"""
 
-class CustomerFilter(django_filters.FilterSet):
+    def __init__(self, *, orderings, aliases, allowed, **kwargs):
+        super().__init__(**kwargs)
+        self.orderings = orderings
+        self.aliases = aliases
+        self.allowed = allowed
+
+    def clean(self, value):
+        value = super().clean(value)
+        if not value:
+            return None
+        names = []
+        for name in value.split(','):
+            name = name.strip()
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            name = self.aliases.get(name, name)
+            names.append(f'-{name}' if descending else name)
+        ordering = self.orderings.get(tuple(names))
+        if ordering is None:
+            raise forms.ValidationError(
+                f"Unsupported orderBy {value!r}; use one of {self.allowed} or one of them reversed"
+            )
+        return ordering
+
+
+class OrderByFilter(django_filters.Filter):
+    """Order by one of a fixed set of orderings, each served by a composite index.
+
+    ``orderings`` end with the primary key so every row has a stable position
+    for cursor pagination. Each may also be requested fully reversed (the
+    index is then read backwards) and without the trailing primary key.
+    Anything else, which the database would have to sort, is a validation error.
+    """
+    field_class = OrderingField
+
+    def __init__(self, orderings, aliases=None, **kwargs):
+        self.orderings = orderings
+        lookup = {}
+        for ordering in orderings:
+            for variant in (ordering, reverse_ordering(ordering)):
+                lookup.setdefault(variant, variant)
+                lookup.setdefault(variant[:-1], variant)
+        allowed = ', '.join(f'"{",".join(ordering[:-1])}"' for ordering in orderings)
+        kwargs.update(orderings=lookup, aliases={'pk': 'id', **(aliases or {})}, allowed=allowed)
+        super().__init__(**kwargs)
+
+    def filter(self, qs, value):
+        if not value:
+            return qs
+        return qs.order_by(*value)
+
+
+class CustomerFilter(FilterPlanMixin, django_filters.FilterSet):
     """Filter class for Customer model"""
     
     # Case-insensitive partial match for name
@@ -11,24 +155,37 @@ class CustomerFilter(django_filters.FilterSet):
     
     # Case-insensitive partial match for email
     email = django_filters.CharFilter(lookup_expr='icontains')
+
+    # Case-insensitive exact match for email (uses the lower(email) index)
+    email_exact = django_filters.CharFilter(method='filter_email_exact')
     
     # Date range filters for created_at
     created_at__gte = django_filters.DateTimeFilter(field_name='created_at', lookup_expr='gte')
     created_at__lte = django_filters.DateTimeFilter(field_name='created_at', lookup_expr='lte')
     
-    # Custom filter for phone number pattern (starts with +1)
+    # Phone number prefix (e.g. +1), matched against the E.164 column
     phone_pattern = django_filters.CharFilter(method='filter_phone_pattern')
+
+    # Indexed orderings (see Customer.Meta.indexes)
+    order_by = OrderByFilter(orderings=[('name', 'id'), ('created_at', 'id')])
     
     class Meta:
         model = Customer
         fields = ['name', 'email', 'created_at']
     
+    def filter_email_exact(self, queryset, name, value):
+        """Filter the customer with this email, whatever its case"""
+        return queryset.with_email(value)
+
     def filter_phone_pattern(self, queryset, name, value):
-        """Custom filter to match phone numbers starting with a specific pattern"""
-        return queryset.filter(phone__istartswith=value)
+        """Match phone numbers starting with a pattern, as a range scan on the phone_e164 index"""
+        bounds = prefix_bounds(value)
+        if bounds is None:
+            return queryset.none()
+        return queryset.filter(phone_e164__gte=bounds[0], phone_e164__lt=bounds[1])
 
 
-class ProductFilter(django_filters.FilterSet):
+class ProductFilter(FilterPlanMixin, django_filters.FilterSet):
     """Filter class for Product model"""
     
     # Case-insensitive partial match for name
@@ -47,6 +204,9 @@ class ProductFilter(django_filters.FilterSet):
     
     # Custom filter for low stock (stock < 10)
     low_stock = django_filters.BooleanFilter(method='filter_low_stock')
+
+    # Indexed orderings (see Product.Meta.indexes)
+    order_by = OrderByFilter(orderings=[('name', 'id'), ('price', 'name', 'id'), ('stock', 'id')])
     
     class Meta:
         model = Product
@@ -59,7 +219,7 @@ class ProductFilter(django_filters.FilterSet):
         return queryset
 
 
-class OrderFilter(django_filters.FilterSet):
+class OrderFilter(FilterPlanMixin, django_filters.FilterSet):
     """Filter class for Order model"""
     
     # Range filters for total_amount
@@ -78,7 +238,32 @@ class OrderFilter(django_filters.FilterSet):
     
     # Filter orders that include a specific product ID
     product_id = django_filters.NumberFilter(field_name='products__id', lookup_expr='exact')
+
+    # Indexed orderings (see Order.Meta.indexes); customer orders by customer id
+    order_by = OrderByFilter(
+        orderings=[('-order_date', '-id'), ('-total_amount', 'id'), ('customer_id', '-order_date', '-id')],
+        aliases={'customer': 'customer_id'},
+    )
     
     class Meta:
         model = Order
         fields = ['total_amount', 'order_date', 'customer_name', 'product_name']
+
+    @property
+    def qs(self):
+        """Filtered orders, merged with the archive when the date range reaches it"""
+        if not hasattr(self, '_merged_qs'):
+            queryset = super().qs
+            if self.reaches_archive(queryset.db):
+                archived = ArchivedOrder.objects.using(queryset.db).select_related('customer')
+                queryset = MergedQuerySet([queryset, self.filter_queryset(archived)])
+            self._merged_qs = queryset
+        return self._merged_qs
+
+    def reaches_archive(self, using):
+        """True when an order_date filter leaves the range open before the archive boundary"""
+        data = self.form.cleaned_data
+        if all(data.get(name) is None for name in ('order_date', 'order_date__gte', 'order_date__lte')):
+            return False
+        lower = data.get('order_date') or data.get('order_date__gte')
+        return lower is None or lower <= archive_boundary(using)
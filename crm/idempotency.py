@@ -0,0 +1,208 @@
+"""
+Idempotency keys for mutations.
+
+A mutation decorated with ``idempotent`` accepts an optional
+``idempotencyKey`` argument. The first request with a key claims a row in
+``IdempotencyKey`` before executing and stores its payload afterwards;
+retries with the same key and arguments get the stored payload back without
+running validation or inserts again. The payload is written in the same
+transaction as the mutation's own writes (on every shard when sharding is
+enabled), so a request that dies before committing leaves nothing to replay
+and nothing half-done. Model instances in the payload are stored as
+references and re-read on replay.
+
+A duplicate that arrives while the first request is still executing waits
+for it to finish (``CRM_IDEMPOTENCY_WAIT_SECONDS``). A claim whose request
+died without storing a result is taken over after
+``CRM_IDEMPOTENCY_LOCK_SECONDS``.
+"""
+import functools
+import hashlib
+import json
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import graphene
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from graphql import GraphQLError
+
+from . import metrics, sharding
+from .models import IdempotencyKey
+from .routers import PRIMARY
+
+POLL_INTERVAL = 0.05
+
+
+def request_hash(arguments):
+    """Stable digest of the mutation arguments (without the key)"""
+    encoded = json.dumps(arguments, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+# Payload serialization
+
+def encode(value):
+    """Convert a mutation payload into JSON, replacing model instances by references"""
+    if isinstance(value, models.Model):
+        return {'$model': value._meta.label, 'pk': value.pk, 'db': value._state.db}
+    if isinstance(value, graphene.ObjectType):
+        return {
+            '$type': type(value)._meta.name,
+            'fields': {name: encode(getattr(value, name, None)) for name in type(value)._meta.fields},
+        }
+    if isinstance(value, (list, tuple)):
+        return [encode(item) for item in value]
+    if isinstance(value, Decimal):
+        return {'$decimal': str(value)}
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, date):
+        return {'$date': value.isoformat()}
+    return value
+
+
+def load_instances(references):
+    """Fetch referenced rows with one query per model and database"""
+    grouped = {}
+    for reference in references:
+        grouped.setdefault((reference['$model'], reference['db']), []).append(reference['pk'])
+    loaded = {}
+    for (label, db), pks in grouped.items():
+        model = apps.get_model(label)
+        for pk, instance in model._base_manager.using(db).in_bulk(pks).items():
+            loaded[(label, db, pk)] = instance
+    return loaded
+
+
+def decode(value, schema):
+    """Rebuild a payload stored by ``encode``"""
+    if isinstance(value, list):
+        references = [item for item in value if isinstance(item, dict) and '$model' in item]
+        loaded = load_instances(references) if references else {}
+        items = []
+        for item in value:
+            if isinstance(item, dict) and '$model' in item:
+                instance = loaded.get((item['$model'], item['db'], item['pk']))
+                if instance is not None:
+                    items.append(instance)
+            else:
+                items.append(decode(item, schema))
+        return items
+    if not isinstance(value, dict):
+        return value
+    if '$model' in value:
+        return load_instances([value]).get((value['$model'], value['db'], value['pk']))
+    if '$type' in value:
+        object_type = schema.get_type(value['$type']).graphene_type
+        return object_type(**{name: decode(field, schema) for name, field in value['fields'].items()})
+    if '$decimal' in value:
+        return Decimal(value['$decimal'])
+    if '$datetime' in value:
+        return parse_datetime(value['$datetime'])
+    if '$date' in value:
+        return parse_date(value['$date'])
+    return value
+
+
+# Claims
+
+def claim(operation, key, digest):
+    """Return ``(row, created)``: a new claim or the live row already holding the key"""
+    keys = IdempotencyKey.objects.using(PRIMARY)
+    lock_timeout = timedelta(seconds=settings.CRM_IDEMPOTENCY_LOCK_SECONDS)
+    while True:
+        now = timezone.now()
+        try:
+            with transaction.atomic(using=PRIMARY):
+                row = keys.create(
+                    operation=operation,
+                    key=key,
+                    request_hash=digest,
+                    expires_at=now + timedelta(hours=settings.CRM_IDEMPOTENCY_TTL_HOURS),
+                )
+            return row, True
+        except IntegrityError:
+            pass
+
+        row = keys.filter(operation=operation, key=key).first()
+        if row is None:
+            continue
+        abandoned = row.response is None and row.created_at < now - lock_timeout
+        if row.expires_at <= now or abandoned:
+            # Delete exactly the row we saw so two takers cannot both win
+            keys.filter(pk=row.pk, created_at=row.created_at).delete()
+            continue
+        return row, False
+
+
+def wait_for_response(row):
+    """Poll a claim held by a concurrent request until it stores its payload"""
+    deadline = time.monotonic() + settings.CRM_IDEMPOTENCY_WAIT_SECONDS
+    while row.response is None:
+        if time.monotonic() >= deadline:
+            raise GraphQLError(f"A request with idempotency key {row.key!r} is still in progress")
+        time.sleep(POLL_INTERVAL)
+        row = IdempotencyKey.objects.using(PRIMARY).filter(pk=row.pk).first()
+        if row is None:
+            raise GraphQLError("The request holding this idempotency key failed; retry")
+    return row
+
+
+def idempotent(mutate):
+    """Decorate a ``Mutation.mutate`` that takes an optional ``idempotency_key``"""
+
+    @functools.wraps(mutate)
+    def wrapper(root, info, idempotency_key=None, **arguments):
+        if not idempotency_key:
+            return mutate(root, info, **arguments)
+
+        operation = info.field_name
+        digest = request_hash(arguments)
+        row, created = claim(operation, idempotency_key, digest)
+
+        if not created:
+            if row.request_hash != digest:
+                raise GraphQLError(
+                    f"Idempotency key {idempotency_key!r} was already used with different arguments"
+                )
+            metrics.record_cache('idempotency', hit=True)
+            row = wait_for_response(row)
+            return decode(row.response, info.schema)
+
+        metrics.record_cache('idempotency', hit=False)
+        try:
+            # The payload commits with the mutation's writes: a crash in
+            # between cannot leave a claim that a retry would run again
+            with transaction.atomic(using=PRIMARY), sharding.atomic():
+                result = mutate(root, info, **arguments)
+                stored = IdempotencyKey.objects.using(PRIMARY).filter(
+                    pk=row.pk, created_at=row.created_at,
+                ).update(response=encode(result))
+                if not stored:
+                    raise GraphQLError(
+                        f"Idempotency key {idempotency_key!r} expired while the request ran; retry"
+                    )
+        except Exception:
+            # Release the key so the client's retry can run
+            IdempotencyKey.objects.using(PRIMARY).filter(pk=row.pk, created_at=row.created_at).delete()
+            raise
+        return result
+
+    return wrapper
+
+
+def purge_expired(batch_size=1000, now=None):
+    """Delete expired keys in batches; return the number deleted"""
+    now = now or timezone.now()
+    keys = IdempotencyKey.objects.using(PRIMARY)
+    deleted = 0
+    while True:
+        batch = list(keys.filter(expires_at__lte=now).values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return deleted
+        deleted += keys.filter(pk__in=batch).delete()[0]
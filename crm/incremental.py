@@ -0,0 +1,494 @@
+"""
+Incremental delivery (``@defer`` and ``@stream``) over multipart HTTP.
+
+graphql-core 3.2 has no incremental executor, so the directives are declared
+on the schema and carried out here by executing the operation in parts:
+
+1. The initial payload runs the operation without its deferred fragments,
+   with every streamed connection cut down to ``initialCount`` edges.
+2. One more pass, only when the operation defers fragments, resolves them and
+   sends each fragment's fields at its path. It only selects the fields on
+   the way to a deferred fragment, so the rest is not resolved twice.
+3. Streamed connections are then fetched ``CRM_STREAM_CHUNK_SIZE`` edges at a
+   time by re-running that root field with an ``after`` cursor, so the server
+   only ever holds one chunk. Deferred fragments inside streamed edges arrive
+   with their edge.
+
+``@stream`` is honoured on the ``edges`` of root connection fields (for
+example ``allOrders``) and delivered inline anywhere else. Clients that do not
+accept ``multipart/mixed`` get the complete result in one response; the
+directives do not change what is resolved.
+"""
+from dataclasses import dataclass, field
+from typing import Optional
+
+from django.conf import settings
+from graphene_django.settings import graphene_settings
+from graphql_relay import get_offset_with_default, offset_to_cursor
+from graphql import (
+    ArgumentNode,
+    DirectiveLocation,
+    FieldNode,
+    FragmentDefinitionNode,
+    FragmentSpreadNode,
+    GraphQLArgument,
+    GraphQLBoolean,
+    GraphQLDirective,
+    GraphQLInt,
+    GraphQLNonNull,
+    GraphQLString,
+    InlineFragmentNode,
+    IntValueNode,
+    NameNode,
+    NullValueNode,
+    SelectionSetNode,
+    StringValueNode,
+    execute,
+    get_operation_ast,
+    parse,
+    specified_directives,
+    validate,
+    value_from_ast,
+)
+from graphql.execution.values import get_directive_values, get_variable_values
+
+from . import encoding
+
+DEFER_DIRECTIVE = GraphQLDirective(
+    name='defer',
+    locations=[DirectiveLocation.FRAGMENT_SPREAD, DirectiveLocation.INLINE_FRAGMENT],
+    args={
+        'if': GraphQLArgument(GraphQLNonNull(GraphQLBoolean), default_value=True),
+        'label': GraphQLArgument(GraphQLString),
+    },
+    description="Send the fragment in a later payload of a multipart response",
+)
+
+STREAM_DIRECTIVE = GraphQLDirective(
+    name='stream',
+    locations=[DirectiveLocation.FIELD],
+    args={
+        'if': GraphQLArgument(GraphQLNonNull(GraphQLBoolean), default_value=True),
+        'label': GraphQLArgument(GraphQLString),
+        'initialCount': GraphQLArgument(GraphQLNonNull(GraphQLInt), default_value=0),
+    },
+    description="Send the first initialCount items of the list, then stream the rest",
+)
+
+# Pass as ``graphene.Schema(directives=...)``
+DIRECTIVES = [*specified_directives, DEFER_DIRECTIVE, STREAM_DIRECTIVE]
+
+CONTENT_TYPE = 'multipart/mixed; boundary="-"; deferSpec=20220824'
+
+# Aliases of the bookkeeping fields added to streamed connections
+CURSOR_ALIAS = '_crmCursor'
+PAGE_INFO_ALIAS = '_crmPageInfo'
+
+
+def accepts_multipart(request):
+    return 'multipart/mixed' in request.META.get('HTTP_ACCEPT', '')
+
+
+def uses_directives(query):
+    """Cheap check before parsing: does the document mention either directive?"""
+    return '@defer' in query or '@stream' in query
+
+
+def enabled(directive, node, variables):
+    values = get_directive_values(directive, node, variables)
+    return values is not None and values['if']
+
+
+@dataclass
+class StreamPlan:
+    """A root connection field whose ``edges`` are streamed"""
+    node: FieldNode
+    key: str
+    label: Optional[str]
+    initial_count: int
+    total: int
+    after: Optional[str]
+    edges_key: str = 'edges'
+    page_info_keys: list = field(default_factory=list)
+
+
+class IncrementalOperation:
+    """One query operation using ``@defer``/``@stream``, executed in parts"""
+
+    def __init__(self, schema, document, operation, variables, operation_name,
+                 root_value=None, context_value=None, middleware=None):
+        self.schema = schema
+        self.document = document
+        self.operation = operation
+        self.variables = variables
+        self.operation_name = operation_name
+        self.root_value = root_value
+        self.context_value = context_value
+        self.middleware = middleware
+        self.fragments = {
+            definition.name.value: definition
+            for definition in document.definitions
+            if isinstance(definition, FragmentDefinitionNode)
+        }
+        self.streams = self.plan_streams()
+        self.has_deferred = False
+        self.errors = 0
+        # Passes executed so far (the query budget allows one operation's worth each)
+        self.executions = 0
+
+    @classmethod
+    def prepare(cls, schema, query, variables, operation_name, **kwargs):
+        """Return an operation to stream, or None to execute the request normally.
+
+        Anything unusual (parse or validation errors, mutations, bad variables)
+        returns None so the regular endpoint reports it.
+        """
+        try:
+            document = parse(query)
+        except Exception:
+            return None
+        if validate(schema.graphql_schema, document):
+            return None
+        operation = get_operation_ast(document, operation_name)
+        if operation is None or operation.operation.value != 'query':
+            return None
+        coerced = get_variable_values(
+            schema.graphql_schema, operation.variable_definitions or (), variables or {}
+        )
+        if isinstance(coerced, list):
+            return None
+        return cls(schema, document, operation, coerced, operation_name, **kwargs)
+
+    # Planning
+
+    def plan_streams(self):
+        plans = []
+        query_type = self.schema.graphql_schema.query_type
+        for selection in self.operation.selection_set.selections:
+            if not isinstance(selection, FieldNode) or selection.selection_set is None:
+                continue
+            field_def = query_type.fields.get(selection.name.value)
+            if field_def is None or not {'first', 'after'} <= set(field_def.args):
+                continue
+            edges = next((
+                child for child in selection.selection_set.selections
+                if isinstance(child, FieldNode) and child.name.value == 'edges'
+                and enabled(STREAM_DIRECTIVE, child, self.variables)
+            ), None)
+            if edges is None:
+                continue
+            arguments = {argument.name.value: argument for argument in selection.arguments}
+            if 'last' in arguments or 'before' in arguments:
+                continue
+            first = self.argument_value(arguments.get('first'), GraphQLInt)
+            after = self.argument_value(arguments.get('after'), GraphQLString)
+            offset = self.argument_value(arguments.get('offset'), GraphQLInt)
+            if offset:
+                # Like graphene-django, count the offset from after the cursor
+                # and fold it into the cursor, so it applies once and not per slice
+                after = offset_to_cursor(get_offset_with_default(after, -1) + offset)
+            stream = get_directive_values(STREAM_DIRECTIVE, edges, self.variables)
+            total = first if first is not None else graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+            total = min(total, settings.CRM_STREAM_MAX_ITEMS)
+            plans.append(StreamPlan(
+                node=selection,
+                key=(selection.alias or selection.name).value,
+                label=stream.get('label'),
+                initial_count=max(0, min(stream['initialCount'], total, graphene_settings.RELAY_CONNECTION_MAX_LIMIT)),
+                total=total,
+                after=after,
+                edges_key=(edges.alias or edges.name).value,
+                page_info_keys=[
+                    (child.alias or child.name).value
+                    for child in selection.selection_set.selections
+                    if isinstance(child, FieldNode) and child.name.value == 'pageInfo'
+                ],
+            ))
+        return plans
+
+    def argument_value(self, argument, type_):
+        if argument is None:
+            return None
+        return value_from_ast(argument.value, type_, self.variables)
+
+    # Document rewriting
+
+    def without_deferred(self, selection_set):
+        """Copy of a selection set with enabled ``@defer`` fragments removed"""
+        selections = []
+        for selection in selection_set.selections:
+            if isinstance(selection, (FragmentSpreadNode, InlineFragmentNode)) \
+                    and enabled(DEFER_DIRECTIVE, selection, self.variables):
+                self.has_deferred = True
+                continue
+            if getattr(selection, 'selection_set', None) is not None:
+                selection = copy_node(selection, selection_set=self.without_deferred(selection.selection_set))
+            selections.append(selection)
+        return SelectionSetNode(selections=tuple(selections))
+
+    def sliced_field(self, plan, first, after):
+        """The streamed root field limited to one slice, with cursor bookkeeping"""
+        arguments = [
+            argument for argument in plan.node.arguments
+            if argument.name.value not in ('first', 'after', 'offset')
+        ]
+        arguments.append(ArgumentNode(name=NameNode(value='first'), value=IntValueNode(value=str(first))))
+        arguments.append(ArgumentNode(
+            name=NameNode(value='after'),
+            value=StringValueNode(value=after) if after is not None else NullValueNode(),
+        ))
+        selections = []
+        for selection in plan.node.selection_set.selections:
+            if isinstance(selection, FieldNode) and selection.name.value == 'edges':
+                selection = copy_node(selection, directives=(), selection_set=SelectionSetNode(
+                    selections=(*selection.selection_set.selections, bookkeeping_field(CURSOR_ALIAS, 'cursor'))
+                ))
+            selections.append(selection)
+        selections.append(bookkeeping_field(
+            PAGE_INFO_ALIAS, 'pageInfo', SelectionSetNode(selections=(
+                bookkeeping_field(None, 'endCursor'), bookkeeping_field(None, 'hasNextPage'),
+            )),
+        ))
+        return copy_node(plan.node, arguments=tuple(arguments), selection_set=SelectionSetNode(selections=tuple(selections)))
+
+    def initial_document(self, strip_deferred):
+        streams = {id(plan.node): plan for plan in self.streams}
+        selections = []
+        for selection in self.operation.selection_set.selections:
+            plan = streams.get(id(selection))
+            if plan is not None:
+                selection = self.sliced_field(plan, plan.initial_count, plan.after)
+            selections.append(selection)
+        selection_set = SelectionSetNode(selections=tuple(selections))
+        fragments = list(self.fragments.values())
+        if strip_deferred:
+            selection_set = self.without_deferred(selection_set)
+            fragments = [
+                copy_node(fragment, selection_set=self.without_deferred(fragment.selection_set))
+                for fragment in fragments
+            ]
+        return self.document_with(selection_set, fragments)
+
+    def deferred_document(self):
+        """The initial document cut down to the fields that lead to deferred fragments"""
+        operation = self.initial_document(strip_deferred=False).definitions[0]
+        return self.document_with(self.only_deferred(operation.selection_set))
+
+    def only_deferred(self, selection_set):
+        """Copy of a selection set keeping enabled ``@defer`` fragments and their enclosing fields"""
+        selections = []
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                if selection.selection_set is None:
+                    continue
+                pruned = self.only_deferred(selection.selection_set)
+                if pruned.selections:
+                    selections.append(copy_node(selection, selection_set=pruned))
+            elif enabled(DEFER_DIRECTIVE, selection, self.variables):
+                selections.append(selection)
+            else:
+                pruned = self.only_deferred(self.fragment_selection_set(selection))
+                if pruned.selections:
+                    type_condition = (
+                        self.fragments[selection.name.value].type_condition
+                        if isinstance(selection, FragmentSpreadNode) else selection.type_condition
+                    )
+                    selections.append(InlineFragmentNode(
+                        type_condition=type_condition, directives=selection.directives, selection_set=pruned,
+                    ))
+        return SelectionSetNode(selections=tuple(selections))
+
+    def document_with(self, selection_set, fragments=None):
+        operation = copy_node(self.operation, selection_set=selection_set)
+        return copy_node(self.document, definitions=(
+            operation, *(self.fragments.values() if fragments is None else fragments)
+        ))
+
+    def execute(self, document):
+        # The original document was validated; rewritten ones may leave
+        # fragments unused, which only validation would reject
+        self.executions += 1
+        result = execute(
+            self.schema.graphql_schema,
+            document,
+            root_value=self.root_value,
+            context_value=self.context_value,
+            variable_values=self.variables,
+            operation_name=self.operation_name,
+            middleware=self.middleware,
+        )
+        self.errors += len(result.errors or [])
+        return result
+
+    # Payloads
+
+    def payloads(self):
+        """Yield the initial payload followed by subsequent payloads"""
+        initial = self.execute(self.initial_document(strip_deferred=True))
+        data = initial.data
+        positions = {}
+        for plan in self.streams:
+            connection = (data or {}).get(plan.key)
+            positions[plan.key] = self.pop_position(connection, plan, plan.after)
+        streaming = [
+            plan for plan in self.streams
+            if positions[plan.key][1] and plan.initial_count < plan.total
+        ]
+
+        payload = {'data': data}
+        if initial.errors:
+            payload['errors'] = [error.formatted for error in initial.errors]
+        if data is None:
+            yield payload
+            return
+        payload['hasNext'] = bool(self.has_deferred or streaming)
+        yield payload
+
+        if self.has_deferred:
+            deferred = self.execute(self.deferred_document())
+            for plan in self.streams:
+                self.pop_position((deferred.data or {}).get(plan.key), plan, None)
+            incremental = []
+            self.collect_deferred(self.operation.selection_set, deferred.data, [], incremental)
+            payload = {'incremental': incremental, 'hasNext': bool(streaming)}
+            # The pass re-resolves the initial fields too; only report new errors
+            reported = [error.formatted for error in initial.errors or []]
+            errors = [error.formatted for error in deferred.errors or [] if error.formatted not in reported]
+            if errors:
+                payload['errors'] = errors
+            yield payload
+
+        for index, plan in enumerate(streaming):
+            yield from self.stream(plan, *positions[plan.key], last=index == len(streaming) - 1)
+
+    def stream(self, plan, after, has_next, last):
+        delivered = plan.initial_count
+        first_page_info = None
+        while has_next and delivered < plan.total:
+            count = min(settings.CRM_STREAM_CHUNK_SIZE, plan.total - delivered)
+            document = self.document_with(SelectionSetNode(selections=(self.sliced_field(plan, count, after),)))
+            result = self.execute(document)
+            connection = (result.data or {}).get(plan.key)
+            if first_page_info is None and connection is not None and plan.initial_count == 0:
+                first_page_info = {key: connection.get(key) for key in plan.page_info_keys}
+            after, has_next = self.pop_position(connection, plan, after)
+            edges = (connection or {}).get(plan.edges_key) or []
+            entry = {'items': edges, 'path': [plan.key, plan.edges_key, delivered]}
+            if plan.label:
+                entry['label'] = plan.label
+            if result.errors:
+                entry['errors'] = [error.formatted for error in result.errors]
+                has_next = False
+            delivered += len(edges)
+            if not edges:
+                has_next = False
+            done = not (has_next and delivered < plan.total)
+            incremental = [entry]
+            if done and plan.page_info_keys and connection is not None:
+                incremental.append({
+                    'data': self.merge_page_info(plan, connection, first_page_info),
+                    'path': [plan.key],
+                })
+            yield {'incremental': incremental, 'hasNext': not (done and last)}
+            if done:
+                return
+
+    @staticmethod
+    def pop_position(connection, plan, after):
+        """Remove the bookkeeping fields; return ``(end cursor, has next page)``"""
+        if not connection:
+            return after, False
+        page_info = connection.pop(PAGE_INFO_ALIAS, None) or {}
+        for edge in connection.get(plan.edges_key) or []:
+            edge.pop(CURSOR_ALIAS, None)
+        return page_info.get('endCursor') or after, bool(page_info.get('hasNextPage'))
+
+    @staticmethod
+    def merge_page_info(plan, connection, first_page_info):
+        """Page info of the whole window: the end of the last chunk, the start of the first"""
+        merged = {}
+        for key in plan.page_info_keys:
+            value = connection.get(key)
+            if isinstance(value, dict) and first_page_info and isinstance(first_page_info.get(key), dict):
+                start = first_page_info[key]
+                value = {**value, **{name: start[name] for name in ('startCursor', 'hasPreviousPage') if name in start}}
+            merged[key] = value
+        if plan.initial_count:
+            # The initial payload already holds the start of the window
+            merged = {
+                key: {name: item for name, item in value.items() if name not in ('startCursor', 'hasPreviousPage')}
+                if isinstance(value, dict) else value
+                for key, value in merged.items()
+            }
+        return merged
+
+    def collect_deferred(self, selection_set, value, path, incremental):
+        """Append ``{data, path}`` for every deferred fragment reached in ``value``"""
+        if value is None:
+            return
+        if isinstance(value, list):
+            for index, item in enumerate(value):
+                self.collect_deferred(selection_set, item, [*path, index], incremental)
+            return
+        if not isinstance(value, dict):
+            return
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                key = (selection.alias or selection.name).value
+                if selection.selection_set is not None and key in value:
+                    self.collect_deferred(selection.selection_set, value[key], [*path, key], incremental)
+                continue
+            fragment_selections = self.fragment_selection_set(selection)
+            if enabled(DEFER_DIRECTIVE, selection, self.variables):
+                data = {key: value[key] for key in self.response_keys(fragment_selections) if key in value}
+                if data:
+                    entry = {'data': data, 'path': path}
+                    label = get_directive_values(DEFER_DIRECTIVE, selection, self.variables).get('label')
+                    if label:
+                        entry['label'] = label
+                    incremental.append(entry)
+            self.collect_deferred(fragment_selections, value, path, incremental)
+
+    def fragment_selection_set(self, selection):
+        if isinstance(selection, FragmentSpreadNode):
+            return self.fragments[selection.name.value].selection_set
+        return selection.selection_set
+
+    def response_keys(self, selection_set):
+        """Keys a selection set produces, not counting nested deferred fragments"""
+        keys = []
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                keys.append((selection.alias or selection.name).value)
+            elif not enabled(DEFER_DIRECTIVE, selection, self.variables):
+                keys.extend(self.response_keys(self.fragment_selection_set(selection)))
+        return keys
+
+
+def copy_node(node, **changes):
+    """Shallow copy of an AST node with some attributes replaced"""
+    copy = node.__copy__()
+    for name, value in changes.items():
+        setattr(copy, name, value)
+    return copy
+
+
+def bookkeeping_field(alias, name, selection_set=None):
+    return FieldNode(
+        alias=NameNode(value=alias) if alias else None,
+        name=NameNode(value=name),
+        arguments=(),
+        directives=(),
+        selection_set=selection_set,
+    )
+
+
+PART_HEADER = b'\r\ncontent-type: application/json; charset=utf-8\r\n\r\n'
+
+
+def multipart(payloads):
+    """Frame payloads as a ``multipart/mixed`` body with boundary ``-``"""
+    yield b'\r\n---'
+    for payload in payloads:
+        yield PART_HEADER + encoding.encode(payload) + b'\r\n---'
+    yield b'--\r\n'
@@ -0,0 +1,131 @@
+"""
+Helpers shared by the GraphQL instrumentation (traffic capture, query
+budgets, slow-operation log, metrics).
+"""
+import re
+import time
+from contextlib import ExitStack
+from functools import lru_cache
+
+from django.db import connections
+from graphql import OperationDefinitionNode, parse
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN \((?:\s*(?:%s|\?)\s*,?)+\)", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=512)
+def operation_label(query, operation_name=None):
+    """Return a stable label for an operation.
+
+    Named operations use their name; anonymous ones are labelled by their
+    root fields, e.g. ``allOrders`` or ``allCustomers,allProducts``.
+    """
+    if operation_name:
+        return operation_name
+    try:
+        document = parse(query)
+    except Exception:
+        return 'invalid'
+
+    for definition in document.definitions:
+        if isinstance(definition, OperationDefinitionNode):
+            if definition.name:
+                return definition.name.value
+            fields = [
+                selection.name.value
+                for selection in definition.selection_set.selections
+                if hasattr(selection, 'name')
+            ]
+            return ','.join(fields) or definition.operation.value
+    return 'unknown'
+
+
+@lru_cache(maxsize=512)
+def operation_type(query, operation_name=None):
+    """Return ``'query'``, ``'mutation'`` or ``'subscription'`` for the selected operation"""
+    try:
+        document = parse(query)
+    except Exception:
+        return None
+
+    operations = [
+        definition for definition in document.definitions
+        if isinstance(definition, OperationDefinitionNode)
+    ]
+    for definition in operations:
+        if operation_name is None or (definition.name and definition.name.value == operation_name):
+            return definition.operation.value
+    return None
+
+
+def fingerprint_sql(sql):
+    """Normalize a SQL statement so repeated shapes (N+1 queries) group together"""
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+class CapturedQuery:
+    __slots__ = ('alias', 'sql', 'params', 'duration_ms')
+
+    def __init__(self, alias, sql, params, duration_ms):
+        self.alias = alias
+        self.sql = sql
+        self.params = params
+        self.duration_ms = duration_ms
+
+    @property
+    def fingerprint(self):
+        return fingerprint_sql(self.sql)
+
+
+class QueryRecorder:
+    """Context manager recording every SQL statement run on any database.
+
+    Unlike ``CaptureQueriesContext`` this does not depend on ``DEBUG`` or the
+    bounded ``queries_log`` and also records statement durations.
+    """
+
+    def __init__(self, aliases=None):
+        self.aliases = aliases
+        self.queries = []
+        self._stack = None
+
+    def __len__(self):
+        return len(self.queries)
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for alias in self.aliases or connections:
+            wrapper = self._make_wrapper(alias)
+            self._stack.enter_context(connections[alias].execute_wrapper(wrapper))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def _make_wrapper(self, alias):
+        def record(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                self.queries.append(CapturedQuery(
+                    alias, sql, params, (time.perf_counter() - start) * 1000
+                ))
+        return record
+
+    def fingerprints(self):
+        """Return ``(fingerprint, count, total_ms)`` tuples, most frequent first"""
+        grouped = {}
+        for query in self.queries:
+            count, total = grouped.get(query.fingerprint, (0, 0.0))
+            grouped[query.fingerprint] = (count + 1, total + query.duration_ms)
+        return sorted(
+            ((fingerprint, count, total) for fingerprint, (count, total) in grouped.items()),
+            key=lambda item: (-item[1], -item[2]),
+        )
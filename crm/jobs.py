@@ -0,0 +1,366 @@
+"""
+Background bulk import jobs.
+
+``enqueue`` stores the rows of a customer, product or order import in an
+``ImportJob`` and returns immediately. A pool of worker threads claims
+pending jobs and processes them ``chunk_size`` rows at a time. Each chunk is
+committed in one transaction together with the job's progress counters, so
+a worker that dies loses at most the chunk in flight: once its heartbeat is
+older than ``CRM_IMPORT_JOB_STALE_SECONDS`` the job is put back to pending
+and resumes after the last committed chunk. A worker that was only slow
+finds the progress moved when it tries to commit, rolls its chunk back and
+leaves the job to the worker that recovered it.
+
+Workers run inside the web process (``CRM_IMPORT_WORKERS`` threads, started
+on the first enqueue) or in a separate process with
+``manage.py run_import_workers`` when ``CRM_IMPORT_WORKERS`` is 0.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, connections, transaction
+from django.db.models import F, prefetch_related_objects
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import counting, outbox, pubsub, sharding
+from .models import Customer, ImportJob, Order, OrderLine, Product
+from .phones import to_e164
+from .routers import PRIMARY
+
+logger = logging.getLogger('crm.jobs')
+
+# Per-row errors kept on the job; failed_rows still counts every failure
+MAX_STORED_ERRORS = 1000
+
+# A chunk rolled back by a lock conflict ("database is locked") is retried
+CHUNK_RETRIES = 5
+CHUNK_RETRY_DELAY = 0.2
+
+
+class JobTakenOver(Exception):
+    """Another worker committed this job's next chunk first (after stale recovery)"""
+
+
+def enqueue(kind, rows, chunk_size=None):
+    """Store an import job and wake the workers once it is committed"""
+    rows = json.loads(json.dumps(list(rows), default=str))
+    job = ImportJob.objects.using(PRIMARY).create(
+        kind=kind,
+        payload=rows,
+        total_rows=len(rows),
+        chunk_size=chunk_size or settings.CRM_IMPORT_CHUNK_SIZE,
+    )
+    if settings.CRM_IMPORT_WORKERS:
+        pool = get_pool()
+        transaction.on_commit(pool.notify, using=PRIMARY)
+    return job
+
+
+# Row processors: validate and insert one chunk, return [(row index, error)]
+
+def import_customers(rows, start):
+    from .schema import existing_emails, insert_customers, validate_phone
+
+    errors = []
+    existing = existing_emails([row['email'] for row in rows if row.get('email')])
+
+    pending = defaultdict(list)
+    for index, row in enumerate(rows, start):
+        email = row.get('email')
+        if not row.get('name') or not email:
+            errors.append((index, "Name and email are required"))
+        elif email.lower() in existing:
+            errors.append((index, "Email already exists"))
+        elif row.get('phone') and not validate_phone(row['phone']):
+            errors.append((index, "Invalid phone format"))
+        else:
+            existing.add(email.lower())
+            pending[sharding.db_for_new_customer(email)].append(
+                # bulk_create skips Customer.save(), which fills phone_e164
+                Customer(name=row['name'], email=email, phone=row.get('phone') or '',
+                         phone_e164=to_e164(row.get('phone')))
+            )
+
+    for alias, customers in pending.items():
+        insert_customers(alias, customers)
+    return errors
+
+
+def import_products(rows, start):
+    errors = []
+    products = []
+    for index, row in enumerate(rows, start):
+        try:
+            price = Decimal(str(row.get('price')))
+            stock = int(row.get('stock') or 0)
+        except (InvalidOperation, TypeError, ValueError):
+            errors.append((index, "Invalid price or stock"))
+            continue
+        if not row.get('name'):
+            errors.append((index, "Name is required"))
+        elif price <= 0:
+            errors.append((index, "Price must be positive"))
+        elif stock < 0:
+            errors.append((index, "Stock cannot be negative"))
+        else:
+            products.append(Product(name=row['name'], price=price, stock=stock))
+
+    if not sharding.is_enabled():
+        outbox.record_many(Product.objects.bulk_create(products))
+        counting.written(Product, created=len(products))
+        pubsub.products_created(products)
+    else:
+        for product in products:
+            outbox.record(sharding.create_replicated(
+                Product, name=product.name, price=product.price, stock=product.stock
+            ))
+    return errors
+
+
+def import_orders(rows, start):
+    from .schema import build_order_lines, collect_quantities
+
+    errors = []
+    parsed = []
+    customer_ids = defaultdict(set)
+    product_ids = defaultdict(set)
+    for index, row in enumerate(rows, start):
+        customer_id = str(row.get('customer_id') or '')
+        try:
+            quantities = collect_quantities(row.get('product_ids'), row.get('lines'))
+        except ValueError as e:
+            quantities = str(e)
+        if customer_id.isdigit():
+            alias = sharding.db_for_id(customer_id)
+            customer_ids[alias].add(int(customer_id))
+            if isinstance(quantities, dict):
+                product_ids[alias].update(int(product_id) for product_id in quantities if product_id.isdigit())
+        parsed.append((index, row, customer_id, quantities))
+
+    # One query for the customers and one for the products per shard. Prices
+    # come from the chunk's transaction, not the product catalog
+    customers = {}
+    products = {}
+    for alias, ids in customer_ids.items():
+        customers.update(Customer.objects.using(alias).in_bulk(ids))
+        # Orders reference the copy of a replicated product on their own shard
+        products[alias] = Product.objects.using(alias).in_bulk(product_ids[alias])
+
+    pending = defaultdict(list)
+    for index, row, customer_id, quantities in parsed:
+        customer = customers.get(int(customer_id)) if customer_id.isdigit() else None
+        if customer is None:
+            errors.append((index, f"Customer with ID {customer_id} does not exist"))
+            continue
+        if isinstance(quantities, str):
+            errors.append((index, quantities))
+            continue
+        if not quantities:
+            errors.append((index, "At least one product must be selected"))
+            continue
+        alias = sharding.db_for_id(customer_id)
+        found = products[alias]
+        missing_id = next(
+            (product_id for product_id in quantities
+             if not product_id.isdigit() or int(product_id) not in found),
+            None,
+        )
+        if missing_id is not None:
+            errors.append((index, f"Product with ID {missing_id} does not exist"))
+            continue
+        order_lines, total_amount = build_order_lines(
+            quantities, {product_id: found[int(product_id)] for product_id in quantities}
+        )
+        order_date = row.get('order_date')
+        order = Order(customer=customer, total_amount=total_amount)
+        pending[alias].append(
+            (order, order_lines, parse_datetime(order_date) if order_date else None)
+        )
+
+    for alias, entries in pending.items():
+        orders = sharding.bulk_create(Order, alias, [order for order, _, _ in entries])
+        # bulk_create fills order_date (auto_now_add); imported dates are set afterwards
+        dated = []
+        for order, _, order_date in entries:
+            if order_date:
+                order.order_date = order_date
+                dated.append(order)
+        if dated:
+            Order.objects.using(alias).bulk_update(dated, ['order_date'])
+        lines = []
+        for order, order_lines, _ in entries:
+            for line in order_lines:
+                line.order = order
+            lines.extend(order_lines)
+        OrderLine.objects.using(alias).bulk_create(lines)
+        prefetch_related_objects(orders, 'line_items')
+        outbox.record_many(orders, using=alias)
+        counting.written(Order, using=alias, created=len(orders))
+        counting.written(OrderLine, using=alias, created=len(lines))
+        pubsub.orders_created(orders, using=alias)
+    return errors
+
+
+PROCESSORS = {
+    ImportJob.KIND_CUSTOMERS: import_customers,
+    ImportJob.KIND_PRODUCTS: import_products,
+    ImportJob.KIND_ORDERS: import_orders,
+}
+
+
+# Claiming and processing
+
+def recover_stale_jobs():
+    """Return running jobs whose worker stopped heartbeating to the queue"""
+    stale_before = timezone.now() - timedelta(seconds=settings.CRM_IMPORT_JOB_STALE_SECONDS)
+    return ImportJob.objects.using(PRIMARY).filter(
+        status=ImportJob.STATUS_RUNNING, heartbeat_at__lt=stale_before,
+    ).update(status=ImportJob.STATUS_PENDING)
+
+
+def claim_next_job():
+    """Atomically move the oldest pending job to running; return it or None"""
+    jobs = ImportJob.objects.using(PRIMARY)
+    for job_id in jobs.filter(status=ImportJob.STATUS_PENDING).order_by('created_at', 'id').values_list('id', flat=True)[:5]:
+        now = timezone.now()
+        claimed = jobs.filter(id=job_id, status=ImportJob.STATUS_PENDING).update(
+            status=ImportJob.STATUS_RUNNING,
+            started_at=Coalesce(F('started_at'), now),
+            heartbeat_at=now,
+        )
+        if claimed:
+            return jobs.get(id=job_id)
+    return None
+
+
+def process_chunk(job):
+    """Import the next chunk and commit it with the job's progress"""
+    start = job.processed_rows
+    rows = job.payload[start:start + job.chunk_size]
+    for attempt in range(CHUNK_RETRIES):
+        try:
+            with transaction.atomic(using=PRIMARY), sharding.atomic():
+                errors = PROCESSORS[job.kind](rows, start)
+                # Only commit on top of the progress this chunk started from;
+                # a worker that recovered the job meanwhile keeps it
+                updated = ImportJob.objects.using(PRIMARY).filter(pk=job.pk, processed_rows=start).update(
+                    errors=(job.errors + [{'row': index, 'message': message} for index, message in errors])[:MAX_STORED_ERRORS],
+                    processed_rows=start + len(rows),
+                    failed_rows=F('failed_rows') + len(errors),
+                    succeeded_rows=F('succeeded_rows') + len(rows) - len(errors),
+                    heartbeat_at=timezone.now(),
+                )
+                if not updated:
+                    raise JobTakenOver(f"Import job {job.pk} moved past row {start}")
+            break
+        except OperationalError:
+            if attempt == CHUNK_RETRIES - 1:
+                raise
+            time.sleep(CHUNK_RETRY_DELAY * (attempt + 1))
+    job.refresh_from_db(using=PRIMARY, fields=[
+        'errors', 'processed_rows', 'failed_rows', 'succeeded_rows', 'heartbeat_at',
+    ])
+
+
+def process_job(job, stop_event=None):
+    """Run a claimed job to completion (or until ``stop_event`` is set)"""
+    try:
+        while job.processed_rows < job.total_rows:
+            if stop_event is not None and stop_event.is_set():
+                # Leave it running; it is picked up again once stale
+                return job
+            process_chunk(job)
+    except JobTakenOver:
+        # The chunk was rolled back; the worker that took over finishes the job
+        logger.warning("Import job %s was taken over by another worker", job.pk)
+        return job
+    except Exception as e:
+        logger.exception("Import job %s failed", job.pk)
+        job.status = ImportJob.STATUS_FAILED
+        job.message = str(e)
+    else:
+        job.status = ImportJob.STATUS_COMPLETED
+    job.finished_at = timezone.now()
+    job.save(using=PRIMARY, update_fields=['status', 'message', 'finished_at'])
+    return job
+
+
+def run_pending(max_jobs=None):
+    """Process pending jobs in the calling thread; return the number processed"""
+    processed = 0
+    recover_stale_jobs()
+    while max_jobs is None or processed < max_jobs:
+        job = claim_next_job()
+        if job is None:
+            break
+        process_job(job)
+        processed += 1
+    return processed
+
+
+class WorkerPool:
+    """Threads that poll for pending jobs; ``notify`` wakes them early"""
+
+    def __init__(self, workers, poll_interval=None):
+        self.workers = workers
+        self.poll_interval = poll_interval or settings.CRM_IMPORT_POLL_INTERVAL
+        self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
+        self.threads = []
+
+    def start(self):
+        for number in range(self.workers):
+            thread = threading.Thread(target=self.run, name=f"crm-import-{number}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def notify(self):
+        self.wake_event.set()
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        self.wake_event.set()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            job = None
+            try:
+                close_old_connections()
+                recover_stale_jobs()
+                job = claim_next_job()
+                if job is not None:
+                    process_job(job, self.stop_event)
+            except Exception:
+                logger.exception("Import worker error")
+            finally:
+                connections.close_all()
+            if job is None:
+                self.wake_event.wait(self.poll_interval)
+                self.wake_event.clear()
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Start this process's in-process worker pool on first use"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = WorkerPool(settings.CRM_IMPORT_WORKERS).start()
+            _pool_pid = os.getpid()
+    return _pool
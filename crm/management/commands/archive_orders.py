@@ -0,0 +1,40 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from crm import sharding
+from crm.archive import archive_batch
+
+
+class Command(BaseCommand):
+    help = "Move old orders into the archive table in throttled batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=settings.CRM_ARCHIVE_AFTER_DAYS,
+                            help='Archive orders placed more than this many days ago')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--sleep', type=float, default=0.1,
+                            help='Seconds to pause between batches so live traffic gets the write lock')
+        parser.add_argument('--max-batches', type=int, help='Stop after this many batches per database')
+        parser.add_argument('--database', help='Only archive this database alias')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['older_than_days'])
+        databases = [options['database']] if options['database'] else (sharding.shards() or ['default'])
+
+        for alias in databases:
+            moved = batches = 0
+            while options['max_batches'] is None or batches < options['max_batches']:
+                count = archive_batch(cutoff, options['batch_size'], using=alias)
+                if not count:
+                    break
+                moved += count
+                batches += 1
+                self.stdout.write(f"  {alias}: archived {moved} orders")
+                time.sleep(options['sleep'])
+            self.stdout.write(self.style.SUCCESS(
+                f"{alias}: archived {moved} orders placed before {cutoff:%Y-%m-%d}"
+            ))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from crm import sharding
+from crm.models import Customer
+from crm.phones import backfill
+
+
+class Command(BaseCommand):
+    help = "Fill Customer.phone_e164 for rows written before it existed, in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='Seconds to pause between batches so live traffic gets the write lock')
+        parser.add_argument('--recompute', action='store_true',
+                            help='Also rewrite rows that already have phone_e164 '
+                                 '(e.g. after changing CRM_PHONE_DEFAULT_COUNTRY_CODE)')
+        parser.add_argument('--database', help='Only backfill this database alias')
+
+    def handle(self, *args, **options):
+        databases = [options['database']] if options['database'] else (sharding.shards() or ['default'])
+
+        for alias in databases:
+            updated = 0
+            for updated in backfill(
+                Customer.objects.using(alias),
+                batch_size=options['batch_size'],
+                recompute=options['recompute'],
+                sleep=options['sleep'],
+            ):
+                self.stdout.write(f"  {alias}: normalized {updated} phone numbers")
+            self.stdout.write(self.style.SUCCESS(f"{alias}: normalized {updated} phone numbers"))
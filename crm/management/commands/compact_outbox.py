@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from crm.outbox import compact
+
+
+class Command(BaseCommand):
+    help = "Delete change feed events consumed by every consumer or past retention"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        for alias, deleted in compact(batch_size=options['batch_size']).items():
+            self.stdout.write(self.style.SUCCESS(f"{alias}: deleted {deleted} outbox events"))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from crm import schema_artifact
+
+
+class Command(BaseCommand):
+    help = "Write the GraphQL schema SDL artifact (crm/schema.graphql)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--out', default=str(schema_artifact.ARTIFACT_PATH))
+        parser.add_argument('--check', action='store_true',
+                            help='Only verify the artifact matches the current sources')
+
+    def handle(self, *args, **options):
+        if options['check']:
+            if not schema_artifact.is_current(options['out']):
+                raise CommandError(f"{options['out']} is out of date; run manage.py export_schema")
+            self.stdout.write(self.style.SUCCESS(f"{options['out']} is up to date"))
+            return
+
+        from alx_backend_graphql.schema import get_schema
+        with open(options['out'], 'w', encoding='utf-8') as artifact:
+            artifact.write(schema_artifact.render(get_schema()))
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['out']}"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from crm.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = "Delete idempotency keys whose TTL has expired"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        deleted = purge_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired idempotency keys"))
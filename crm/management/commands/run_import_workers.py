@@ -0,0 +1,29 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from crm.jobs import WorkerPool, run_pending
+
+
+class Command(BaseCommand):
+    help = "Process bulk import jobs outside the web processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=max(settings.CRM_IMPORT_WORKERS, 1))
+        parser.add_argument('--once', action='store_true',
+                            help='Process the pending jobs in this thread and exit')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            processed = run_pending()
+            self.stdout.write(self.style.SUCCESS(f"Processed {processed} import jobs"))
+            return
+
+        pool = WorkerPool(options['workers']).start()
+        self.stdout.write(f"Running {options['workers']} import workers (Ctrl+C to stop)")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pool.stop()
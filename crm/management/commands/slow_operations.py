@@ -0,0 +1,65 @@
+import glob
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Summarize the slow GraphQL operation log, or show entries for one operation"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--operation', help='Only show entries for this operation label')
+        parser.add_argument('--min-ms', type=float, default=0, help='Ignore entries faster than this')
+        parser.add_argument('--limit', type=int, default=10, help='Number of entries to show')
+        parser.add_argument('--plans', action='store_true', help='Print captured query plans')
+
+    def handle(self, *args, **options):
+        entries = [
+            entry for entry in self.read_entries()
+            if entry['duration_ms'] >= options['min_ms']
+            and (not options['operation'] or entry['operation'] == options['operation'])
+        ]
+        if not entries:
+            self.stdout.write("No slow operations recorded.")
+            return
+
+        if not options['operation']:
+            self.print_summary(entries)
+            return
+
+        entries.sort(key=lambda entry: entry['duration_ms'], reverse=True)
+        for entry in entries[:options['limit']]:
+            self.stdout.write(
+                f"{entry['duration_ms']:.1f}ms  {entry['query_count']} queries  "
+                f"variables={json.dumps(entry['variables'])}"
+            )
+            if options['plans']:
+                for plan in entry['plans']:
+                    self.stdout.write(f"    {plan['duration_ms']:.1f}ms {plan['sql']}")
+                    for row in plan['plan']:
+                        self.stdout.write(f"        {row}")
+
+    def read_entries(self):
+        """Yield entries from the current log and its rotated backups"""
+        path = settings.CRM_SLOW_OPERATION_LOG
+        for filename in sorted(glob.glob(f"{path}*")):
+            with open(filename, encoding='utf-8') as log:
+                for line in log:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+
+    def print_summary(self, entries):
+        grouped = defaultdict(list)
+        for entry in entries:
+            grouped[entry['operation']].append(entry['duration_ms'])
+
+        self.stdout.write(f"{'operation':<36} {'count':>7} {'avg ms':>9} {'max ms':>9}")
+        for operation, durations in sorted(grouped.items(), key=lambda item: -sum(item[1])):
+            self.stdout.write(
+                f"{operation[:36]:<36} {len(durations):>7} "
+                f"{sum(durations) / len(durations):>9.1f} {max(durations):>9.1f}"
+            )
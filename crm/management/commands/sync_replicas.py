@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from crm.routers import PRIMARY, replicas
+
+
+class Command(BaseCommand):
+    help = "Copy the primary SQLite database onto every configured read replica"
+
+    def handle(self, *args, **options):
+        if not replicas():
+            raise CommandError("No read replicas configured (set CRM_REPLICA_DATABASES).")
+
+        primary = connections[PRIMARY]
+        primary.ensure_connection()
+        for alias in replicas():
+            replica = connections[alias]
+            replica.ensure_connection()
+            # sqlite3's online backup API copies a consistent snapshot page by page
+            primary.connection.backup(replica.connection)
+            self.stdout.write(self.style.SUCCESS(f"Synced {alias} from {PRIMARY}"))
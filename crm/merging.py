@@ -0,0 +1,145 @@
+"""
+Ordered merging of several querysets into one lazily sliced sequence.
+
+Used to present rows that live in different databases or tables (shards,
+the order archive) as a single result to ``DjangoConnectionField``, which
+only needs ``len()`` and slicing. Each source is fetched already sorted and
+limited to the rows the requested page can need, then merged in Python.
+"""
+import heapq
+from functools import total_ordering
+
+
+@total_ordering
+class Descending:
+    """Invert the comparison of a sort key component"""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def ordering_of(queryset):
+    """Return the effective ordering of ``queryset`` with ``pk`` as tie-breaker"""
+    if isinstance(queryset, MergedQuerySet):
+        return list(queryset.ordering)
+    ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+    for name in ordering:
+        if not isinstance(name, str):
+            raise ValueError(f"Cannot merge querysets ordered by expression {name!r}")
+    if not any(name.lstrip('-') in ('pk', 'id') for name in ordering):
+        ordering.append('pk')
+    return ordering
+
+
+def resolve_attribute(obj, path):
+    for part in path.split('__'):
+        if obj is None:
+            return None
+        obj = getattr(obj, part)
+    return obj
+
+
+def sort_key(ordering):
+    """Build a key function matching SQL ORDER BY semantics (NULLs first when ascending)"""
+    fields = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+
+    def key(obj):
+        parts = []
+        for path, descending in fields:
+            value = resolve_attribute(obj, path)
+            component = (value is not None, value) if value is not None else (False, 0)
+            parts.append(Descending(component) if descending else component)
+        return tuple(parts)
+    return key
+
+
+class MergedQuerySet:
+    """A read-only, sliceable view over several identically ordered querysets"""
+
+    def __init__(self, querysets, start=0, stop=None, ordering=None):
+        self.querysets = list(querysets)
+        self.ordering = ordering or (ordering_of(self.querysets[0]) if self.querysets else ['pk'])
+        self.querysets = [queryset.order_by(*self.ordering) for queryset in self.querysets]
+        self.start = start
+        self.stop = stop
+        self._total = None
+        self._result_cache = None
+
+    @property
+    def model(self):
+        return self.querysets[0].model if self.querysets else None
+
+    def _clone(self, start, stop):
+        clone = MergedQuerySet.__new__(MergedQuerySet)
+        clone.querysets = self.querysets
+        clone.ordering = self.ordering
+        clone.start = start
+        clone.stop = stop
+        clone._total = self._total
+        clone._result_cache = None
+        return clone
+
+    def total(self):
+        """Number of rows across every source, ignoring any slice"""
+        if self._total is None:
+            self._total = sum(queryset.count() for queryset in self.querysets)
+        return self._total
+
+    def count(self):
+        return len(self)
+
+    def order_by(self, *ordering):
+        """Re-order every source; merged results can themselves be merged"""
+        if self.start or self.stop is not None:
+            raise TypeError("Cannot reorder a sliced MergedQuerySet")
+        return MergedQuerySet(self.querysets, ordering=list(ordering))
+
+    def __len__(self):
+        if self._result_cache is not None:
+            return len(self._result_cache)
+        stop = self.total() if self.stop is None else min(self.stop, self.total())
+        return max(0, stop - self.start)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            if item.step not in (None, 1):
+                raise ValueError("MergedQuerySet does not support slice steps")
+            if (item.start is not None and item.start < 0) or (item.stop is not None and item.stop < 0):
+                raise ValueError("Negative indexing is not supported.")
+            start = self.start + (item.start or 0)
+            stop = None if item.stop is None else self.start + item.stop
+            if self.stop is not None:
+                stop = self.stop if stop is None else min(stop, self.stop)
+                start = min(start, self.stop)
+            return self._clone(start, stop)
+        if item < 0:
+            raise ValueError("Negative indexing is not supported.")
+        return list(self[item:item + 1])[0]
+
+    def _fetch(self):
+        limit = self.stop
+        sources = [queryset if limit is None else queryset[:limit] for queryset in self.querysets]
+        merged = heapq.merge(*sources, key=sort_key(self.ordering))
+        rows = []
+        for index, row in enumerate(merged):
+            if limit is not None and index >= limit:
+                break
+            if index >= self.start:
+                rows.append(row)
+        return rows
+
+    def __iter__(self):
+        if self._result_cache is None:
+            self._result_cache = self._fetch()
+        return iter(self._result_cache)
+
+    def __bool__(self):
+        return len(self) > 0
+
@@ -0,0 +1,402 @@
+"""
+In-process metrics with Prometheus text exposition.
+
+Counters and histograms keep their samples in plain dicts guarded by a
+per-metric lock held only for the update itself. With several worker
+processes (gunicorn/uvicorn workers behind ``wsgi.py`` or ``asgi.py``) set
+``CRM_METRICS_MULTIPROCESS_DIR``: every process periodically snapshots its
+samples to ``<dir>/metrics-<pid>-<token>.json`` and ``/metrics`` merges all
+snapshots, so any worker can answer a scrape.
+
+Every process holds a lock on ``metrics-<pid>-<token>.lock`` while it runs,
+and the kernel drops the lock when the process exits. A scrape that can take
+a snapshot's lock folds that snapshot into ``aggregate.json`` before deleting
+it. Counter and histogram totals therefore never go down when a worker is
+recycled. Locks, unlike pids, mean the same thing across PID namespaces.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+from django.conf import settings
+from graphql import get_named_type, is_leaf_type
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200)
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500)
+
+# Caps the number of label combinations per metric so client-chosen
+# operation names cannot grow memory without bound
+MAX_LABEL_SETS = 500
+OVERFLOW_LABEL = '__other__'
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        if key not in self.samples and len(self.samples) >= MAX_LABEL_SETS:
+            return tuple(OVERFLOW_LABEL for _ in self.labelnames)
+        return key
+
+    def reset(self):
+        with self.lock:
+            self.samples = {}
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(key), self._copy(value)] for key, value in self.samples.items()]
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.samples[key] = self.samples.get(key, 0) + amount
+
+    @staticmethod
+    def merge(current, other):
+        return (current or 0) + other
+
+    def render(self, samples):
+        for key, value in samples.items():
+            yield f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}"
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.samples.get(key)
+            if state is None:
+                # [per-bucket counts (last is +Inf), sum, count]
+                state = self.samples[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @staticmethod
+    def _copy(value):
+        return [list(value[0]), value[1], value[2]]
+
+    @staticmethod
+    def merge(current, other):
+        if current is None:
+            return [list(other[0]), other[1], other[2]]
+        return [[a + b for a, b in zip(current[0], other[0])], current[1] + other[1], current[2] + other[2]]
+
+    def render(self, samples):
+        for key, (counts, total, count) in samples.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else format_value(bound)
+                labels = format_labels(self.labelnames + ('le',), key + (le,))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value) if not value.is_integer() else str(int(value))
+    return str(value)
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+AGGREGATE_FILE = 'aggregate.json'
+AGGREGATE_LOCK = 'aggregate.lock'
+
+
+def owner_exited(lock_path):
+    """Whether the process that wrote a snapshot has exited (its lock is free)"""
+    try:
+        fd = os.open(lock_path, os.O_RDWR)
+    except FileNotFoundError:
+        return True
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    finally:
+        os.close(fd)
+    return True
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def read_json(path):
+    try:
+        with open(path, encoding='utf-8') as source:
+            return json.load(source)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path, data):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as target:
+        json.dump(data, target)
+    os.replace(temp_path, path)
+
+
+def snapshot_owner(filename):
+    """``(pid, token)`` of the process that wrote a snapshot file, or None"""
+    if not (filename.startswith('metrics-') and filename.endswith('.json')):
+        return None
+    pid, _, token = filename[len('metrics-'):-len('.json')].partition('-')
+    if not pid.isdigit():
+        return None
+    return int(pid), token
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.pid = os.getpid()
+        self.token = uuid.uuid4().hex[:12]
+        self.last_flush = 0.0
+        self.lock = threading.Lock()
+        # Open while the process runs; see owner_exited()
+        self.lock_file = None
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def check_fork(self):
+        """Drop samples inherited from a parent process after a fork"""
+        pid = os.getpid()
+        if pid != self.pid:
+            self.pid = pid
+            self.token = uuid.uuid4().hex[:12]
+            if self.lock_file is not None:
+                # The parent still holds its lock through its own descriptor
+                self.lock_file.close()
+                self.lock_file = None
+            for metric in self.metrics.values():
+                metric.reset()
+
+    # Multiprocess aggregation
+
+    @staticmethod
+    def multiprocess_dir():
+        return getattr(settings, 'CRM_METRICS_MULTIPROCESS_DIR', None)
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def flush(self, force=False):
+        """Write this process's samples to the shared directory (throttled)"""
+        directory = self.multiprocess_dir()
+        if not directory:
+            return
+        interval = getattr(settings, 'CRM_METRICS_FLUSH_INTERVAL', 1.0)
+        now = time.monotonic()
+        if not force and now - self.last_flush < interval:
+            return
+        with self.lock:
+            self.last_flush = now
+            os.makedirs(directory, exist_ok=True)
+            name = f"metrics-{self.pid}-{self.token}"
+            if self.lock_file is None:
+                # Taken before the first snapshot exists, so no scrape sees it unlocked
+                self.lock_file = open(os.path.join(directory, f"{name}.lock"), 'a')
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            write_json(os.path.join(directory, f"{name}.json"), self.snapshot())
+
+    def fold_exited(self, directory, filenames):
+        """Add the snapshots of exited processes to the aggregate, then delete them.
+
+        The aggregate records the files it absorbed last, so if a scrape dies
+        before deleting them the next one deletes them instead of counting
+        them twice.
+        """
+        aggregate_path = os.path.join(directory, AGGREGATE_FILE)
+        aggregate = read_json(aggregate_path) or {'samples': {}, 'folded': []}
+        for filename in aggregate['folded']:
+            remove(os.path.join(directory, filename))
+        samples = {}
+        self.merge_into(samples, aggregate['samples'])
+        for filename in filenames:
+            data = read_json(os.path.join(directory, filename))
+            if data is not None:
+                self.merge_into(samples, data)
+        write_json(aggregate_path, {
+            'samples': {name: [[list(key), value] for key, value in entries.items()]
+                        for name, entries in samples.items()},
+            'folded': filenames,
+        })
+        for filename in filenames:
+            remove(os.path.join(directory, filename))
+            remove(os.path.join(directory, f"{filename[:-len('.json')]}.lock"))
+
+    def merge_into(self, merged, data):
+        for name, samples in data.items():
+            metric = self.metrics.get(name)
+            if metric is None:
+                continue
+            target = merged.setdefault(name, {})
+            for key, value in samples:
+                key = tuple(key)
+                target[key] = metric.merge(target.get(key), value)
+
+    def collect(self):
+        """Return ``{metric name: {label key: value}}`` across all processes"""
+        self.check_fork()
+        directory = self.multiprocess_dir()
+        if not directory:
+            return {
+                name: {tuple(key): value for key, value in metric.snapshot()}
+                for name, metric in self.metrics.items()
+            }
+
+        self.flush(force=True)
+        merged = {name: {} for name in self.metrics}
+        # Scrapes take turns, so none reads a snapshot another is folding
+        with open(os.path.join(directory, AGGREGATE_LOCK), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            live, exited = [], []
+            for filename in sorted(os.listdir(directory)):
+                owner = snapshot_owner(filename)
+                if owner is None:
+                    continue
+                lock_path = os.path.join(directory, f"{filename[:-len('.json')]}.lock")
+                if owner != (self.pid, self.token) and owner_exited(lock_path):
+                    exited.append(filename)
+                else:
+                    live.append(filename)
+            if exited:
+                self.fold_exited(directory, exited)
+            aggregate = read_json(os.path.join(directory, AGGREGATE_FILE))
+            if aggregate is not None:
+                self.merge_into(merged, aggregate['samples'])
+            for filename in live:
+                data = read_json(os.path.join(directory, filename))
+                if data is not None:
+                    self.merge_into(merged, data)
+        return merged
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format"""
+        collected = self.collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            lines.extend(metric.render(collected.get(name, {})))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+operations_total = registry.register(Counter(
+    'crm_graphql_operations_total', 'GraphQL operations executed.', ('operation', 'status')
+))
+operation_duration = registry.register(Histogram(
+    'crm_graphql_operation_duration_seconds', 'GraphQL operation latency.', ('operation',)
+))
+field_duration = registry.register(Histogram(
+    'crm_graphql_field_duration_seconds', 'Latency of non-scalar GraphQL field resolvers.', ('field',)
+))
+sql_queries = registry.register(Histogram(
+    'crm_graphql_sql_queries', 'SQL queries per GraphQL operation.', ('operation',),
+    buckets=QUERY_COUNT_BUCKETS,
+))
+errors_total = registry.register(Counter(
+    'crm_graphql_errors_total', 'GraphQL errors returned.', ('operation',)
+))
+cache_requests = registry.register(Counter(
+    'crm_cache_requests_total', 'Application cache lookups by result.', ('cache', 'result')
+))
+dataloader_batch_size = registry.register(Histogram(
+    'crm_dataloader_batch_size', 'Keys loaded per batched lookup.', ('loader',),
+    buckets=BATCH_SIZE_BUCKETS,
+))
+pubsub_messages = registry.register(Counter(
+    'crm_pubsub_messages_total', 'Subscription messages delivered to subscribers.', ('topic',)
+))
+pubsub_dropped = registry.register(Counter(
+    'crm_pubsub_dropped_total', 'Subscription messages dropped for slow subscribers.', ('topic',)
+))
+
+
+def observe_operation(label, duration_ms, query_count, error_count=0):
+    """Record one executed GraphQL operation"""
+    registry.check_fork()
+    status = 'error' if error_count else 'ok'
+    operations_total.inc(operation=label, status=status)
+    operation_duration.observe(duration_ms / 1000, operation=label)
+    sql_queries.observe(query_count, operation=label)
+    if error_count:
+        errors_total.inc(error_count, operation=label)
+    registry.flush()
+
+
+def record_cache(cache, hit):
+    """Count a cache lookup; the hit ratio is hits / (hits + misses)"""
+    cache_requests.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def observe_batch(loader, size):
+    """Record the number of keys fetched by one batched lookup"""
+    dataloader_batch_size.observe(size, loader=loader)
+
+
+class FieldMetricsMiddleware:
+    """Graphene middleware timing every resolver that returns a non-scalar.
+
+    Scalar fields resolve from attributes already loaded on the parent and
+    would only add overhead, so they are skipped.
+    """
+
+    def resolve(self, next, root, info, **args):
+        if is_leaf_type(get_named_type(info.return_type)):
+            return next(root, info, **args)
+        start = time.perf_counter()
+        try:
+            return next(root, info, **args)
+        finally:
+            field_duration.observe(
+                time.perf_counter() - start, field=f"{info.parent_type.name}.{info.field_name}"
+            )
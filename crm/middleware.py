@@ -0,0 +1,183 @@
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence, compress_string
+
+from . import routers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class GraphQLTrafficCaptureMiddleware:
+    """Append every GraphQL request to a JSONL file for later replay.
+
+    Each line holds ``timestamp``, ``operationName``, ``query`` and
+    ``variables`` (plus the response status and duration), the format read by
+    ``benchmarks/replay_traffic.py``. Enabled by ``CRM_TRAFFIC_CAPTURE_PATH``.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, get_response):
+        self.path = getattr(settings, 'CRM_TRAFFIC_CAPTURE_PATH', None)
+        if not self.path:
+            raise MiddlewareNotUsed()
+        self.graphql_path = getattr(settings, 'CRM_GRAPHQL_PATH', '/graphql')
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.path.rstrip('/') != self.graphql_path:
+            return self.get_response(request)
+
+        payload = self.extract_operation(request)
+        started = time.time()
+        response = self.get_response(request)
+        if payload is not None:
+            payload.update({
+                'timestamp': started,
+                'status': response.status_code,
+                'duration_ms': round((time.time() - started) * 1000, 3),
+            })
+            self.write(payload)
+        return response
+
+    @staticmethod
+    def extract_operation(request):
+        """Pull query, variables and operation name out of a GET or POST request"""
+        if request.method == 'GET':
+            data = request.GET
+        elif request.content_type == 'application/json':
+            try:
+                data = json.loads(request.body or b'{}')
+            except ValueError:
+                return None
+            if not isinstance(data, dict):
+                return None
+        elif request.content_type == 'application/graphql':
+            data = {'query': request.body.decode('utf-8', 'replace')}
+        else:
+            data = request.POST
+
+        query = data.get('query')
+        if not query:
+            return None
+        variables = data.get('variables')
+        if isinstance(variables, str):
+            try:
+                variables = json.loads(variables)
+            except ValueError:
+                variables = None
+        return {
+            'operationName': data.get('operationName') or None,
+            'query': query,
+            'variables': variables,
+        }
+
+    def write(self, payload):
+        line = json.dumps(payload, default=str) + '\n'
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as capture:
+                capture.write(line)
+
+
+class PrimaryPinningMiddleware:
+    """Scope read-your-writes pinning of the replica router to one request"""
+
+    def __init__(self, get_response):
+        if not routers.replicas():
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with routers.request_scope():
+            return self.get_response(request)
+
+
+class CompressionMiddleware:
+    """Compress responses with brotli or gzip, whichever the client prefers.
+
+    Responses smaller than ``CRM_COMPRESSION_MIN_BYTES`` are sent as they
+    are. Streaming responses (multipart ``@defer``/``@stream`` results, the
+    change stream) are compressed chunk by chunk and flushed after every
+    chunk, so each part still reaches the client as soon as it is produced.
+    brotli is only offered when the ``brotli`` package is installed.
+    """
+
+    BROTLI_QUALITY = 5
+
+    def __init__(self, get_response):
+        self.min_bytes = getattr(settings, 'CRM_COMPRESSION_MIN_BYTES', None)
+        if self.min_bytes is None:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.has_header('Content-Encoding'):
+            return response
+        if not response.streaming and len(response.content) < self.min_bytes:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        coding = self.choose_coding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if coding is None:
+            return response
+
+        if response.streaming:
+            if coding == 'br':
+                response.streaming_content = self.brotli_sequence(response.streaming_content)
+            else:
+                response.streaming_content = compress_sequence(response.streaming_content)
+            del response.headers['Content-Length']
+        else:
+            if coding == 'br':
+                compressed = brotli.compress(response.content, quality=self.BROTLI_QUALITY)
+            else:
+                compressed = compress_string(response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = coding
+        return response
+
+    @staticmethod
+    def choose_coding(accept_encoding):
+        """Return ``'br'``, ``'gzip'`` or None for an ``Accept-Encoding`` header"""
+        weights = {}
+        for item in accept_encoding.split(','):
+            coding, _, params = item.strip().partition(';')
+            quality = 1.0
+            if params.strip().startswith('q='):
+                try:
+                    quality = float(params.strip()[2:])
+                except ValueError:
+                    quality = 0.0
+            if coding:
+                weights[coding.strip().lower()] = quality
+        default = weights.get('*', 0.0)
+        candidates = ['br', 'gzip'] if brotli is not None else ['gzip']
+        accepted = [coding for coding in candidates if weights.get(coding, default) > 0]
+        if not accepted:
+            return None
+        # Highest weight wins; ties go to brotli, which compresses JSON better
+        return max(accepted, key=lambda coding: (weights.get(coding, default), coding == 'br'))
+
+    def brotli_sequence(self, sequence):
+        compressor = brotli.Compressor(quality=self.BROTLI_QUALITY)
+        for chunk in sequence:
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
@@ -0,0 +1,92 @@
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def snapshot_unit_prices(apps, schema_editor):
+    """Existing links were priced at the product's current price"""
+    alias = schema_editor.connection.alias
+    Product = apps.get_model('crm', 'Product')
+    price = Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('price')[:1])
+    for name in ('OrderLine', 'ArchivedOrderLine'):
+        apps.get_model('crm', name).objects.using(alias).update(unit_price=price)
+
+
+class Migration(migrations.Migration):
+    """Turn the order/product links into line items.
+
+    The through models take over the tables Django created for the plain
+    many-to-many relations, so existing links are kept as lines of
+    quantity 1.
+    """
+
+    dependencies = [
+        ('crm', '0003_archivedorder'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='OrderLine',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='line_items', to='crm.order')),
+                        ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_lines', to='crm.product')),
+                    ],
+                    options={
+                        'db_table': 'crm_order_products',
+                        'ordering': ['id'],
+                        'unique_together': {('order', 'product')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='order',
+                    name='products',
+                    field=models.ManyToManyField(related_name='orders', through='crm.OrderLine', to='crm.product'),
+                ),
+                migrations.CreateModel(
+                    name='ArchivedOrderLine',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('order', models.ForeignKey(db_column='archivedorder_id', on_delete=django.db.models.deletion.CASCADE, related_name='line_items', to='crm.archivedorder')),
+                        ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_order_lines', to='crm.product')),
+                    ],
+                    options={
+                        'db_table': 'crm_archivedorder_products',
+                        'ordering': ['id'],
+                        'unique_together': {('order', 'product')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='archivedorder',
+                    name='products',
+                    field=models.ManyToManyField(related_name='archived_orders', through='crm.ArchivedOrderLine', to='crm.product'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='orderline',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='orderline',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=10),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='archivedorderline',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='archivedorderline',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=10),
+            preserve_default=False,
+        ),
+        migrations.RunPython(snapshot_unit_prices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:31
+
+import django.db.models.functions.text
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+
+def check_case_duplicates(apps, schema_editor):
+    # Refuse to guess which of two customers to keep; merge them first
+    Customer = apps.get_model('crm', 'Customer')
+    duplicates = list(
+        Customer.objects.using(schema_editor.connection.alias)
+        .values(email_lower=Lower('email'))
+        .annotate(count=Count('id'))
+        .filter(count__gt=1)
+        .values_list('email_lower', flat=True)[:20]
+    )
+    if duplicates:
+        raise RuntimeError(
+            "Customers share an email that differs only in case; merge them before migrating: "
+            + ", ".join(duplicates)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0007_outbox'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_case_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='customer',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('email'), name='crm_customer_email_ci_unique'),
+        ),
+    ]
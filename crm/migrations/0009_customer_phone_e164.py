@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:33
+
+from django.db import migrations, models
+
+from crm.phones import backfill
+
+
+def fill_phone_e164(apps, schema_editor):
+    """Normalize existing phones so phonePattern matches rows written before the column"""
+    Customer = apps.get_model('crm', 'Customer')
+    for _ in backfill(Customer.objects.using(schema_editor.connection.alias)):
+        pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0008_customer_email_ci_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='phone_e164',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=17, null=True),
+        ),
+        migrations.RunPython(fill_phone_e164, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,21 @@
 from django.db import models
+from django.db.models.functions import Lower
+from django.db.models.lookups import Exact
 from django.core.validators import RegexValidator
+from django.utils import timezone
 from decimal import Decimal
 
+from .phones import to_e164
+
+
+class CustomerQuerySet(models.QuerySet):
+    def with_email(self, email):
+        """Case-insensitive email match, answered by the ``lower(email)`` unique index"""
+        return self.filter(Exact(Lower('email'), email.lower()))
+
+    def with_emails(self, emails):
+        return self.alias(email_lower=Lower('email')).filter(email_lower__in=[email.lower() for email in emails])
+
 
 class Customer(models.Model):
     name = models.CharField(max_length=100)
@@ -11,13 +25,33 @@ class Customer(models.Model):
         message="Phone number must be entered in the format: '+999999999' or '999-999-9999'. Up to 15 digits allowed."
     )
     phone = models.CharField(validators=[phone_regex], max_length=17, blank=True, null=True)
+    # ``phone`` in E.164, kept in step by save(); phonePattern range-scans it
+    phone_e164 = models.CharField(max_length=17, blank=True, null=True, editable=False, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CustomerQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.phone_e164 = to_e164(self.phone)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'phone' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'phone_e164'}
+        super().save(*args, **kwargs)
+
     class Meta:
         ordering = ['name']
+        constraints = [
+            # Alice@Example.com and alice@example.com are the same customer
+            models.UniqueConstraint(Lower('email'), name='crm_customer_email_ci_unique'),
+        ]
+        # One per CustomerFilter ordering
+        indexes = [
+            models.Index(fields=['name', 'id'], name='crm_customer_name_idx'),
+            models.Index(fields=['created_at', 'id'], name='crm_customer_created_idx'),
+        ]
 
 
 class Product(models.Model):
@@ -31,11 +65,17 @@ class Product(models.Model):
 
     class Meta:
         ordering = ['name']
+        # One per ProductFilter ordering
+        indexes = [
+            models.Index(fields=['name', 'id'], name='crm_product_name_idx'),
+            models.Index(fields=['price', 'name', 'id'], name='crm_product_price_idx'),
+            models.Index(fields=['stock', 'id'], name='crm_product_stock_idx'),
+        ]
 
 
 class Order(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='orders')
-    products = models.ManyToManyField(Product, related_name='orders')
+    products = models.ManyToManyField(Product, through='OrderLine', related_name='orders')
     total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
     order_date = models.DateTimeField(auto_now_add=True)
 
@@ -44,3 +84,184 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['-order_date']
+        # One per OrderFilter ordering
+        indexes = [
+            models.Index(fields=['order_date', 'id'], name='crm_order_date_idx'),
+            models.Index(fields=['-total_amount', 'id'], name='crm_order_total_idx'),
+            models.Index(fields=['customer', '-order_date', '-id'], name='crm_order_customer_idx'),
+        ]
+
+
+class OrderLine(models.Model):
+    """A product on an order with its quantity and the unit price paid"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='line_items')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='order_lines')
+    quantity = models.PositiveIntegerField(default=1)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    @property
+    def line_total(self):
+        return self.unit_price * self.quantity
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} on order {self.order_id}"
+
+    class Meta:
+        # Reuses the table of the former auto-created many-to-many relation
+        db_table = 'crm_order_products'
+        unique_together = [('order', 'product')]
+        ordering = ['id']
+
+
+class ArchivedOrder(models.Model):
+    """Order moved out of the hot ``Order`` table by ``manage.py archive_orders``.
+
+    Keeps the original id and the same field names as ``Order`` so filters and
+    the GraphQL ``OrderType`` work on both.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='archived_orders')
+    products = models.ManyToManyField(Product, through='ArchivedOrderLine', related_name='archived_orders')
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
+    order_date = models.DateTimeField(db_index=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archived order {self.id} - {self.customer.name}"
+
+    class Meta:
+        ordering = ['-order_date']
+        # Archived orders are merged into allOrders in the same orderings as Order
+        indexes = [
+            models.Index(fields=['order_date', 'id'], name='crm_archivedorder_date_idx'),
+            models.Index(fields=['-total_amount', 'id'], name='crm_archivedorder_total_idx'),
+            models.Index(fields=['customer', '-order_date', '-id'], name='crm_archivedorder_cust_idx'),
+        ]
+
+
+class ArchivedOrderLine(models.Model):
+    """Line item of an archived order"""
+    order = models.ForeignKey(
+        ArchivedOrder, on_delete=models.CASCADE, related_name='line_items', db_column='archivedorder_id'
+    )
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='archived_order_lines')
+    quantity = models.PositiveIntegerField(default=1)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    @property
+    def line_total(self):
+        return self.unit_price * self.quantity
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} on archived order {self.order_id}"
+
+    class Meta:
+        db_table = 'crm_archivedorder_products'
+        unique_together = [('order', 'product')]
+        ordering = ['id']
+
+
+class IdempotencyKey(models.Model):
+    """Stored result of a mutation executed with a client idempotency key"""
+    operation = models.CharField(max_length=64)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    # Null while the first request holding the key is still executing
+    response = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.operation}:{self.key}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['operation', 'key'], name='crm_idempotency_operation_key'),
+        ]
+
+
+class ImportJob(models.Model):
+    """A bulk import processed in chunks by the background workers"""
+    KIND_CUSTOMERS = 'customers'
+    KIND_PRODUCTS = 'products'
+    KIND_ORDERS = 'orders'
+    KIND_CHOICES = [
+        (KIND_CUSTOMERS, 'Customers'),
+        (KIND_PRODUCTS, 'Products'),
+        (KIND_ORDERS, 'Orders'),
+    ]
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    payload = models.JSONField()
+    chunk_size = models.PositiveIntegerField(default=1000)
+    total_rows = models.PositiveIntegerField(default=0)
+    # Rows covered by committed chunks; a restarted worker resumes here
+    processed_rows = models.PositiveIntegerField(default=0)
+    succeeded_rows = models.PositiveIntegerField(default=0)
+    failed_rows = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    message = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def rows_per_second(self):
+        if not self.started_at or not self.processed_rows:
+            return 0.0
+        end = self.finished_at or timezone.now()
+        elapsed = (end - self.started_at).total_seconds()
+        return self.processed_rows / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self):
+        return f"{self.kind} import #{self.pk} ({self.status})"
+
+    class Meta:
+        ordering = ['-created_at']
+
+
+class OutboxEvent(models.Model):
+    """A change to a CRM entity, written in the transaction that made it"""
+    ACTION_CREATED = 'created'
+    ACTION_UPDATED = 'updated'
+    ACTION_CHOICES = [
+        (ACTION_CREATED, 'Created'),
+        (ACTION_UPDATED, 'Updated'),
+    ]
+
+    # Monotonically increasing per database; consumers resume after it
+    id = models.BigAutoField(primary_key=True)
+    entity = models.CharField(max_length=32)
+    entity_id = models.BigIntegerField()
+    action = models.CharField(max_length=16, choices=ACTION_CHOICES)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.entity} {self.entity_id} {self.action}"
+
+    class Meta:
+        ordering = ['id']
+
+
+class OutboxConsumer(models.Model):
+    """Position of a downstream consumer in the change feed"""
+    name = models.CharField(max_length=100, unique=True)
+    cursor = models.CharField(max_length=500)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,198 @@
+"""
+Transactional outbox and change feed.
+
+Mutations record an ``OutboxEvent`` for every row they create, inside the
+transaction that writes the row, so the feed never shows a change that was
+rolled back and never misses one that committed. Events live on the same
+database as the entity (each shard has its own outbox) and are read back in
+id order; SQLite serializes writers, so ids become visible in order.
+
+A feed cursor is the last event id read on every database, encoded as an
+opaque string. Consumers that store their cursor with ``ackChanges`` let
+``compact_outbox`` delete the events all of them have read.
+"""
+import base64
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from . import sharding
+from .models import Order, OutboxConsumer, OutboxEvent
+from .routers import PRIMARY
+
+MAX_LIMIT = 1000
+
+
+def databases():
+    """Databases holding an outbox"""
+    return sharding.shards() or [PRIMARY]
+
+
+# Recording
+
+def serialize(instance):
+    """JSON payload of an entity; orders include their line items"""
+    payload = {field.attname: getattr(instance, field.attname) for field in instance._meta.concrete_fields}
+    if isinstance(instance, Order):
+        if 'line_items' in getattr(instance, '_prefetched_objects_cache', {}):
+            # Bulk writers prefetch the lines of all their orders at once
+            lines = instance.line_items.all()
+        else:
+            lines = instance.line_items.using(instance._state.db)
+        payload['lines'] = [
+            {'product_id': line.product_id, 'quantity': line.quantity, 'unit_price': line.unit_price}
+            for line in lines
+        ]
+    return json.loads(json.dumps(payload, cls=DjangoJSONEncoder))
+
+
+def build_event(instance, action):
+    return OutboxEvent(
+        entity=instance._meta.object_name,
+        entity_id=instance.pk,
+        action=action,
+        payload=serialize(instance),
+    )
+
+
+def record(instance, action=OutboxEvent.ACTION_CREATED):
+    """Add an event for ``instance`` on its database (call inside the write's transaction)"""
+    using = instance._state.db
+    if sharding.is_replicated(type(instance)):
+        # Replicated rows are announced once, from the first shard
+        using = sharding.shards()[0]
+    event = build_event(instance, action)
+    event.save(using=using)
+    return event
+
+
+def record_many(instances, action=OutboxEvent.ACTION_CREATED, using=None):
+    """Add events for rows written with ``bulk_create`` on ``using``"""
+    events = [build_event(instance, action) for instance in instances if instance.pk is not None]
+    OutboxEvent.objects.using(using).bulk_create(events)
+
+
+# Cursors
+
+def encode_cursor(positions):
+    raw = json.dumps(positions, sort_keys=True, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Return ``{database: last event id}``; an empty cursor starts from the beginning"""
+    if not cursor:
+        return {}
+    try:
+        positions = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise ValueError(f"Invalid change cursor {cursor!r}")
+    if not isinstance(positions, dict) or not all(isinstance(value, int) for value in positions.values()):
+        raise ValueError(f"Invalid change cursor {cursor!r}")
+    return positions
+
+
+# Reading
+
+def read_changes(cursor=None, limit=100):
+    """Return ``(events, next cursor, has more)`` for events after ``cursor``"""
+    positions = decode_cursor(cursor)
+    limit = max(1, min(limit, MAX_LIMIT))
+
+    candidates = []
+    more = False
+    for alias in databases():
+        events = list(
+            OutboxEvent.objects.using(alias)
+            .filter(id__gt=positions.get(alias, 0))
+            .order_by('id')[:limit + 1]
+        )
+        more = more or len(events) > limit
+        # Concurrent writers can commit ids out of created_at order. Sorting on
+        # the latest created_at up to each event keeps every database in id
+        # order, so the cut below always returns a contiguous run of ids and
+        # the cursor never passes an id it has not returned
+        latest = None
+        for event in events[:limit]:
+            latest = event.created_at if latest is None else max(latest, event.created_at)
+            candidates.append((latest, alias, event))
+
+    # Interleave databases by time
+    candidates.sort(key=lambda candidate: (candidate[0], candidate[1], candidate[2].id))
+    selected = candidates[:limit]
+    more = more or len(candidates) > limit
+
+    positions = dict(positions)
+    events = []
+    for _, alias, event in selected:
+        positions[alias] = max(positions.get(alias, 0), event.id)
+        event.database = alias
+        events.append(event)
+    return events, encode_cursor(positions), more
+
+
+def iter_changes(cursor=None, batch_size=500, follow=0.0, poll_interval=1.0):
+    """Yield ``(event, cursor after it)``, polling for up to ``follow`` seconds once caught up"""
+    positions = decode_cursor(cursor)
+    deadline = time.monotonic() + follow
+    while True:
+        events, _, has_more = read_changes(encode_cursor(positions), batch_size)
+        for event in events:
+            # Never move a position backwards
+            positions[event.database] = max(positions.get(event.database, 0), event.id)
+            yield event, encode_cursor(positions)
+        if has_more:
+            continue
+        if time.monotonic() + poll_interval > deadline:
+            return
+        time.sleep(poll_interval)
+
+
+def event_to_dict(event):
+    return {
+        'id': event.id,
+        'database': getattr(event, 'database', None),
+        'entity': event.entity,
+        'entity_id': event.entity_id,
+        'action': event.action,
+        'payload': event.payload,
+        'created_at': event.created_at.isoformat(),
+    }
+
+
+# Consumers and compaction
+
+def acknowledge(consumer, cursor):
+    """Store how far ``consumer`` has processed the feed"""
+    decode_cursor(cursor)
+    OutboxConsumer.objects.using(PRIMARY).update_or_create(name=consumer, defaults={'cursor': cursor})
+
+
+def compact(now=None, batch_size=5000):
+    """Delete events read by every consumer or older than the retention period.
+
+    Returns the number of deleted events per database.
+    """
+    now = now or timezone.now()
+    retention_start = now - timedelta(days=settings.CRM_OUTBOX_RETENTION_DAYS)
+    consumers = [decode_cursor(cursor) for cursor in OutboxConsumer.objects.using(PRIMARY).values_list('cursor', flat=True)]
+
+    deleted = {}
+    for alias in databases():
+        events = OutboxEvent.objects.using(alias)
+        removable = events.filter(created_at__lt=retention_start)
+        if consumers:
+            consumed = min(positions.get(alias, 0) for positions in consumers)
+            removable = events.filter(id__lte=consumed) | removable
+        count = 0
+        while True:
+            batch = list(removable.values_list('id', flat=True)[:batch_size])
+            if not batch:
+                break
+            count += events.filter(id__in=batch).delete()[0]
+        deleted[alias] = count
+    return deleted
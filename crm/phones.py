@@ -0,0 +1,81 @@
+"""
+E.164 phone numbers.
+
+``Customer.phone`` keeps the number as entered (``+1234567890``,
+``123-456-7890``); ``Customer.phone_e164`` holds it as ``+`` and digits,
+indexed, so prefix searches are a range scan on that column. A number
+without a leading ``+`` is a national number in
+``settings.CRM_PHONE_DEFAULT_COUNTRY_CODE``; a national trunk prefix equal
+to the country code (``1-123-456-7890`` with country code 1) is dropped.
+"""
+import time
+
+from django.conf import settings
+
+# Smallest character sorting after every digit: '+1' <= '+1...' < '+1:'
+_AFTER_DIGITS = ':'
+
+
+def _digits(value):
+    return ''.join(char for char in value if char.isdigit())
+
+
+def to_e164(phone):
+    """``phone`` as ``+<country code><number>``, or None when it has no digits"""
+    if not phone:
+        return None
+    digits = _digits(phone)
+    if not digits:
+        return None
+    if phone.lstrip().startswith('+'):
+        return '+' + digits
+    country_code = settings.CRM_PHONE_DEFAULT_COUNTRY_CODE
+    if digits.startswith(country_code) and len(digits) == 10 + len(country_code):
+        digits = digits[len(country_code):]
+    return '+' + country_code + digits
+
+
+def prefix_bounds(pattern):
+    """``(low, high)`` so ``low <= phone_e164 < high`` matches numbers starting with ``pattern``.
+
+    ``pattern`` is read like a stored number: ``+44`` is a country code,
+    ``123`` a national prefix. Returns None when it has no digits.
+    """
+    digits = _digits(pattern)
+    if not digits:
+        return None
+    if pattern.lstrip().startswith('+'):
+        prefix = '+' + digits
+    else:
+        prefix = '+' + settings.CRM_PHONE_DEFAULT_COUNTRY_CODE + digits
+    return prefix, prefix + _AFTER_DIGITS
+
+
+def backfill(customers, batch_size=1000, recompute=False, sleep=0.0):
+    """Fill ``phone_e164`` for ``customers`` (a queryset) one batch at a time.
+
+    Yields the running number of rows updated after each batch. Only uses
+    the queryset's model, so migrations can pass a historical one.
+    """
+    customers = customers.exclude(phone__isnull=True).exclude(phone='')
+    if not recompute:
+        customers = customers.filter(phone_e164__isnull=True)
+    manager = customers.model._base_manager.db_manager(customers.db)
+
+    # Walk by id so rows whose phone has no digits (left null) are not revisited
+    last_id = updated = 0
+    while True:
+        batch = list(customers.filter(id__gt=last_id).order_by('id').only('id', 'phone', 'phone_e164')[:batch_size])
+        if not batch:
+            return
+        last_id = batch[-1].id
+        changed = []
+        for customer in batch:
+            normalized = to_e164(customer.phone)
+            if normalized != customer.phone_e164:
+                customer.phone_e164 = normalized
+                changed.append(customer)
+        manager.bulk_update(changed, ['phone_e164'])
+        updated += len(changed)
+        yield updated
+        time.sleep(sleep)
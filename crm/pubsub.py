@@ -0,0 +1,229 @@
+"""
+In-process publish/subscribe bus for GraphQL subscriptions.
+
+Model signals publish one plain-dict payload per committed change; every
+subscriber of the topic receives that same object, so fanning out to many
+WebSocket clients costs no database queries. Subscribers are asyncio queues
+owned by the ASGI event loop, and publishing is safe from any thread.
+
+The backend is chosen with ``settings.CRM_PUBSUB_BACKEND``. The default
+``InMemoryBroker`` only reaches subscribers in the same process; with
+several ASGI workers, point the setting at a broker class implementing
+``publish``/``subscribe`` on top of a shared transport.
+"""
+import asyncio
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_init, post_save
+from django.utils.module_loading import import_string
+
+from . import metrics, sharding
+from .models import Order, OrderLine, Product
+
+ORDER_CREATED = 'order_created'
+STOCK_CHANGED = 'stock_changed'
+
+# Messages kept per subscriber before the oldest are dropped
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class Broker:
+    """Backend interface"""
+
+    def publish(self, topic, message):
+        raise NotImplementedError
+
+    def has_subscribers(self, topic):
+        """False lets publishers skip building a payload nobody receives"""
+        return True
+
+    def subscribe(self, topic):
+        """Return an async iterator of the messages published to ``topic``"""
+        raise NotImplementedError
+
+
+class Subscription:
+    """One subscriber's queue; iterate it inside the event loop"""
+
+    def __init__(self, broker, topic, loop):
+        self.broker = broker
+        self.topic = topic
+        self.loop = loop
+        self.queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+
+    def deliver(self, message):
+        # Runs on the subscriber's loop; a slow client loses its oldest messages
+        if self.queue.full():
+            self.queue.get_nowait()
+            metrics.pubsub_dropped.inc(topic=self.topic)
+        self.queue.put_nowait(message)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InMemoryBroker(Broker):
+    def __init__(self):
+        self.subscribers = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, topic):
+        subscription = Subscription(self, topic, asyncio.get_running_loop())
+        with self.lock:
+            self.subscribers.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.get(subscription.topic, set()).discard(subscription)
+
+    def has_subscribers(self, topic):
+        return bool(self.subscribers.get(topic))
+
+    def publish(self, topic, message):
+        with self.lock:
+            subscribers = list(self.subscribers.get(topic, ()))
+        for subscription in subscribers:
+            if subscription.loop.is_closed():
+                self.unsubscribe(subscription)
+                continue
+            subscription.loop.call_soon_threadsafe(subscription.deliver, message)
+        metrics.pubsub_messages.inc(len(subscribers), topic=topic)
+        return len(subscribers)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.CRM_PUBSUB_BACKEND)()
+    return _broker
+
+
+def publish(topic, message):
+    return get_broker().publish(topic, message)
+
+
+def has_subscribers(topic):
+    return get_broker().has_subscribers(topic)
+
+
+def subscribe(topic):
+    return get_broker().subscribe(topic)
+
+
+async def listen(topic):
+    """Async generator over ``topic`` that unsubscribes when closed"""
+    subscription = subscribe(topic)
+    try:
+        async for message in subscription:
+            yield message
+    finally:
+        subscription.close()
+
+
+# Payloads, built once per event
+
+def order_payload(order_id, using):
+    order = Order.objects.using(using).select_related('customer').get(id=order_id)
+    lines = OrderLine.objects.using(using).filter(order_id=order_id).select_related('product')
+    return {
+        'id': order.id,
+        'customer_id': order.customer_id,
+        'customer_name': order.customer.name,
+        'total_amount': order.total_amount,
+        'order_date': order.order_date,
+        'lines': [
+            {
+                'product_id': line.product_id,
+                'product_name': line.product.name,
+                'quantity': line.quantity,
+                'unit_price': line.unit_price,
+            }
+            for line in lines
+        ],
+    }
+
+
+def product_payload(product, previous_stock):
+    return {
+        'id': product.id,
+        'name': product.name,
+        'price': product.price,
+        'stock': product.stock,
+        'previous_stock': previous_stock,
+    }
+
+
+# Signal handlers
+
+def remember_stock(sender, instance, **kwargs):
+    # Read from __dict__ so a deferred stock field is not loaded
+    instance._published_stock = instance.__dict__.get('stock') if instance.pk else None
+
+
+def order_saved(sender, instance, created, using, **kwargs):
+    if not created:
+        return
+
+    def publish_order():
+        if has_subscribers(ORDER_CREATED):
+            publish(ORDER_CREATED, order_payload(instance.pk, using))
+
+    # Published after commit, when the order's line items exist as well
+    transaction.on_commit(publish_order, using=using)
+
+
+def orders_created(orders, using=None):
+    """Publish ``orderCreated`` for orders written with ``bulk_create`` (which sends no signals)"""
+    ids = [order.pk for order in orders]
+
+    def publish_orders():
+        if has_subscribers(ORDER_CREATED):
+            for order_id in ids:
+                publish(ORDER_CREATED, order_payload(order_id, using))
+
+    transaction.on_commit(publish_orders, using=using)
+
+
+def products_created(products, using=None):
+    """Publish ``stockChanged`` for products written with ``bulk_create``"""
+    if not has_subscribers(STOCK_CHANGED):
+        return
+    payloads = [product_payload(product, None) for product in products]
+
+    def publish_products():
+        for payload in payloads:
+            publish(STOCK_CHANGED, payload)
+
+    transaction.on_commit(publish_products, using=using)
+
+
+def product_saved(sender, instance, created, using, **kwargs):
+    if sharding.is_replicated(Product) and using != sharding.shards()[0]:
+        return
+    previous = None if created else getattr(instance, '_published_stock', None)
+    if not created and previous == instance.stock:
+        return
+    instance._published_stock = instance.stock
+    if has_subscribers(STOCK_CHANGED):
+        payload = product_payload(instance, previous)
+        transaction.on_commit(lambda: publish(STOCK_CHANGED, payload), using=using)
+
+
+def connect():
+    post_init.connect(remember_stock, sender=Product, dispatch_uid='crm.pubsub.remember_stock')
+    post_save.connect(order_saved, sender=Order, dispatch_uid='crm.pubsub.order_saved')
+    post_save.connect(product_saved, sender=Product, dispatch_uid='crm.pubsub.product_saved')
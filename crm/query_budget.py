@@ -0,0 +1,107 @@
+"""
+SQL query budgets per GraphQL operation.
+
+Budgets are declared in ``settings.CRM_QUERY_BUDGETS`` keyed by operation
+label (the operation name, or the root fields of an anonymous operation).
+Tests use ``query_budget``/``execute_with_budget`` to fail when a change adds
+queries; in production ``check_operation`` logs offenders with the SQL
+fingerprints that made up the excess.
+"""
+import logging
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .instrumentation import QueryRecorder, operation_label
+
+logger = logging.getLogger('crm.query_budget')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised in tests when an operation runs more SQL queries than allowed"""
+
+    def __init__(self, label, budget, recorder):
+        self.label = label
+        self.budget = budget
+        self.recorder = recorder
+        super().__init__(
+            f"{label} executed {len(recorder)} SQL queries (budget {budget}):\n"
+            + format_fingerprints(recorder)
+        )
+
+
+def get_query_budget(label):
+    """Return the declared budget for an operation label, or None"""
+    return getattr(settings, 'CRM_QUERY_BUDGETS', {}).get(label)
+
+
+def format_fingerprints(recorder, limit=5):
+    """Render the most frequent statement shapes for an error or log line"""
+    lines = []
+    for fingerprint, count, total_ms in recorder.fingerprints()[:limit]:
+        lines.append(f"  {count}x ({total_ms:.1f}ms) {fingerprint}")
+    return '\n'.join(lines)
+
+
+@contextmanager
+def query_budget(label_or_budget):
+    """Fail the enclosed block if it runs more queries than the budget.
+
+    Accepts either an operation label declared in ``CRM_QUERY_BUDGETS`` or
+    an explicit integer budget::
+
+        with query_budget('allOrders'):
+            schema.execute(query)
+    """
+    if isinstance(label_or_budget, int):
+        label, budget = 'block', label_or_budget
+    else:
+        label, budget = label_or_budget, get_query_budget(label_or_budget)
+        if budget is None:
+            raise KeyError(f"No query budget declared for {label_or_budget!r}")
+
+    with QueryRecorder() as recorder:
+        yield recorder
+    if len(recorder) > budget:
+        raise QueryBudgetExceeded(label, budget, recorder)
+
+
+def execute_with_budget(schema, query, variables=None, operation_name=None, budget=None):
+    """Execute ``query`` on ``schema`` and fail if it exceeds its budget.
+
+    Without an explicit ``budget`` the one declared for the operation label
+    is used.
+    """
+    label = operation_label(query, operation_name)
+    if budget is None:
+        budget = get_query_budget(label)
+        if budget is None:
+            raise KeyError(f"No query budget declared for {label!r}")
+
+    with QueryRecorder() as recorder:
+        result = schema.execute(query, variable_values=variables, operation_name=operation_name)
+    if len(recorder) > budget:
+        raise QueryBudgetExceeded(label, budget, recorder)
+    return result
+
+
+def check_operation(label, recorder, executions=1):
+    """Log operations that exceed their budget (or the default threshold).
+
+    An operation delivered incrementally executes once per payload pass and
+    gets its budget for each of the ``executions``.
+    """
+    budget = get_query_budget(label)
+    if budget is None:
+        budget = getattr(settings, 'CRM_QUERY_BUDGET_DEFAULT', None)
+    if budget is None:
+        return False
+    budget *= executions
+    if len(recorder) <= budget:
+        return False
+
+    logger.warning(
+        "GraphQL operation %s executed %d SQL queries (budget %d)\n%s",
+        label, len(recorder), budget, format_fingerprints(recorder),
+    )
+    return True
@@ -0,0 +1,47 @@
+"""
+Local replica sync shim.
+
+Replays every committed write statement from the primary connection onto
+each read replica, so two SQLite files stay in sync while developing or
+testing the read/write router. Not meant for production replication:
+replicas must start as copies of the primary (``manage.py sync_replicas``)
+and must not be written to directly.
+"""
+from functools import partial
+
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+
+from .routers import PRIMARY, replicas
+
+WRITE_PREFIXES = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+def replay(sql, params, many):
+    for alias in replicas():
+        with connections[alias].cursor() as cursor:
+            if many:
+                cursor.executemany(sql, params)
+            else:
+                cursor.execute(sql, params)
+
+
+def replay_writes(execute, sql, params, many, context):
+    if many:
+        params = list(params)
+    result = execute(sql, params, many, context)
+    if sql.lstrip()[:7].upper().startswith(WRITE_PREFIXES):
+        # on_commit runs immediately in autocommit mode and is discarded
+        # together with any savepoint or transaction that rolls back
+        transaction.on_commit(partial(replay, sql, params, many), using=PRIMARY)
+    return result
+
+
+def attach(sender, connection, **kwargs):
+    if connection.alias == PRIMARY and replay_writes not in connection.execute_wrappers:
+        connection.execute_wrappers.append(replay_writes)
+
+
+def install():
+    """Start replaying primary writes onto the configured replicas"""
+    connection_created.connect(attach, dispatch_uid='crm_replica_replay')
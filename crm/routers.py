@@ -0,0 +1,82 @@
+"""
+Database routing for read replicas.
+
+Reads go to one of ``settings.CRM_READ_REPLICAS`` and writes to ``default``.
+Once a request writes (or runs a GraphQL mutation) it is pinned to the
+primary for the rest of the request so it always reads its own writes.
+Pinning only lasts for a ``request_scope``; outside one (import worker
+threads, management commands) reads inside an ``atomic`` block on the
+primary go to the primary and the rest to the replicas.
+"""
+import contextvars
+import itertools
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+PRIMARY = 'default'
+
+# None outside a request scope: there is nothing to pin
+_pinned = contextvars.ContextVar('crm_primary_pinned', default=None)
+_replica_cycle = ((), None)
+
+
+def replicas():
+    return getattr(settings, 'CRM_READ_REPLICAS', [])
+
+
+def pin_primary():
+    """Route every further read in the current request scope to the primary"""
+    if _pinned.get() is not None:
+        _pinned.set(True)
+
+
+def is_pinned():
+    return bool(_pinned.get())
+
+
+@contextmanager
+def request_scope():
+    """Reset primary pinning at the start and end of a request"""
+    token = _pinned.set(False)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+def next_replica():
+    global _replica_cycle
+    pool, cycle = _replica_cycle
+    if pool != tuple(replicas()):
+        pool = tuple(replicas())
+        cycle = itertools.cycle(pool)
+        _replica_cycle = (pool, cycle)
+    return next(cycle)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not replicas() or is_pinned() or connections[PRIMARY].in_atomic_block:
+            # A transaction on the primary reads its own uncommitted writes
+            return PRIMARY
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # Follow relations on the database the instance came from
+            return instance._state.db
+        return next_replica()
+
+    def db_for_write(self, model, **hints):
+        if replicas():
+            pin_primary()
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {PRIMARY, *replicas()}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
@@ -1,13 +1,21 @@
 import graphene
 from graphene_django import DjangoObjectType
-from graphene_django.filter import DjangoFilterConnectionField
+from graphql import FieldNode, FragmentSpreadNode, GraphQLError
 from django.core.exceptions import ValidationError
-from django.db import transaction
 from decimal import Decimal
 from datetime import datetime
 import re
+from collections import Counter, defaultdict
+from functools import lru_cache
 
-from .models import Customer, Product, Order
+from django.db import IntegrityError, transaction
+
+from . import catalog, counting, incremental, jobs, nodes, outbox, pubsub, sharding
+from .idempotency import idempotent
+from .phones import to_e164
+from .fields import CountedConnection, CRMFilterConnectionField, LoadedFilterConnectionField
+from .models import Customer, Product, Order, OrderLine, ArchivedOrder, ArchivedOrderLine, ImportJob, OutboxEvent
+from .routers import PRIMARY
 from .filters import CustomerFilter, ProductFilter, OrderFilter
 
 
@@ -18,6 +26,7 @@ class CustomerType(DjangoObjectType):
         fields = '__all__'
         filterset_class = CustomerFilter
         interfaces = (graphene.relay.Node,)
+        connection_class = CountedConnection
 
 
 class ProductType(DjangoObjectType):
@@ -26,14 +35,148 @@ class ProductType(DjangoObjectType):
         fields = '__all__'
         filterset_class = ProductFilter
         interfaces = (graphene.relay.Node,)
+        connection_class = CountedConnection
+
+
+def selects_field(info, name):
+    """Whether a field called ``name`` is selected anywhere below the one being resolved"""
+    if info is None:
+        return False
+    pending = [node.selection_set for node in info.field_nodes if node.selection_set is not None]
+    spread = set()
+    while pending:
+        for selection in pending.pop().selections:
+            if isinstance(selection, FragmentSpreadNode):
+                fragment = info.fragments.get(selection.name.value)
+                if fragment is not None and fragment.name.value not in spread:
+                    spread.add(fragment.name.value)
+                    pending.append(fragment.selection_set)
+            elif isinstance(selection, FieldNode) and selection.name.value == name:
+                return True
+            elif selection.selection_set is not None:
+                pending.append(selection.selection_set)
+    return False
 
 
 class OrderType(DjangoObjectType):
+    products = LoadedFilterConnectionField(ProductType, required=True)
+
     class Meta:
         model = Order
         fields = '__all__'
         filterset_class = OrderFilter
         interfaces = (graphene.relay.Node,)
+        connection_class = CountedConnection
+
+    @classmethod
+    def get_queryset(cls, queryset, info):
+        # Every order query renders the customer; avoid one query per order
+        queryset = queryset.select_related('customer')
+        if selects_field(info, 'products'):
+            # One query for every order's lines; their products come from the
+            # catalog, or from one more query when it is not available
+            if catalog.get_catalog() is None:
+                queryset = queryset.prefetch_related('line_items__product')
+            else:
+                queryset = queryset.prefetch_related('line_items')
+        return queryset
+
+    def resolve_products(root, info, **kwargs):
+        if not counting.filter_arguments(kwargs) and kwargs.get('order_by') is None:
+            products = catalog.order_products(root)
+            if products is not None:
+                return products
+        return root.products.all()
+
+    @classmethod
+    def is_type_of(cls, root, info):
+        # Archived orders keep their id and fields and are served as orders
+        if isinstance(root, ArchivedOrder):
+            return True
+        return super().is_type_of(root, info)
+
+
+class OrderLineType(DjangoObjectType):
+    line_total = graphene.Decimal()
+
+    class Meta:
+        model = OrderLine
+        fields = ('id', 'product', 'quantity', 'unit_price')
+        interfaces = (graphene.relay.Node,)
+
+    @classmethod
+    def get_queryset(cls, queryset, info):
+        return queryset.select_related('product')
+
+    @classmethod
+    def is_type_of(cls, root, info):
+        if isinstance(root, ArchivedOrderLine):
+            return True
+        return super().is_type_of(root, info)
+
+    def resolve_line_total(self, info):
+        return self.line_total
+
+
+class ImportRowError(graphene.ObjectType):
+    row = graphene.Int()
+    message = graphene.String()
+
+
+class ImportJobType(DjangoObjectType):
+    progress = graphene.Float(description="Fraction of rows processed (0-1)")
+    rows_per_second = graphene.Float()
+    errors = graphene.List(ImportRowError)
+
+    class Meta:
+        model = ImportJob
+        exclude = ('payload', 'heartbeat_at')
+
+    def resolve_progress(self, info):
+        return self.processed_rows / self.total_rows if self.total_rows else 1.0
+
+    def resolve_rows_per_second(self, info):
+        return round(self.rows_per_second, 1)
+
+    def resolve_errors(self, info):
+        return [ImportRowError(**error) for error in self.errors]
+
+
+class ChangeEventType(DjangoObjectType):
+    class Meta:
+        model = OutboxEvent
+        fields = ('id', 'entity', 'entity_id', 'action', 'payload', 'created_at')
+
+
+class ChangeFeed(graphene.ObjectType):
+    events = graphene.List(ChangeEventType)
+    cursor = graphene.String(description="Pass as `since` to continue after these events")
+    has_more = graphene.Boolean()
+
+
+# Subscription payloads, resolved from the dicts published by crm.pubsub
+class OrderEventLine(graphene.ObjectType):
+    product_id = graphene.ID()
+    product_name = graphene.String()
+    quantity = graphene.Int()
+    unit_price = graphene.Decimal()
+
+
+class OrderCreatedEvent(graphene.ObjectType):
+    id = graphene.ID()
+    customer_id = graphene.ID()
+    customer_name = graphene.String()
+    total_amount = graphene.Decimal()
+    order_date = graphene.DateTime()
+    lines = graphene.List(OrderEventLine)
+
+
+class StockChangedEvent(graphene.ObjectType):
+    id = graphene.ID()
+    name = graphene.String()
+    price = graphene.Decimal()
+    stock = graphene.Int()
+    previous_stock = graphene.Int()
 
 
 # Input Types
@@ -49,12 +192,28 @@ class ProductInput(graphene.InputObjectType):
     stock = graphene.Int(required=False, default_value=0)
 
 
+class OrderLineInput(graphene.InputObjectType):
+    product_id = graphene.ID(required=True)
+    quantity = graphene.Int(required=False, default_value=1)
+
+
 class OrderInput(graphene.InputObjectType):
     customer_id = graphene.ID(required=True)
-    product_ids = graphene.List(graphene.ID, required=True)
+    # Each listed id adds one unit; repeat an id or use lines for quantities.
+    # (Not "items": input objects are dicts and the name would shadow dict.items)
+    product_ids = graphene.List(graphene.ID, required=False)
+    lines = graphene.List(OrderLineInput, required=False)
     order_date = graphene.DateTime(required=False)
 
 
+class ImportJobInput(graphene.InputObjectType):
+    # Exactly one of the row lists
+    customers = graphene.List(CustomerInput, required=False)
+    products = graphene.List(ProductInput, required=False)
+    orders = graphene.List(OrderInput, required=False)
+    chunk_size = graphene.Int(required=False)
+
+
 # Validation Helper Functions
 def validate_phone(phone):
     """Validate phone number format"""
@@ -64,26 +223,142 @@ def validate_phone(phone):
     return re.match(pattern, phone) is not None
 
 
-def validate_email_unique(email, exclude_id=None):
-    """Check if email is unique"""
-    query = Customer.objects.filter(email=email)
+def validate_email_unique(email, exclude_id=None, using=None):
+    """Check if email is unique, ignoring case"""
+    query = Customer.objects.using(using).with_email(email)
     if exclude_id:
         query = query.exclude(id=exclude_id)
     return not query.exists()
 
 
+def existing_emails(emails):
+    """Lower-cased ``emails`` that already belong to a customer (one query per shard)"""
+    by_shard = defaultdict(list)
+    for email in emails:
+        by_shard[sharding.db_for_new_customer(email)].append(email)
+    existing = set()
+    for alias, shard_emails in by_shard.items():
+        existing.update(
+            email.lower()
+            for email in Customer.objects.using(alias).with_emails(shard_emails).values_list('email', flat=True)
+        )
+    return existing
+
+
+def insert_customers(alias, customers):
+    """Bulk insert unsaved customers on ``alias`` together with their change events"""
+    sharding.bulk_create(Customer, alias, customers)
+    outbox.record_many(customers, using=alias)
+    counting.written(Customer, using=alias, created=len(customers))
+    return customers
+
+
+def collect_quantities(product_ids=None, lines=None):
+    """Merge product ids and lines into ``{product id: quantity}`` (insertion ordered)"""
+    quantities = Counter()
+    for product_id in product_ids or []:
+        quantities[str(product_id)] += 1
+    for line in lines or []:
+        quantity = line.get('quantity', 1)
+        if quantity is None or quantity < 1:
+            raise ValueError(f"Quantity for product {line['product_id']} must be at least 1")
+        quantities[str(line['product_id'])] += quantity
+    return quantities
+
+
+def fetch_products(product_ids, using=None):
+    """Load products by id in one query; return ``(products by id, first missing id)``
+
+    Prices are charged from these rows, so they are read from the database
+    (inside the order's transaction), never from the product catalog, which
+    may lag other workers' writes.
+    """
+    valid_ids = {product_id: int(product_id) for product_id in product_ids if product_id.isdigit()}
+    found = Product.objects.using(using).in_bulk(set(valid_ids.values()))
+    products = {}
+    for product_id in product_ids:
+        product = found.get(valid_ids.get(product_id))
+        if product is None:
+            return products, product_id
+        products[product_id] = product
+    return products, None
+
+
+def build_order_lines(quantities, products):
+    """Unsaved lines for ``{product id: quantity}`` at the products' current prices, and their total"""
+    order_lines = [
+        OrderLine(product=products[product_id], quantity=quantity, unit_price=products[product_id].price)
+        for product_id, quantity in quantities.items()
+    ]
+    return order_lines, sum((line.line_total for line in order_lines), Decimal('0.00'))
+
+
+def place_order(customer_id, product_ids=None, lines=None, order_date=None):
+    """Validate and create an order with its lines; return ``(order, error message)``"""
+    # Orders live on their customer's shard (None when unsharded)
+    shard = sharding.db_for_id(customer_id)
+
+    # Validate customer exists
+    try:
+        customer = Customer.objects.using(shard).get(id=customer_id)
+    except Customer.DoesNotExist:
+        return None, f"Customer with ID {customer_id} does not exist"
+
+    try:
+        quantities = collect_quantities(product_ids, lines)
+    except ValueError as e:
+        return None, str(e)
+
+    # Validate at least one product is selected
+    if not quantities:
+        return None, "At least one product must be selected"
+
+    try:
+        with transaction.atomic(using=shard):
+            # Validate all product IDs exist; the lines are priced from the
+            # same transaction that writes them
+            products, missing_id = fetch_products(list(quantities), using=shard)
+            if missing_id is not None:
+                return None, f"Product with ID {missing_id} does not exist"
+            order_lines, total_amount = build_order_lines(quantities, products)
+
+            order = sharding.create(
+                Order,
+                shard,
+                customer=customer,
+                total_amount=total_amount,
+            )
+            for line in order_lines:
+                line.order = order
+            OrderLine.objects.using(order._state.db).bulk_create(order_lines)
+
+            # Update order_date if provided
+            if order_date:
+                order.order_date = order_date
+                order.save(update_fields=['order_date'])
+
+            outbox.record(order)
+    except Exception as e:
+        return None, str(e)
+    return order, None
+
+
 # Mutations
 class CreateCustomer(graphene.Mutation):
     class Arguments:
         input = CustomerInput(required=True)
+        idempotency_key = graphene.String(required=False)
 
     customer = graphene.Field(CustomerType)
     message = graphene.String()
     success = graphene.Boolean()
 
+    @idempotent
     def mutate(self, info, input):
+        shard = sharding.db_for_new_customer(input.email)
+
         # Validate email uniqueness
-        if not validate_email_unique(input.email):
+        if not validate_email_unique(input.email, using=shard):
             return CreateCustomer(
                 customer=None,
                 message="Email already exists",
@@ -99,11 +374,15 @@ class CreateCustomer(graphene.Mutation):
             )
 
         try:
-            customer = Customer.objects.create(
-                name=input.name,
-                email=input.email,
-                phone=input.get('phone', '')
-            )
+            with transaction.atomic(using=shard):
+                customer = sharding.create(
+                    Customer,
+                    shard,
+                    name=input.name,
+                    email=input.email,
+                    phone=input.get('phone', '')
+                )
+                outbox.record(customer)
             return CreateCustomer(
                 customer=customer,
                 message="Customer created successfully",
@@ -125,19 +404,23 @@ class CustomerError(graphene.ObjectType):
 class BulkCreateCustomers(graphene.Mutation):
     class Arguments:
         input = graphene.List(CustomerInput, required=True)
+        idempotency_key = graphene.String(required=False)
 
     customers = graphene.List(CustomerType)
     errors = graphene.List(CustomerError)
     success = graphene.Boolean()
 
+    @idempotent
     def mutate(self, info, input):
         created_customers = []
         errors = []
+        pending = defaultdict(list)
 
-        with transaction.atomic():
+        with sharding.atomic():
+            # Validate email uniqueness with one query per shard
+            taken = existing_emails([customer_data.email for customer_data in input])
             for customer_data in input:
-                # Validate email uniqueness
-                if not validate_email_unique(customer_data.email):
+                if customer_data.email.lower() in taken:
                     errors.append(CustomerError(
                         email=customer_data.email,
                         message="Email already exists"
@@ -152,23 +435,31 @@ class BulkCreateCustomers(graphene.Mutation):
                     ))
                     continue
 
+                taken.add(customer_data.email.lower())
+                phone = customer_data.get('phone', '')
+                # bulk_create skips Customer.save(), which fills phone_e164
+                customer = Customer(
+                    name=customer_data.name, email=customer_data.email, phone=phone, phone_e164=to_e164(phone)
+                )
+                pending[sharding.db_for_new_customer(customer_data.email)].append(customer)
+                created_customers.append(customer)
+
+            for shard, customers in pending.items():
                 try:
-                    customer = Customer.objects.create(
-                        name=customer_data.name,
-                        email=customer_data.email,
-                        phone=customer_data.get('phone', '')
-                    )
-                    created_customers.append(customer)
-                except ValidationError as e:
-                    errors.append(CustomerError(
-                        email=customer_data.email,
-                        message=str(e)
-                    ))
-                except Exception as e:
-                    errors.append(CustomerError(
-                        email=customer_data.email,
-                        message=str(e)
-                    ))
+                    with transaction.atomic(using=shard):
+                        insert_customers(shard, customers)
+                except IntegrityError:
+                    # A concurrent request took one of the emails; find it row by row
+                    for customer in customers:
+                        try:
+                            with transaction.atomic(using=shard):
+                                insert_customers(shard, [customer])
+                        except Exception as e:
+                            created_customers.remove(customer)
+                            errors.append(CustomerError(
+                                email=customer.email,
+                                message=str(e)
+                            ))
 
         return BulkCreateCustomers(
             customers=created_customers,
@@ -180,11 +471,13 @@ class BulkCreateCustomers(graphene.Mutation):
 class CreateProduct(graphene.Mutation):
     class Arguments:
         input = ProductInput(required=True)
+        idempotency_key = graphene.String(required=False)
 
     product = graphene.Field(ProductType)
     message = graphene.String()
     success = graphene.Boolean()
 
+    @idempotent
     def mutate(self, info, input):
         # Validate price is positive
         if input.price <= 0:
@@ -204,11 +497,14 @@ class CreateProduct(graphene.Mutation):
             )
 
         try:
-            product = Product.objects.create(
-                name=input.name,
-                price=input.price,
-                stock=stock
-            )
+            with sharding.atomic():
+                product = sharding.create_replicated(
+                    Product,
+                    name=input.name,
+                    price=input.price,
+                    stock=stock
+                )
+                outbox.record(product)
             return CreateProduct(
                 product=product,
                 message="Product created successfully",
@@ -225,89 +521,110 @@ class CreateProduct(graphene.Mutation):
 class CreateOrder(graphene.Mutation):
     class Arguments:
         input = OrderInput(required=True)
+        idempotency_key = graphene.String(required=False)
 
     order = graphene.Field(OrderType)
     message = graphene.String()
     success = graphene.Boolean()
 
+    @idempotent
     def mutate(self, info, input):
-        # Validate customer exists
-        try:
-            customer = Customer.objects.get(id=input.customer_id)
-        except Customer.DoesNotExist:
-            return CreateOrder(
-                order=None,
-                message=f"Customer with ID {input.customer_id} does not exist",
-                success=False
-            )
+        order, error = place_order(
+            input.customer_id,
+            product_ids=input.get('product_ids'),
+            lines=input.get('lines'),
+            order_date=input.get('order_date'),
+        )
+        if error:
+            return CreateOrder(order=None, message=error, success=False)
+        return CreateOrder(
+            order=order,
+            message="Order created successfully",
+            success=True
+        )
 
-        # Validate at least one product is selected
-        if not input.product_ids or len(input.product_ids) == 0:
-            return CreateOrder(
-                order=None,
-                message="At least one product must be selected",
-                success=False
-            )
 
-        # Validate all product IDs exist and collect products
-        products = []
-        total_amount = Decimal('0.00')
-        
-        for product_id in input.product_ids:
-            try:
-                product = Product.objects.get(id=product_id)
-                products.append(product)
-                total_amount += product.price
-            except Product.DoesNotExist:
-                return CreateOrder(
-                    order=None,
-                    message=f"Product with ID {product_id} does not exist",
-                    success=False
-                )
+class StartImportJob(graphene.Mutation):
+    class Arguments:
+        input = ImportJobInput(required=True)
+        idempotency_key = graphene.String(required=False)
 
-        try:
-            # Create order
-            order = Order.objects.create(
-                customer=customer,
-                total_amount=total_amount,
-            )
-            
-            # Associate products
-            order.products.set(products)
-            
-            # Update order_date if provided
-            if input.get('order_date'):
-                order.order_date = input.order_date
-                order.save()
+    job = graphene.Field(ImportJobType)
+    message = graphene.String()
+    success = graphene.Boolean()
 
-            return CreateOrder(
-                order=order,
-                message="Order created successfully",
-                success=True
+    @idempotent
+    def mutate(self, info, input):
+        # Validate exactly one kind of rows is given
+        provided = [kind for kind, _ in ImportJob.KIND_CHOICES if input.get(kind) is not None]
+        if len(provided) != 1:
+            return StartImportJob(
+                job=None,
+                message="Provide exactly one of customers, products or orders",
+                success=False
             )
-        except Exception as e:
-            return CreateOrder(
-                order=None,
-                message=str(e),
+        kind = provided[0]
+
+        # Validate chunk size
+        chunk_size = input.get('chunk_size')
+        if chunk_size is not None and not 1 <= chunk_size <= 10000:
+            return StartImportJob(
+                job=None,
+                message="Chunk size must be between 1 and 10000",
                 success=False
             )
 
+        job = jobs.enqueue(kind, input[kind], chunk_size=chunk_size)
+        return StartImportJob(
+            job=job,
+            message=f"Import of {job.total_rows} {kind} queued",
+            success=True
+        )
+
+
+class AckChanges(graphene.Mutation):
+    class Arguments:
+        consumer = graphene.String(required=True)
+        cursor = graphene.String(required=True)
+
+    message = graphene.String()
+    success = graphene.Boolean()
+
+    def mutate(self, info, consumer, cursor):
+        try:
+            outbox.acknowledge(consumer, cursor)
+        except ValueError as e:
+            return AckChanges(message=str(e), success=False)
+        return AckChanges(message="Position saved", success=True)
+
 
 # Query
 class Query(graphene.ObjectType):
-    # Connection fields with DjangoFilterConnectionField
-    all_customers = DjangoFilterConnectionField(CustomerType, filterset_class=CustomerFilter)
-    all_products = DjangoFilterConnectionField(ProductType, filterset_class=ProductFilter)
-    all_orders = DjangoFilterConnectionField(OrderType, filterset_class=OrderFilter)
+    # Connection fields (DjangoFilterConnectionField, shard aware)
+    all_customers = CRMFilterConnectionField(CustomerType, filterset_class=CustomerFilter)
+    all_products = CRMFilterConnectionField(ProductType, filterset_class=ProductFilter)
+    all_orders = CRMFilterConnectionField(OrderType, filterset_class=OrderFilter)
     
     # Single item queries
     customer = graphene.Field(CustomerType, id=graphene.ID(required=True))
     product = graphene.Field(ProductType, id=graphene.ID(required=True))
     order = graphene.Field(OrderType, id=graphene.ID(required=True))
+    job = graphene.Field(ImportJobType, id=graphene.ID(required=True))
+
+    # Change feed (transactional outbox)
+    changes = graphene.Field(ChangeFeed, since=graphene.String(), limit=graphene.Int(default_value=100))
+
+    # Relay refetching by global id
+    node = graphene.Field(graphene.relay.Node, id=graphene.ID(required=True))
+    nodes = graphene.List(
+        graphene.relay.Node,
+        ids=graphene.List(graphene.NonNull(graphene.ID), required=True),
+        description="Nodes in the order of `ids`; null for unknown ids",
+    )
 
     def resolve_customer(self, info, id):
         try:
-            return Customer.objects.get(id=id)
+            return Customer.objects.using(sharding.db_for_id(id)).get(id=id)
         except Customer.DoesNotExist:
             return None
 
@@ -319,10 +636,55 @@ class Query(graphene.ObjectType):
 
     def resolve_order(self, info, id):
         try:
-            return Order.objects.get(id=id)
+            return Order.objects.using(sharding.db_for_id(id)).get(id=id)
         except Order.DoesNotExist:
+            pass
+        try:
+            return ArchivedOrder.objects.using(sharding.db_for_id(id)).get(id=id)
+        except ArchivedOrder.DoesNotExist:
             return None
 
+    def resolve_node(self, info, id):
+        return nodes.resolve_nodes(info, [id])[0]
+
+    def resolve_nodes(self, info, ids):
+        if len(ids) > nodes.MAX_IDS:
+            raise GraphQLError(f"At most {nodes.MAX_IDS} ids can be requested at once")
+        return nodes.resolve_nodes(info, ids)
+
+    def resolve_job(self, info, id):
+        # Progress is written to the primary; replicas may lag behind it
+        try:
+            return ImportJob.objects.using(PRIMARY).get(id=id)
+        except ImportJob.DoesNotExist:
+            return None
+
+    def resolve_changes(self, info, since=None, limit=100):
+        try:
+            events, cursor, has_more = outbox.read_changes(since, limit)
+        except ValueError as e:
+            raise GraphQLError(str(e))
+        return ChangeFeed(events=events, cursor=cursor, has_more=has_more)
+
+
+# Subscription
+class Subscription(graphene.ObjectType):
+    order_created = graphene.Field(OrderCreatedEvent)
+    stock_changed = graphene.Field(
+        StockChangedEvent,
+        threshold=graphene.Int(description="Only products whose stock is or was below this"),
+    )
+
+    async def subscribe_order_created(root, info):
+        async for event in pubsub.listen(pubsub.ORDER_CREATED):
+            yield event
+
+    async def subscribe_stock_changed(root, info, threshold=None):
+        async for event in pubsub.listen(pubsub.STOCK_CHANGED):
+            previous = event['previous_stock']
+            if threshold is None or event['stock'] < threshold or (previous is not None and previous < threshold):
+                yield event
+
 
 # Mutation
 class Mutation(graphene.ObjectType):
@@ -330,6 +692,20 @@ class Mutation(graphene.ObjectType):
     bulk_create_customers = BulkCreateCustomers.Field()
     create_product = CreateProduct.Field()
     create_order = CreateOrder.Field()
+    start_import_job = StartImportJob.Field()
+    ack_changes = AckChanges.Field()
+
+
+@lru_cache(maxsize=None)
+def get_schema():
+    """The CRM-only schema, built on first use"""
+    return graphene.Schema(
+        query=Query, mutation=Mutation, subscription=Subscription, directives=incremental.DIRECTIVES
+    )
 
 
-schema = graphene.Schema(query=Query, mutation=Mutation)
+def __getattr__(name):
+    # ``crm.schema.schema`` stays importable without building it at import time
+    if name == 'schema':
+        return get_schema()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
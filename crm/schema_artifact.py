@@ -0,0 +1,55 @@
+"""
+The schema as an SDL artifact (``crm/schema.graphql``).
+
+``manage.py export_schema`` writes the printed schema with a header holding
+a hash of the Python sources it is generated from. Clients and code
+generators read the file instead of booting Django, and
+``export_schema --check`` (cheap: it only hashes the sources) fails in CI
+when the file is older than the code.
+"""
+import hashlib
+import re
+from pathlib import Path
+
+from graphql import print_schema
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+ARTIFACT_PATH = BASE_DIR / 'crm' / 'schema.graphql'
+
+# Files whose changes can change the printed schema
+SOURCES = (
+    'alx_backend_graphql/schema.py',
+    'crm/schema.py',
+    'crm/filters.py',
+    'crm/fields.py',
+    'crm/incremental.py',
+    'crm/models.py',
+)
+
+HEADER = "# Generated by `manage.py export_schema`; do not edit.\n# source-hash: {}\n\n"
+_HASH_LINE = re.compile(r'^# source-hash: ([0-9a-f]{64})$', re.MULTILINE)
+
+
+def source_hash():
+    digest = hashlib.sha256()
+    for name in SOURCES:
+        digest.update(name.encode('utf-8'))
+        digest.update((BASE_DIR / name).read_bytes())
+    return digest.hexdigest()
+
+
+def render(schema):
+    """Artifact contents for ``schema``"""
+    return HEADER.format(source_hash()) + print_schema(schema.graphql_schema) + '\n'
+
+
+def stored_hash(path=ARTIFACT_PATH):
+    try:
+        match = _HASH_LINE.search(Path(path).read_text(encoding='utf-8'))
+    except FileNotFoundError:
+        return None
+    return match.group(1) if match else None
+
+
+def is_current(path=ARTIFACT_PATH):
+    return stored_hash(path) == source_hash()
@@ -0,0 +1,201 @@
+"""
+Optional customer-id sharding across several SQLite databases.
+
+Enabled by listing shard databases in ``settings.CRM_SHARDS``. Each customer
+and all of their orders live on one shard, and ``Product`` rows are copied to
+every shard so order/product joins stay local.
+
+Ids encode their shard: customer and order ids satisfy
+``id % len(shards) == shard index``. A new customer's shard is picked by
+hashing the lower-cased email, so duplicate emails always collide on the same
+shard's unique index. Orders inherit their customer's shard.
+
+Writes that span shards (products, bulk mutations) open one transaction per
+shard and commit them in turn. This is not a two-phase commit.
+
+A customer or order query must name its shard (``using(db_for_id(id))``)
+or read every shard with ``merged``; the router raises ``ShardRoutingError``
+rather than let it run against the default database.
+"""
+import zlib
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+
+ALLOCATION_RETRIES = 5
+
+
+class ShardRoutingError(RuntimeError):
+    """A query on a partitioned model that does not say which shard to use"""
+
+
+def shards():
+    return getattr(settings, 'CRM_SHARDS', [])
+
+
+def is_enabled():
+    return bool(shards())
+
+
+def is_sharded(model):
+    """True for models partitioned by customer (as opposed to replicated)"""
+    from .models import Customer, Order
+    return is_enabled() and model in (Customer, Order)
+
+
+def is_replicated(model):
+    from .models import Product
+    return is_enabled() and model is Product
+
+
+def shard_index_for_id(object_id):
+    return int(object_id) % len(shards())
+
+
+def db_for_id(object_id):
+    """Return the shard holding a customer or order id, or None when unsharded"""
+    if not is_enabled():
+        return None
+    return shards()[shard_index_for_id(object_id)]
+
+
+def db_for_new_customer(email):
+    """Pick the shard for a customer that does not exist yet"""
+    if not is_enabled():
+        return None
+    return shards()[zlib.crc32(email.strip().lower().encode('utf-8')) % len(shards())]
+
+
+def any_shard():
+    """Database to read replicated models from"""
+    return shards()[0] if is_enabled() else None
+
+
+def allocate_id(model, alias):
+    """Return the next free id on ``alias`` whose residue matches the shard"""
+    count = len(shards())
+    index = shards().index(alias)
+    current = model.objects.using(alias).aggregate(top=Max('id'))['top'] or 0
+    candidate = current + 1
+    return candidate + (index - candidate) % count
+
+
+def create(model, alias, **fields):
+    """Create a partitioned row on ``alias`` with a shard-encoded id"""
+    if alias is None:
+        return model.objects.create(**fields)
+
+    for attempt in range(ALLOCATION_RETRIES):
+        new_id = allocate_id(model, alias)
+        try:
+            with transaction.atomic(using=alias):
+                return model.objects.using(alias).create(id=new_id, **fields)
+        except IntegrityError:
+            # Retry only when a concurrent insert took the id; other
+            # constraint violations (e.g. duplicate email) are real errors
+            id_taken = model.objects.using(alias).filter(id=new_id).exists()
+            if not id_taken or attempt == ALLOCATION_RETRIES - 1:
+                raise
+
+
+def bulk_create(model, alias, instances):
+    """``bulk_create`` partitioned rows on ``alias`` with consecutive shard-encoded ids"""
+    if alias is None:
+        return model.objects.bulk_create(instances)
+
+    count = len(shards())
+    for attempt in range(ALLOCATION_RETRIES):
+        first_id = allocate_id(model, alias)
+        for number, instance in enumerate(instances):
+            instance.id = first_id + number * count
+        try:
+            with transaction.atomic(using=alias):
+                return model.objects.using(alias).bulk_create(instances)
+        except IntegrityError:
+            ids = [instance.id for instance in instances]
+            ids_taken = model.objects.using(alias).filter(id__in=ids).exists()
+            if not ids_taken or attempt == ALLOCATION_RETRIES - 1:
+                raise
+
+
+def create_replicated(model, **fields):
+    """Create a replicated row with the same id on every shard"""
+    if not is_enabled():
+        return model.objects.create(**fields)
+
+    with atomic():
+        primary = shards()[0]
+        top = max(model.objects.using(alias).aggregate(top=Max('id'))['top'] or 0 for alias in shards())
+        instance = model.objects.using(primary).create(id=top + 1, **fields)
+        for alias in shards()[1:]:
+            model.objects.using(alias).create(id=instance.id, **fields)
+    return instance
+
+
+def merged(queryset):
+    """``queryset`` run on every shard and merged in its ordering"""
+    from .merging import MergedQuerySet
+    return MergedQuerySet(queryset.using(alias) for alias in shards())
+
+
+@contextmanager
+def atomic():
+    """One transaction per shard (or the default database when unsharded)"""
+    if not is_enabled():
+        with transaction.atomic():
+            yield
+        return
+    with ExitStack() as stack:
+        for alias in shards():
+            stack.enter_context(transaction.atomic(using=alias))
+        yield
+
+
+class ShardRouter:
+    """Route partitioned and replicated CRM models to their shards.
+
+    Partitioned rows are reached through ``crm.sharding`` helpers (explicit
+    ``using``) or through relations of an instance already loaded from a
+    shard, which this router keeps on the instance's database. Anything else
+    would silently read or write the default database, so it raises.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not is_enabled() or model._meta.app_label != 'crm':
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in shards():
+            return instance._state.db
+        if is_replicated(model):
+            return any_shard()
+        self.check_routed(model)
+        return None
+
+    def db_for_write(self, model, **hints):
+        if not is_enabled() or model._meta.app_label != 'crm':
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in shards():
+            return instance._state.db
+        self.check_routed(model)
+        return None
+
+    @staticmethod
+    def check_routed(model):
+        if is_sharded(model):
+            raise ShardRoutingError(
+                f"{model.__name__} rows live on {', '.join(shards())}: query one with "
+                f".using(sharding.db_for_id(id)) or all of them with sharding.merged(queryset)"
+            )
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if obj1._state.db in shards() or obj2._state.db in shards():
+            return obj1._state.db == obj2._state.db
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in shards():
+            return app_label == 'crm'
+        return None
@@ -0,0 +1,84 @@
+"""
+Slow GraphQL operation log.
+
+A sampled fraction of operations is timed; those slower than
+``CRM_SLOW_OPERATION_MS`` are written as one JSON line to the
+``crm.slow_operations`` logger (a rotating file in the default settings)
+together with every SQL statement and the ``EXPLAIN QUERY PLAN`` output of
+the slowest ones. Read it back with ``python manage.py slow_operations``.
+"""
+import json
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('crm.slow_operations')
+
+MAX_STATEMENTS = 100
+MAX_STRING_LENGTH = 64
+MAX_LIST_ITEMS = 10
+
+
+def should_sample():
+    """Decide up front whether this operation is eligible for the slow log"""
+    rate = getattr(settings, 'CRM_SLOW_OPERATION_SAMPLE_RATE', 1.0)
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def normalize_variables(value):
+    """Make variables stable and bounded: sorted keys, truncated strings and lists"""
+    if isinstance(value, dict):
+        return {key: normalize_variables(value[key]) for key in sorted(value)}
+    if isinstance(value, (list, tuple)):
+        items = [normalize_variables(item) for item in value[:MAX_LIST_ITEMS]]
+        if len(value) > MAX_LIST_ITEMS:
+            items.append(f"... {len(value) - MAX_LIST_ITEMS} more")
+        return items
+    if isinstance(value, str) and len(value) > MAX_STRING_LENGTH:
+        return value[:MAX_STRING_LENGTH] + '...'
+    return value
+
+
+def explain(query):
+    """Return the query plan rows for a captured SELECT statement"""
+    connection = connections[query.alias]
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + query.sql, query.params)
+            return [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+    except Exception as e:
+        return [f"EXPLAIN failed: {e}"]
+
+
+def record_if_slow(label, variables, duration_ms, recorder):
+    """Write a slow-log entry when ``duration_ms`` exceeds the threshold"""
+    threshold = getattr(settings, 'CRM_SLOW_OPERATION_MS', 500)
+    if duration_ms < threshold:
+        return None
+
+    explain_top = getattr(settings, 'CRM_SLOW_OPERATION_EXPLAIN_TOP', 3)
+    selects = [query for query in recorder.queries if query.sql.lstrip().upper().startswith('SELECT')]
+    slowest = sorted(selects, key=lambda query: query.duration_ms, reverse=True)[:explain_top]
+
+    entry = {
+        'timestamp': time.time(),
+        'operation': label,
+        'duration_ms': round(duration_ms, 3),
+        'variables': normalize_variables(variables or {}),
+        'query_count': len(recorder.queries),
+        'sql_ms': round(sum(query.duration_ms for query in recorder.queries), 3),
+        'statements': [
+            {'sql': query.sql, 'duration_ms': round(query.duration_ms, 3)}
+            for query in recorder.queries[:MAX_STATEMENTS]
+        ],
+        'plans': [
+            {'sql': query.sql, 'duration_ms': round(query.duration_ms, 3), 'plan': explain(query)}
+            for query in slowest
+        ],
+    }
+    logger.info(json.dumps(entry, default=str))
+    return entry
@@ -1,3 +1,1568 @@
-from django.test import TestCase
+import asyncio
+import fcntl
+import gzip
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.utils import ConnectionHandler
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from graphql import print_ast
+from graphql_relay import to_global_id
+
+from alx_backend_graphql.schema import schema
+from benchmarks.replay_traffic import load_operations, replay
+
+from . import (
+    catalog, counting, encoding, idempotency, jobs, metrics, phones, pubsub, replication, routers, schema_artifact,
+    sharding,
+)
+from .archive import archive_batch, archive_watermark
+from .incremental import IncrementalOperation, multipart
+from .idempotency import purge_expired
+from .jobs import claim_next_job, import_orders, process_chunk, process_job, run_pending
+from .outbox import compact, decode_cursor, iter_changes, read_changes
+from .websocket import GraphQLWebSocket
+from .instrumentation import fingerprint_sql
+from .filters import CustomerFilter, OrderFilter, ProductFilter, reverse_ordering
+from .middleware import CompressionMiddleware
+from .models import (
+    ArchivedOrder, Customer, IdempotencyKey, ImportJob, Product, Order, OrderLine, OutboxEvent,
+)
+from .query_budget import QueryBudgetExceeded, execute_with_budget, query_budget
+
+
+class TrafficCaptureTests(TransactionTestCase):
+    # Replay runs on a worker thread, which only sees committed rows
+    QUERY = 'query Products($first: Int) { allProducts(first: $first) { edges { node { name } } } }'
+
+    class SchemaTransport:
+        """Execute replayed bodies against the schema, without HTTP"""
+
+        def __init__(self):
+            self.results = []
+
+        def __call__(self, body):
+            request = json.loads(body)
+            result = schema.execute(
+                request['query'], variable_values=request['variables'], operation_name=request['operationName'],
+            )
+            self.results.append(result)
+            return (200 if result.errors is None else 400), json.dumps({'data': result.data}).encode()
+
+        def close(self):
+            pass
+
+    def test_captured_requests_replay(self):
+        Product.objects.create(name="Laptop", price=Decimal("999.99"), stock=5)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'traffic.jsonl')
+            with override_settings(CRM_TRAFFIC_CAPTURE_PATH=path):
+                self.client.post('/graphql', {
+                    'query': self.QUERY, 'variables': {'first': 1}, 'operationName': 'Products',
+                }, content_type='application/json')
+                self.client.get('/graphql', {'query': '{ allCustomers { edges { node { name } } } }'})
+                # Not GraphQL requests: not captured
+                self.client.post('/graphql', 'not json', content_type='application/json')
+                self.client.get('/metrics')
+            operations, skipped = load_operations(path)
+
+        self.assertEqual(skipped, 0)
+        self.assertEqual([operation['operationName'] for operation in operations], ['Products', None])
+        self.assertEqual(operations[0]['variables'], {'first': 1})
+
+        transport = self.SchemaTransport()
+        samples, errors, _ = replay(operations, transport, concurrency=1)
+        self.assertEqual(sum(len(values) for values in samples.values()), 2)
+        self.assertEqual(dict(errors), {})
+        # One worker replays in recorded order
+        self.assertEqual(transport.results[0].data, {'allProducts': {'edges': [{'node': {'name': "Laptop"}}]}})
+
+
+class DatabaseProfileTests(SimpleTestCase):
+    # The connections under test are opened by a separate handler, also as 'default'
+    databases = {'default'}
+
+    def connect(self, directory, profile):
+        handler = ConnectionHandler({'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(directory, 'profile.sqlite3'),
+            **settings.DATABASE_PROFILES[profile],
+        }})
+        connection = handler['default']
+        self.addCleanup(connection.close)
+        return connection
+
+    def pragmas(self, connection):
+        with connection.cursor() as cursor:
+            return {
+                name: cursor.execute(f'PRAGMA {name}').fetchone()[0]
+                for name in ('journal_mode', 'busy_timeout', 'synchronous', 'cache_size', 'temp_store')
+            }
+
+    def test_production_profile_tunes_every_connection(self):
+        with tempfile.TemporaryDirectory() as directory:
+            connection = self.connect(directory, 'production')
+            self.assertEqual(self.pragmas(connection), {
+                'journal_mode': 'wal', 'busy_timeout': 5000, 'synchronous': 1, 'cache_size': -64000, 'temp_store': 2,
+            })
+            self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+            self.assertEqual(connection.settings_dict['CONN_MAX_AGE'], 600)
+            self.assertTrue(connection.settings_dict['CONN_HEALTH_CHECKS'])
+
+            # A connection opened later (after CONN_MAX_AGE recycled one) gets them too
+            connection.close()
+            self.assertEqual(self.pragmas(connection)['busy_timeout'], 5000)
+
+    def test_default_profile_keeps_sqlite_defaults(self):
+        with tempfile.TemporaryDirectory() as directory:
+            connection = self.connect(directory, 'default')
+            pragmas = self.pragmas(connection)
+            self.assertEqual(pragmas['journal_mode'], 'delete')
+            self.assertIsNone(connection.transaction_mode)
+            self.assertEqual(connection.settings_dict['CONN_MAX_AGE'], 0)
+
+
+class QueryBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        products = [
+            Product.objects.create(name=f"Product {i}", price=Decimal('10.00'), stock=5)
+            for i in range(3)
+        ]
+        for i in range(5):
+            customer = Customer.objects.create(name=f"Customer {i}", email=f"customer{i}@example.com")
+            order = Order.objects.create(customer=customer, total_amount=Decimal('30.00'))
+            order.products.set(products, through_defaults={'unit_price': Decimal('10.00')})
+
+    def test_all_orders_with_customer_within_budget(self):
+        result = execute_with_budget(schema, '''
+            query {
+                allOrders(first: 10) { edges { node { id totalAmount customer { name } } } }
+            }
+        ''')
+        self.assertIsNone(result.errors)
+        self.assertEqual(len(result.data['allOrders']['edges']), 5)
+
+    def test_all_customers_within_budget(self):
+        result = execute_with_budget(schema, '{ allCustomers(first: 10) { edges { node { name } } } }')
+        self.assertIsNone(result.errors)
+
+    def test_nested_products_within_budget(self):
+        # No catalog inside the test transaction: lines and products are prefetched
+        result = execute_with_budget(schema, '''
+            query {
+                allOrders(first: 10) { edges { node { id products { edges { node { name } } } } } }
+            }
+        ''')
+        self.assertIsNone(result.errors)
+        for edge in result.data['allOrders']['edges']:
+            self.assertEqual(len(edge['node']['products']['edges']), 3)
+
+    def test_exceeding_the_budget_raises(self):
+        query = '{ allOrders(first: 10) { edges { node { id customer { name } } } } }'
+        with self.assertRaises(QueryBudgetExceeded) as raised:
+            execute_with_budget(schema, query, budget=0)
+        self.assertIn('1x', str(raised.exception))
+        self.assertIn('crm_order', str(raised.exception))
+
+    def test_query_budget_context_manager(self):
+        with query_budget(1):
+            list(Customer.objects.all())
+        with self.assertRaises(QueryBudgetExceeded):
+            with query_budget(1):
+                for customer in Customer.objects.all():
+                    list(customer.orders.all())
+
+    def test_fingerprint_groups_literals(self):
+        self.assertEqual(
+            fingerprint_sql("SELECT * FROM crm_order WHERE id IN (%s, %s) AND total_amount > 10"),
+            "SELECT * FROM crm_order WHERE id IN (...) AND total_amount > ?",
+        )
+
+
+class SlowOperationLogTests(TestCase):
+    QUERY = 'query SlowOrders($first: Int) { allOrders(first: $first) { edges { node { id } } } }'
+
+    def post(self):
+        return self.client.post('/graphql', {
+            'query': self.QUERY, 'variables': {'first': 5}, 'operationName': 'SlowOrders',
+        }, content_type='application/json')
+
+    @override_settings(CRM_SLOW_OPERATION_MS=0, CRM_SLOW_OPERATION_SAMPLE_RATE=1)
+    def test_operations_over_the_threshold_are_logged(self):
+        with self.assertLogs('crm.slow_operations', 'INFO') as logs:
+            self.post()
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry['operation'], 'SlowOrders')
+        self.assertEqual(entry['variables'], {'first': 5})
+        self.assertEqual(entry['query_count'], len(entry['statements']))
+        self.assertIn('crm_order', entry['plans'][0]['sql'])
+        self.assertTrue(any('crm_order' in row for row in entry['plans'][0]['plan']))
+
+    @override_settings(CRM_SLOW_OPERATION_MS=60_000, CRM_SLOW_OPERATION_SAMPLE_RATE=1)
+    def test_fast_operations_are_not_logged(self):
+        with self.assertNoLogs('crm.slow_operations'):
+            self.post()
+
+    @override_settings(CRM_SLOW_OPERATION_MS=0, CRM_SLOW_OPERATION_SAMPLE_RATE=0)
+    def test_unsampled_operations_are_not_logged(self):
+        with self.assertNoLogs('crm.slow_operations'):
+            self.post()
+
+    def test_command_aggregates_the_log(self):
+        entries = [
+            ('allOrders', 600.0), ('allOrders', 1000.0), ('allCustomers', 550.0), ('allOrders', 2000.0),
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'slow.log')
+            # The rotated backup is read along with the current file
+            for filename, chunk in ((path, entries[:2]), (f'{path}.1', entries[2:])):
+                with open(filename, 'w', encoding='utf-8') as log:
+                    for operation, duration_ms in chunk:
+                        log.write(json.dumps({
+                            'operation': operation, 'duration_ms': duration_ms, 'query_count': 2,
+                            'variables': {}, 'plans': [{'sql': 'SELECT 1', 'duration_ms': 1.0, 'plan': ['SCAN']}],
+                        }) + '\n')
+                    log.write('not json\n')
+
+            with override_settings(CRM_SLOW_OPERATION_LOG=path):
+                summary = io.StringIO()
+                call_command('slow_operations', stdout=summary)
+                detail = io.StringIO()
+                call_command('slow_operations', operation='allOrders', min_ms=700, plans=True, stdout=detail)
+
+        lines = summary.getvalue().splitlines()
+        self.assertEqual(lines[1].split(), ['allOrders', '3', '1200.0', '2000.0'])
+        self.assertEqual(lines[2].split(), ['allCustomers', '1', '550.0', '550.0'])
+        detail = detail.getvalue().splitlines()
+        self.assertTrue(detail[0].startswith('2000.0ms  2 queries'))
+        self.assertEqual(sum(line.endswith('queries  variables={}') for line in detail), 2)
+        self.assertIn('        SCAN', detail)
+
+
+class MetricsTests(TestCase):
+    def registry(self):
+        registry = metrics.Registry()
+        counter = registry.register(metrics.Counter('crm_test_total', 'Test counter.', ('kind',)))
+        return registry, counter
+
+    def write_snapshot(self, directory, name, value):
+        with open(os.path.join(directory, name), 'w', encoding='utf-8') as snapshot:
+            json.dump({'crm_test_total': [[['a'], value]]}, snapshot)
+
+    def hold_lock(self, directory, name):
+        """Stand in for a live worker: hold the lock on its snapshot"""
+        lock = open(os.path.join(directory, name.replace('.json', '.lock')), 'a')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def test_endpoint_renders_operations(self):
+        metrics.observe_operation('MetricsProbe', 12.0, 3)
+        response = self.client.get('/metrics')
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE crm_graphql_operations_total counter', body)
+        self.assertRegex(body, r'crm_graphql_operations_total\{operation="MetricsProbe",status="ok"\} \d+')
+        self.assertIn('crm_graphql_sql_queries_bucket{operation="MetricsProbe",le="3"}', body)
+
+    def test_snapshots_of_live_processes_are_merged(self):
+        registry, counter = self.registry()
+        counter.inc(2, kind='a')
+        with tempfile.TemporaryDirectory() as directory, override_settings(CRM_METRICS_MULTIPROCESS_DIR=directory):
+            # Another worker, possibly in another PID namespace, with this process's pid
+            self.write_snapshot(directory, f'metrics-{os.getpid()}-other.json', 5)
+            with self.hold_lock(directory, f'metrics-{os.getpid()}-other.json'):
+                self.assertEqual(registry.collect()['crm_test_total'], {('a',): 7})
+                self.assertIn(f'metrics-{os.getpid()}-other.json', os.listdir(directory))
+            self.assertIn(f'metrics-{os.getpid()}-{registry.token}.json', os.listdir(directory))
+
+    def test_snapshots_of_exited_processes_are_folded_into_the_aggregate(self):
+        registry, counter = self.registry()
+        counter.inc(kind='a')
+        with tempfile.TemporaryDirectory() as directory, override_settings(CRM_METRICS_MULTIPROCESS_DIR=directory):
+            self.write_snapshot(directory, 'metrics-4242-gone.json', 5)
+            # An earlier process with this pid
+            self.write_snapshot(directory, f'metrics-{os.getpid()}-earlier.json', 11)
+            self.assertEqual(registry.collect()['crm_test_total'], {('a',): 17})
+            self.assertEqual(registry.collect()['crm_test_total'], {('a',): 17})
+            self.assertEqual(
+                sorted(name for name in os.listdir(directory) if name.endswith('.json')),
+                ['aggregate.json', f'metrics-{os.getpid()}-{registry.token}.json'],
+            )
+
+    def test_counter_total_survives_a_recycled_worker(self):
+        registry, counter = self.registry()
+        with tempfile.TemporaryDirectory() as directory, override_settings(CRM_METRICS_MULTIPROCESS_DIR=directory):
+            worker = self.hold_lock(directory, 'metrics-4242-worker.json')
+            self.write_snapshot(directory, 'metrics-4242-worker.json', 5)
+            self.assertEqual(registry.collect()['crm_test_total'], {('a',): 5})
+            worker.close()  # The worker exits
+
+            self.write_snapshot(directory, 'metrics-4243-replacement.json', 1)
+            with self.hold_lock(directory, 'metrics-4243-replacement.json'):
+                self.assertEqual(registry.collect()['crm_test_total'], {('a',): 6})
+            self.assertNotIn('metrics-4242-worker.json', os.listdir(directory))
+
+    def test_interrupted_fold_is_not_counted_twice(self):
+        registry, counter = self.registry()
+        with tempfile.TemporaryDirectory() as directory, override_settings(CRM_METRICS_MULTIPROCESS_DIR=directory):
+            self.write_snapshot(directory, 'metrics-4242-gone.json', 5)
+            with mock.patch.object(metrics, 'remove'):
+                # The scrape folds the snapshot but dies before deleting it
+                registry.collect()
+            self.assertIn('metrics-4242-gone.json', os.listdir(directory))
+            self.assertEqual(registry.collect()['crm_test_total'], {('a',): 5})
+            self.assertNotIn('metrics-4242-gone.json', os.listdir(directory))
+
+
+@override_settings(CRM_READ_REPLICAS=['replica_1', 'replica_2'])
+class ReplicaRouterTests(SimpleTestCase):
+    # Only the atomic block test touches the database
+    databases = {'default'}
+
+    def setUp(self):
+        self.router = routers.PrimaryReplicaRouter()
+
+    def test_reads_rotate_over_the_replicas(self):
+        reads = {self.router.db_for_read(Customer) for _ in range(4)}
+        self.assertEqual(reads, {'replica_1', 'replica_2'})
+        customer = Customer(name="Alice")
+        customer._state.db = 'replica_2'
+        self.assertEqual(self.router.db_for_read(Order, instance=customer), 'replica_2')
+
+    def test_writes_pin_the_rest_of_the_request(self):
+        with routers.request_scope():
+            self.assertNotEqual(self.router.db_for_read(Customer), routers.PRIMARY)
+            self.assertEqual(self.router.db_for_write(Customer), routers.PRIMARY)
+            self.assertEqual(self.router.db_for_read(Product), routers.PRIMARY)
+        with routers.request_scope():
+            self.assertNotEqual(self.router.db_for_read(Customer), routers.PRIMARY)
+
+    def test_writes_outside_a_request_do_not_pin(self):
+        # Import worker threads and management commands never enter a request scope
+        self.router.db_for_write(Customer)
+        routers.pin_primary()
+        self.assertNotEqual(self.router.db_for_read(Customer), routers.PRIMARY)
+
+    def test_transactions_read_the_primary(self):
+        with transaction.atomic():
+            self.assertEqual(self.router.db_for_read(Customer), routers.PRIMARY)
+        self.assertNotEqual(self.router.db_for_read(Customer), routers.PRIMARY)
+
+    @override_settings(CRM_READ_REPLICAS=[])
+    def test_without_replicas_everything_uses_the_primary(self):
+        self.assertEqual(self.router.db_for_read(Customer), routers.PRIMARY)
+
+
+class ReplicationTests(TestCase):
+    def test_committed_writes_are_replayed(self):
+        replayed = []
+        with mock.patch.object(replication, 'replay', lambda sql, params, many: replayed.append(sql.split()[0])):
+            with self.captureOnCommitCallbacks(execute=True), connection.execute_wrapper(replication.replay_writes):
+                customer = Customer.objects.create(name="Alice", email="alice@example.com")
+                list(Customer.objects.all())
+                with self.assertRaises(ValueError), transaction.atomic():
+                    Product.objects.create(name="Laptop", price=Decimal("999.99"))
+                    raise ValueError
+                Customer.objects.filter(pk=customer.pk).update(name="Alicia")
+        # Reads and the rolled back savepoint are not replayed
+        self.assertEqual(replayed, ['INSERT', 'UPDATE'])
+
+
+@override_settings(CRM_SHARDS=['shard_0', 'shard_1'])
+class ShardingTests(TransactionTestCase):
+    SHARDS = ['shard_0', 'shard_1']
+    # Resolved when the class is set up, once the shard aliases exist
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        # Two SQLite shard databases next to the test database
+        cls.directory = tempfile.TemporaryDirectory()
+        for alias in cls.SHARDS:
+            connections.settings[alias] = {
+                **connections['default'].settings_dict, 'NAME': os.path.join(cls.directory.name, f'{alias}.sqlite3'),
+            }
+            call_command('migrate', database=alias, verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        for alias in cls.SHARDS:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        cls.directory.cleanup()
+
+    def setUp(self):
+        cache.clear()
+        catalog.reset()
+        self.addCleanup(catalog.reset)
+
+    def create_customers(self, *names):
+        emails = [f"{name.lower()}.{index}@example.com" for index, name in enumerate(names)]
+        return [
+            sharding.create(Customer, sharding.db_for_new_customer(email), name=name, email=email)
+            for name, email in zip(names, emails)
+        ]
+
+    def test_ids_encode_their_shard(self):
+        ids = {alias: [sharding.create(Customer, alias, name=f"{alias} {i}", email=f"{alias}.{i}@example.com").id
+                       for i in range(3)]
+               for alias in self.SHARDS}
+        self.assertEqual(ids, {'shard_0': [2, 4, 6], 'shard_1': [1, 3, 5]})
+        for alias, customer_ids in ids.items():
+            for customer_id in customer_ids:
+                self.assertEqual(sharding.db_for_id(customer_id), alias)
+                customer = Customer.objects.using(sharding.db_for_id(customer_id)).get(id=customer_id)
+                self.assertEqual(customer._state.db, alias)
+
+        # Orders take their customer's shard and relations stay on it
+        customer = Customer.objects.using('shard_1').get(id=3)
+        order = sharding.create(Order, 'shard_1', customer=customer, total_amount=Decimal("10.00"))
+        self.assertEqual(sharding.db_for_id(order.id), 'shard_1')
+        self.assertEqual(list(customer.orders.all()), [order])
+
+    def test_products_are_copied_to_every_shard(self):
+        product = sharding.create_replicated(Product, name="Laptop", price=Decimal("999.99"), stock=5)
+        for alias in self.SHARDS:
+            self.assertEqual(Product.objects.using(alias).get(id=product.id).name, "Laptop")
+        self.assertEqual(Product.objects.get(id=product.id)._state.db, 'shard_0')
+
+    def test_unrouted_queries_raise(self):
+        self.create_customers("Alice")
+        with self.assertRaises(sharding.ShardRoutingError):
+            list(Customer.objects.filter(name="Alice"))
+        with self.assertRaises(sharding.ShardRoutingError):
+            Order.objects.count()
+
+    def test_merged_order_and_slicing(self):
+        names = ["Dora", "Alice", "Eve", "Bob", "Frank", "Carol", "Bob"]
+        customers = self.create_customers(*names)
+        self.assertEqual({customer._state.db for customer in customers}, set(self.SHARDS))
+
+        merged = sharding.merged(Customer.objects.order_by('name'))
+        expected = sorted((customer.name, customer.id) for customer in customers)
+        self.assertEqual(len(merged), 7)
+        self.assertEqual([(customer.name, customer.id) for customer in merged], expected)
+        self.assertEqual([customer.name for customer in merged[2:5]], [name for name, _ in expected[2:5]])
+        self.assertEqual([customer.name for customer in merged[1:][1:3]], [name for name, _ in expected[2:4]])
+        self.assertEqual(merged[6].name, "Frank")
+        self.assertEqual(list(merged[10:]), [])
+
+        descending = [customer.name for customer in sharding.merged(Customer.objects.order_by('-name'))]
+        self.assertEqual(descending, sorted(names, reverse=True))
+
+        result = schema.execute('{ allCustomers(first: 3, offset: 2) { edges { node { name } } } }')
+        self.assertIsNone(result.errors)
+        self.assertEqual(
+            [edge['node']['name'] for edge in result.data['allCustomers']['edges']],
+            [name for name, _ in expected[2:5]],
+        )
+
+
+class OrderLineTests(TestCase):
+    CREATE_ORDER = '''
+        mutation CreateOrder($input: OrderInput!) {
+            createOrder(input: $input) {
+                success
+                message
+                order { totalAmount lineItems { edges { node { quantity unitPrice lineTotal } } } }
+            }
+        }
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = Customer.objects.create(name="Buyer", email="buyer@example.com")
+        cls.laptop = Product.objects.create(name="Laptop", price=Decimal('999.99'), stock=5)
+        cls.mouse = Product.objects.create(name="Mouse", price=Decimal('25.50'), stock=50)
+
+    def create_order(self, **fields):
+        result = schema.execute(self.CREATE_ORDER, variable_values={
+            'input': {'customerId': str(self.customer.id), **fields},
+        })
+        self.assertIsNone(result.errors)
+        return result.data['createOrder']
+
+    def test_quantities_and_total(self):
+        payload = self.create_order(
+            productIds=[str(self.laptop.id)],
+            lines=[{'productId': str(self.mouse.id), 'quantity': 4}],
+        )
+        self.assertTrue(payload['success'])
+        self.assertEqual(payload['order']['totalAmount'], '1101.99')
+        lines = [edge['node'] for edge in payload['order']['lineItems']['edges']]
+        self.assertEqual([line['quantity'] for line in lines], [1, 4])
+        self.assertEqual(lines[1]['lineTotal'], '102.00')
+
+    def test_repeated_product_ids_become_one_line(self):
+        payload = self.create_order(productIds=[str(self.mouse.id)] * 3)
+        self.assertEqual(payload['order']['totalAmount'], '76.50')
+        self.assertEqual(OrderLine.objects.get().quantity, 3)
+
+    def test_unit_price_is_a_snapshot(self):
+        self.create_order(productIds=[str(self.laptop.id)])
+        Product.objects.filter(id=self.laptop.id).update(price=Decimal('1299.00'))
+        self.assertEqual(OrderLine.objects.get().unit_price, Decimal('999.99'))
+
+    def test_invalid_quantity_and_unknown_product(self):
+        payload = self.create_order(lines=[{'productId': str(self.mouse.id), 'quantity': 0}])
+        self.assertFalse(payload['success'])
+        payload = self.create_order(productIds=['999'])
+        self.assertEqual(payload['message'], "Product with ID 999 does not exist")
+        self.assertFalse(Order.objects.exists())
+
+    def test_archive_keeps_line_items(self):
+        self.create_order(lines=[{'productId': str(self.mouse.id), 'quantity': 2}])
+        Order.objects.update(order_date=timezone.now() - timedelta(days=400))
+        self.assertEqual(archive_batch(timezone.now() - timedelta(days=365)), 1)
+        line = ArchivedOrder.objects.get().line_items.get()
+        self.assertEqual((line.quantity, line.unit_price), (2, Decimal('25.50')))
+        self.assertFalse(OrderLine.objects.exists())
+
+
+class ArchiveTests(TestCase):
+    QUERY = '{ allOrders%s { edges { node { id totalAmount customer { name } } } } }'
+
+    def setUp(self):
+        cache.clear()
+        customer = Customer.objects.create(name="Alice", email="alice@example.com")
+        self.orders = {}
+        for days, total in ((500, "50.00"), (400, "40.00"), (200, "20.00"), (10, "10.00")):
+            order = Order.objects.create(customer=customer, total_amount=Decimal(total))
+            Order.objects.filter(pk=order.pk).update(order_date=timezone.now() - timedelta(days=days))
+            self.orders[days] = to_global_id('OrderType', order.pk)
+        output = io.StringIO()
+        call_command('archive_orders', batch_size=1, sleep=0, stdout=output)
+        self.assertIn("archived 2 orders", output.getvalue())
+
+    def order_ids(self, arguments):
+        result = schema.execute(self.QUERY % arguments)
+        self.assertIsNone(result.errors)
+        return [edge['node']['id'] for edge in result.data['allOrders']['edges']]
+
+    def days_ago(self, days):
+        return (timezone.now() - timedelta(days=days)).isoformat()
+
+    def test_command_moves_old_orders(self):
+        self.assertEqual(sorted(ArchivedOrder.objects.values_list('total_amount', flat=True)),
+                         [Decimal("40.00"), Decimal("50.00")])
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_date_filters_reaching_the_archive_merge_it(self):
+        self.assertEqual(
+            self.order_ids(f'(orderDate_Gte: "{self.days_ago(450)}")'),
+            [self.orders[10], self.orders[200], self.orders[400]],
+        )
+        self.assertEqual(
+            self.order_ids(f'(orderDate_Lte: "{self.days_ago(100)}", orderBy: "-totalAmount")'),
+            [self.orders[500], self.orders[400], self.orders[200]],
+        )
+        # Other filters apply to archived rows too
+        self.assertEqual(
+            self.order_ids(f'(orderDate_Lte: "{self.days_ago(100)}", totalAmount_Lte: 45, first: 1)'),
+            [self.orders[200]],
+        )
+
+    def test_live_only_filters_never_read_the_archive(self):
+        archive_watermark()  # Cached per process, as between two archive runs
+        for arguments in ('', f'(orderDate_Gte: "{self.days_ago(300)}")', '(totalAmount_Gte: 1)'):
+            with CaptureQueriesContext(connection) as queries:
+                ids = self.order_ids(arguments)
+            self.assertFalse(any('crm_archivedorder' in query['sql'] for query in queries), arguments)
+            self.assertNotIn(self.orders[400], ids)
+
+
+class IdempotencyTests(TestCase):
+    CREATE_CUSTOMER = '''
+        mutation CreateCustomer($input: CustomerInput!, $key: String) {
+            createCustomer(input: $input, idempotencyKey: $key) { success message customer { id email } }
+        }
+    '''
+
+    def execute(self, email, key):
+        return schema.execute(self.CREATE_CUSTOMER, variable_values={
+            'input': {'name': "Retry", 'email': email}, 'key': key,
+        })
+
+    def test_retry_returns_stored_result(self):
+        first = self.execute("retry@example.com", "key-1")
+        second = self.execute("retry@example.com", "key-1")
+        self.assertIsNone(second.errors)
+        self.assertTrue(second.data['createCustomer']['success'])
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(Customer.objects.count(), 1)
+
+    def test_without_key_executes_again(self):
+        self.execute("retry@example.com", None)
+        result = self.execute("retry@example.com", None)
+        self.assertEqual(result.data['createCustomer']['message'], "Email already exists")
+
+    def test_key_reused_with_different_arguments(self):
+        self.execute("first@example.com", "key-1")
+        result = self.execute("second@example.com", "key-1")
+        self.assertIn("different arguments", result.errors[0].message)
+        self.assertFalse(Customer.objects.filter(email="second@example.com").exists())
+
+    def test_expired_keys_are_purged_and_reusable(self):
+        self.execute("first@example.com", "key-1")
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(purge_expired(), 1)
+        result = self.execute("second@example.com", "key-1")
+        self.assertTrue(result.data['createCustomer']['success'])
+
+    def test_concurrent_duplicate_waits_for_stored_result(self):
+        first = self.execute("retry@example.com", "key-1")
+        stored = IdempotencyKey.objects.get().response
+        IdempotencyKey.objects.update(response=None)
+
+        def finish_first_request(seconds):
+            IdempotencyKey.objects.update(response=stored)
+
+        with mock.patch.object(idempotency.time, 'sleep', side_effect=finish_first_request) as sleep:
+            second = self.execute("retry@example.com", "key-1")
+        sleep.assert_called_once()
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(Customer.objects.count(), 1)
+
+    @override_settings(CRM_IDEMPOTENCY_WAIT_SECONDS=0)
+    def test_concurrent_duplicate_times_out(self):
+        self.execute("retry@example.com", "key-1")
+        IdempotencyKey.objects.update(response=None)
+        result = self.execute("retry@example.com", "key-1")
+        self.assertIn("still in progress", result.errors[0].message)
+
+    def test_concurrent_duplicate_sees_failed_request(self):
+        self.execute("retry@example.com", "key-1")
+        IdempotencyKey.objects.update(response=None)
+        with mock.patch.object(idempotency.time, 'sleep', side_effect=lambda seconds: IdempotencyKey.objects.all().delete()):
+            result = self.execute("retry@example.com", "key-1")
+        self.assertIn("failed; retry", result.errors[0].message)
+
+    def test_result_is_stored_with_the_mutation(self):
+        with mock.patch.object(idempotency, 'encode', side_effect=RuntimeError("crashed")):
+            result = self.execute("retry@example.com", "key-1")
+        self.assertIsNotNone(result.errors)
+        self.assertFalse(Customer.objects.exists())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_taken_over_claim_rolls_back(self):
+        encode = idempotency.encode
+
+        def taken_over(value):
+            # Another request took the key over while this one ran
+            IdempotencyKey.objects.update(created_at=timezone.now() + timedelta(seconds=1))
+            return encode(value)
+
+        with mock.patch.object(idempotency, 'encode', side_effect=taken_over):
+            result = self.execute("retry@example.com", "key-1")
+        self.assertIn("expired while the request ran", result.errors[0].message)
+        self.assertFalse(Customer.objects.exists())
+
+
+@override_settings(CRM_IMPORT_WORKERS=0)
+class ImportJobTests(TestCase):
+    START_IMPORT = '''
+        mutation StartImport($input: ImportJobInput!) {
+            startImportJob(input: $input) { success message job { id status totalRows } }
+        }
+    '''
+    JOB = '''
+        query Job($id: ID!) {
+            job(id: $id) { status progress processedRows succeededRows failedRows errors { row message } }
+        }
+    '''
+
+    def start(self, **fields):
+        result = schema.execute(self.START_IMPORT, variable_values={'input': fields})
+        self.assertIsNone(result.errors)
+        return result.data['startImportJob']
+
+    def job(self, job_id):
+        return schema.execute(self.JOB, variable_values={'id': job_id}).data['job']
+
+    def test_customer_import_in_chunks(self):
+        rows = [{'name': f"Row {i}", 'email': f"row{i}@example.com"} for i in range(5)]
+        rows.append({'name': "Duplicate", 'email': "row0@example.com"})
+        payload = self.start(customers=rows, chunkSize=2)
+        self.assertEqual(payload['job']['status'], 'PENDING')
+        self.assertEqual(payload['job']['totalRows'], 6)
+
+        self.assertEqual(run_pending(), 1)
+        job = self.job(payload['job']['id'])
+        self.assertEqual(job['status'], 'COMPLETED')
+        self.assertEqual((job['succeededRows'], job['failedRows']), (5, 1))
+        self.assertEqual(job['errors'], [{'row': 5, 'message': "Email already exists"}])
+        self.assertEqual(Customer.objects.count(), 5)
+
+    def test_resume_after_worker_stopped(self):
+        rows = [{'name': f"Product {i}", 'price': '9.99', 'stock': i} for i in range(6)]
+        job_id = self.start(products=rows, chunkSize=2)['job']['id']
+
+        # A worker commits one chunk and dies
+        process_chunk(claim_next_job())
+        ImportJob.objects.filter(id=job_id).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(self.job(job_id)['progress'], 2 / 6)
+
+        run_pending()
+        job = self.job(job_id)
+        self.assertEqual((job['status'], job['processedRows']), ('COMPLETED', 6))
+        self.assertEqual(Product.objects.count(), 6)
+
+    def test_slow_worker_does_not_duplicate_a_recovered_job(self):
+        rows = [{'name': f"Product {i}", 'price': '9.99', 'stock': i} for i in range(4)]
+        job_id = self.start(products=rows, chunkSize=2)['job']['id']
+
+        # Worker A claims the job, then stalls long enough to look dead
+        slow = claim_next_job()
+        ImportJob.objects.filter(id=job_id).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        # Worker B recovers and finishes it before A commits its first chunk
+        self.assertEqual(run_pending(), 1)
+
+        with self.assertLogs('crm.jobs', 'WARNING') as logs:
+            process_job(slow)
+        self.assertIn("taken over", logs.output[0])
+        job = self.job(job_id)
+        self.assertEqual((job['status'], job['processedRows'], job['succeededRows']), ('COMPLETED', 4, 4))
+        self.assertEqual(Product.objects.count(), 4)
+        self.assertEqual(OutboxEvent.objects.filter(entity='Product').count(), 4)
+
+    def test_order_import_is_bulk(self):
+        customer = Customer.objects.create(name="Importer", email="importer@example.com")
+        cable = Product.objects.create(name="Cable", price=Decimal('5.00'), stock=10)
+        plug = Product.objects.create(name="Plug", price=Decimal('2.50'), stock=10)
+
+        def rows(count):
+            return [
+                {'customer_id': str(customer.id), 'lines': [{'product_id': str(cable.id), 'quantity': 2}],
+                 'product_ids': [str(plug.id)], 'order_date': '2024-01-02T03:04:05+00:00'}
+                for _ in range(count)
+            ]
+
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(import_orders(rows(2), 0), [])
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(import_orders(rows(20), 0), [])
+        self.assertEqual(len(small), len(large))
+
+        order = Order.objects.latest('id')
+        self.assertEqual(order.total_amount, Decimal('12.50'))
+        self.assertEqual(order.order_date.year, 2024)
+        self.assertEqual(sorted(order.line_items.values_list('product_id', 'quantity')), [(cable.id, 2), (plug.id, 1)])
+        self.assertEqual(OutboxEvent.objects.filter(entity='Order').count(), 22)
+        self.assertEqual(len(OutboxEvent.objects.filter(entity='Order').last().payload['lines']), 2)
+
+    def test_order_import_reports_invalid_rows(self):
+        customer = Customer.objects.create(name="Importer", email="importer@example.com")
+        product = Product.objects.create(name="Cable", price=Decimal('5.00'), stock=10)
+        errors = import_orders([
+            {'customer_id': '999', 'product_ids': [str(product.id)]},
+            {'customer_id': 'abc', 'product_ids': [str(product.id)]},
+            {'customer_id': str(customer.id), 'product_ids': ['999']},
+            {'customer_id': str(customer.id), 'product_ids': []},
+            {'customer_id': str(customer.id), 'lines': [{'product_id': str(product.id), 'quantity': 0}]},
+            {'customer_id': str(customer.id), 'product_ids': [str(product.id)]},
+        ], 10)
+        self.assertEqual(errors, [
+            (10, "Customer with ID 999 does not exist"),
+            (11, "Customer with ID abc does not exist"),
+            (12, "Product with ID 999 does not exist"),
+            (13, "At least one product must be selected"),
+            (14, f"Quantity for product {product.id} must be at least 1"),
+        ])
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_requires_exactly_one_kind(self):
+        payload = self.start(customers=[], products=[])
+        self.assertFalse(payload['success'])
+        self.assertFalse(ImportJob.objects.exists())
+
+
+class OutboxTests(TestCase):
+    CHANGES = '''
+        query Changes($since: String, $limit: Int) {
+            changes(since: $since, limit: $limit) { cursor hasMore events { entity entityId action } }
+        }
+    '''
+
+    def create_customer(self, email):
+        return schema.execute(
+            'mutation($email: String!) { createCustomer(input: {name: "Feed", email: $email}) { success } }',
+            variable_values={'email': email},
+        ).data['createCustomer']['success']
+
+    def changes(self, since=None, limit=100):
+        result = schema.execute(self.CHANGES, variable_values={'since': since, 'limit': limit})
+        self.assertIsNone(result.errors)
+        return result.data['changes']
+
+    def test_events_follow_mutations(self):
+        self.assertTrue(self.create_customer("one@example.com"))
+        self.assertFalse(self.create_customer("one@example.com"))
+        self.assertTrue(self.create_customer("two@example.com"))
+
+        first = self.changes(limit=1)
+        self.assertTrue(first['hasMore'])
+        self.assertEqual(first['events'][0]['action'], 'CREATED')
+        second = self.changes(since=first['cursor'])
+        self.assertFalse(second['hasMore'])
+        self.assertEqual(
+            [event['entityId'] for event in first['events'] + second['events']],
+            list(Customer.objects.order_by('id').values_list('id', flat=True)),
+        )
+        self.assertEqual(self.changes(since=second['cursor'])['events'], [])
+
+    def test_order_payload_includes_lines(self):
+        customer = Customer.objects.create(name="Buyer", email="buyer@example.com")
+        product = Product.objects.create(name="Cable", price=Decimal('5.00'), stock=10)
+        schema.execute('mutation($input: OrderInput!) { createOrder(input: $input) { success } }', variable_values={
+            'input': {'customerId': str(customer.id), 'lines': [{'productId': str(product.id), 'quantity': 3}]},
+        })
+        event = OutboxEvent.objects.get(entity='Order')
+        self.assertEqual(event.payload['total_amount'], '15.00')
+        self.assertEqual(event.payload['lines'], [{'product_id': product.id, 'quantity': 3, 'unit_price': '5.00'}])
+
+    def test_out_of_order_created_at_does_not_skip_events(self):
+        # Concurrent writers: the later id committed an earlier timestamp
+        now = timezone.now()
+        ids = []
+        for offset in (2, 1, 3, 0):
+            event = OutboxEvent.objects.create(entity='Customer', entity_id=offset, action='CREATED', payload={})
+            OutboxEvent.objects.filter(pk=event.pk).update(created_at=now + timedelta(seconds=offset))
+            ids.append(event.id)
+
+        seen, cursor = [], None
+        for _ in ids:
+            events, cursor, _ = read_changes(cursor, limit=1)
+            seen.extend(event.id for event in events)
+        self.assertEqual(seen, ids)
+
+        streamed = list(iter_changes(batch_size=3))
+        self.assertEqual([event.id for event, _ in streamed], ids)
+        self.assertEqual(decode_cursor(streamed[-1][1]), {'default': ids[-1]})
+
+    def test_compaction_keeps_unacknowledged_events(self):
+        for email in ("a@example.com", "b@example.com", "c@example.com"):
+            self.create_customer(email)
+        cursor = self.changes(limit=2)['cursor']
+        schema.execute(
+            'mutation($cursor: String!) { ackChanges(consumer: "warehouse", cursor: $cursor) { success } }',
+            variable_values={'cursor': cursor},
+        )
+        self.assertEqual(compact(), {'default': 2})
+        self.assertEqual(len(self.changes(since=cursor)['events']), 1)
+
+
+class IncrementalDeliveryTests(TestCase):
+    QUERY = '''
+        query {
+            allOrders(first: 5) {
+                pageInfo { hasNextPage endCursor }
+                edges @stream(initialCount: 2, label: "orders") {
+                    node { totalAmount ... @defer(label: "customer") { customer { name } } }
+                }
+            }
+        }
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        customer = Customer.objects.create(name="Streamer", email="stream@example.com")
+        for amount in range(1, 7):
+            Order.objects.create(customer=customer, total_amount=Decimal(amount))
+
+    def post(self, **headers):
+        return self.client.post('/graphql', {'query': self.QUERY}, content_type='application/json', **headers)
+
+    def parts(self, response):
+        body = b''.join(response.streaming_content).decode()
+        self.assertTrue(body.endswith('\r\n-----\r\n'))
+        return [json.loads(part.split('\r\n\r\n', 1)[1]) for part in body.split('\r\n---')[1:-1]]
+
+    @override_settings(CRM_STREAM_CHUNK_SIZE=2)
+    def test_multipart_payloads_add_up_to_the_full_result(self):
+        response = self.post(HTTP_ACCEPT='multipart/mixed')
+        self.assertTrue(response['Content-Type'].startswith('multipart/mixed'))
+        initial, deferred, *chunks = self.parts(response)
+
+        connection = initial['data']['allOrders']
+        self.assertEqual(len(connection['edges']), 2)
+        self.assertNotIn('customer', connection['edges'][0]['node'])
+        self.assertEqual(
+            [(entry['path'], entry['label']) for entry in deferred['incremental']],
+            [(['allOrders', 'edges', 0, 'node'], 'customer'), (['allOrders', 'edges', 1, 'node'], 'customer')],
+        )
+        self.assertEqual([chunk['incremental'][0]['path'][-1] for chunk in chunks], [2, 4])
+        self.assertEqual([len(chunk['incremental'][0]['items']) for chunk in chunks], [2, 1])
+        self.assertEqual([chunk['hasNext'] for chunk in chunks], [True, False])
+
+        for entry in deferred['incremental']:
+            connection['edges'][entry['path'][2]]['node'].update(entry['data'])
+        for chunk in chunks:
+            connection['edges'].extend(chunk['incremental'][0]['items'])
+        connection['pageInfo'].update(chunks[-1]['incremental'][1]['data']['pageInfo'])
+        self.assertEqual(initial['data'], json.loads(self.post().content)['data'])
+
+    def test_without_multipart_accept_directives_are_ignored(self):
+        response = self.post()
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(len(json.loads(response.content)['data']['allOrders']['edges']), 5)
+
+    @override_settings(CRM_STREAM_CHUNK_SIZE=2)
+    def test_every_pass_is_checked_against_the_query_budget(self):
+        # One query per pass: initial payload, deferred pass and two chunks
+        with self.assertNoLogs('crm.query_budget'):
+            self.parts(self.post(HTTP_ACCEPT='multipart/mixed'))
+        with override_settings(CRM_QUERY_BUDGETS={'allOrders': 0}):
+            with self.assertLogs('crm.query_budget', 'WARNING') as logs:
+                self.parts(self.post(HTTP_ACCEPT='multipart/mixed'))
+        self.assertIn("GraphQL operation allOrders executed 4 SQL queries (budget 0)", logs.output[0])
+
+    @override_settings(CRM_SLOW_OPERATION_MS=0, CRM_SLOW_OPERATION_SAMPLE_RATE=1, CRM_STREAM_CHUNK_SIZE=2)
+    def test_streamed_operations_reach_the_slow_log(self):
+        with self.assertLogs('crm.slow_operations', 'INFO') as logs:
+            self.parts(self.post(HTTP_ACCEPT='multipart/mixed'))
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry['operation'], 'allOrders')
+        # Initial payload, deferred pass and two stream chunks
+        self.assertEqual(entry['query_count'], 4)
+
+    @override_settings(CRM_STREAM_CHUNK_SIZE=2)
+    def test_stream_applies_offset_once(self):
+        query = '''
+            query {
+                allOrders(first: 4, offset: 1, orderBy: "-totalAmount") {
+                    edges @stream(initialCount: 1) { node { totalAmount } }
+                }
+            }
+        '''
+        response = self.client.post(
+            '/graphql', {'query': query}, content_type='application/json', HTTP_ACCEPT='multipart/mixed',
+        )
+        initial, *chunks = self.parts(response)
+        edges = initial['data']['allOrders']['edges']
+        for chunk in chunks:
+            edges.extend(chunk['incremental'][0]['items'])
+        self.assertEqual([edge['node']['totalAmount'] for edge in edges], ['5.00', '4.00', '3.00', '2.00'])
+
+    def test_deferred_pass_only_selects_deferred_fields(self):
+        operation = IncrementalOperation.prepare(schema, '''
+            query {
+                hello
+                allOrders(first: 2) {
+                    totalCount
+                    edges { node { totalAmount products { edges { node { name } } } ...Buyer @defer } }
+                }
+            }
+            fragment Buyer on OrderType { customer { name } }
+        ''', None, None)
+        operation.initial_document(strip_deferred=True)
+        deferred = print_ast(operation.deferred_document().definitions[0])
+        self.assertIn('...Buyer @defer', deferred)
+        for skipped in ('hello', 'totalCount', 'totalAmount', 'products'):
+            self.assertNotIn(skipped, deferred)
+
+    def test_multipart_framing(self):
+        self.assertEqual(
+            b''.join(multipart([{'hasNext': False}])),
+            b'\r\n---\r\ncontent-type: application/json; charset=utf-8\r\n\r\n{"hasNext":false}\r\n-----\r\n',
+        )
+
+
+class EncodingTests(TestCase):
+    def test_encoders_agree(self):
+        data = {'data': {'total': Decimal('12.50'), 'at': timezone.now(), 'name': "Zoë"}}
+        self.assertEqual(json.loads(encoding.orjson_encode(data)), json.loads(encoding.stdlib_encode(data)))
+        self.assertEqual(
+            json.loads(encoding.orjson_encode(data, pretty=True)), json.loads(encoding.stdlib_encode(data, pretty=True)),
+        )
+
+    def test_view_uses_configured_encoder(self):
+        Customer.objects.create(name="Encoded", email="encoded@example.com")
+        query = {'query': '{ allCustomers { edges { node { name createdAt } } } }'}
+        responses = []
+        for encoder in ('crm.encoding.orjson_encode', 'crm.encoding.stdlib_encode'):
+            with override_settings(CRM_JSON_ENCODER=encoder):
+                responses.append(self.client.post('/graphql', query, content_type='application/json'))
+        self.assertEqual(json.loads(responses[0].content), json.loads(responses[1].content))
+        self.assertEqual(responses[1].content, encoding.stdlib_encode(json.loads(responses[0].content)))
+
+
+class ResponseSizeTests(TestCase):
+    QUERY = {'query': '{ allOrders { edges { node { id totalAmount customer { id name email } } } } }'}
+
+    @classmethod
+    def setUpTestData(cls):
+        customer = Customer.objects.create(name="Repeat", email="repeat@example.com")
+        for amount in range(1, 31):
+            Order.objects.create(customer=customer, total_amount=Decimal(amount))
+
+    def test_large_responses_are_gzipped(self):
+        plain = self.client.post('/graphql', self.QUERY, content_type='application/json')
+        compressed = self.client.post(
+            '/graphql', self.QUERY, content_type='application/json', HTTP_ACCEPT_ENCODING='gzip',
+        )
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', compressed['Vary'])
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+
+        small = self.client.post(
+            '/graphql', {'query': '{ hello }'}, content_type='application/json', HTTP_ACCEPT_ENCODING='gzip',
+        )
+        self.assertFalse(small.has_header('Content-Encoding'))
+
+    def test_choose_coding(self):
+        self.assertEqual(CompressionMiddleware.choose_coding('gzip, deflate'), 'gzip')
+        self.assertIsNone(CompressionMiddleware.choose_coding('gzip;q=0, identity'))
+        self.assertIsNone(CompressionMiddleware.choose_coding(''))
+        self.assertEqual(CompressionMiddleware.choose_coding('*'), 'gzip')
+
+    def test_normalized_response_stores_each_node_once(self):
+        plain = json.loads(self.client.post('/graphql', self.QUERY, content_type='application/json').content)
+        normalized = json.loads(self.client.post(
+            '/graphql', self.QUERY, content_type='application/json', HTTP_X_CRM_NORMALIZE='1',
+        ).content)
+        entities = normalized['extensions']['entities']
+        self.assertEqual(len(entities), 31)
+
+        def resolve(value):
+            if isinstance(value, list):
+                return [resolve(item) for item in value]
+            if isinstance(value, dict):
+                value = entities[value['$ref']] if '$ref' in value else value
+                return {key: resolve(item) for key, item in value.items()}
+            return value
+
+        self.assertEqual(resolve(normalized['data']), plain['data'])
+
+    def test_conflicting_objects_stay_inline(self):
+        response = {'data': {'a': {'id': 'X', 'n': 1}, 'b': {'id': 'X', 'n': 2}, 'c': {'id': 'X'}}}
+        normalized = encoding.normalize(response)
+        self.assertEqual(normalized['data'], {'a': {'$ref': 'X'}, 'b': {'id': 'X', 'n': 2}, 'c': {'$ref': 'X'}})
+        self.assertEqual(normalized['extensions']['entities'], {'X': {'id': 'X', 'n': 1}})
+
+
+class CustomerEmailTests(TestCase):
+    CREATE = '''
+        mutation($email: String!) { createCustomer(input: {name: "Case", email: $email}) { success message } }
+    '''
+
+    def test_email_uniqueness_ignores_case(self):
+        first = schema.execute(self.CREATE, variable_values={'email': "Alice@Example.com"}).data['createCustomer']
+        second = schema.execute(self.CREATE, variable_values={'email': "alice@example.COM"}).data['createCustomer']
+        self.assertTrue(first['success'])
+        self.assertEqual(second, {'success': False, 'message': "Email already exists"})
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Customer.objects.create(name="Race", email="ALICE@EXAMPLE.COM")
+
+    def test_email_exact_filter(self):
+        Customer.objects.create(name="Alice", email="Alice@Example.com")
+        Customer.objects.create(name="Alicia", email="alice@example.org")
+        result = schema.execute('{ allCustomers(emailExact: "alice@example.com") { edges { node { name } } } }')
+        self.assertEqual(result.data['allCustomers']['edges'], [{'node': {'name': "Alice"}}])
+
+    def test_import_skips_case_duplicates(self):
+        Customer.objects.create(name="Alice", email="Alice@Example.com")
+        jobs.import_customers([
+            {'name': "Dup", 'email': "ALICE@example.com"},
+            {'name': "New", 'email': "new@example.com"},
+            {'name': "New again", 'email': "NEW@example.com"},
+        ], 0)
+        self.assertEqual(Customer.objects.count(), 2)
+
+
+class CustomerPhoneTests(TestCase):
+    def test_to_e164(self):
+        self.assertEqual(phones.to_e164("+1234567890"), "+1234567890")
+        self.assertEqual(phones.to_e164("123-456-7890"), "+11234567890")
+        self.assertEqual(phones.to_e164("1-123-456-7890"), "+11234567890")
+        self.assertEqual(phones.to_e164("+44 20 7946 0958"), "+442079460958")
+        self.assertIsNone(phones.to_e164(""))
+        self.assertIsNone(phones.to_e164(None))
+
+    def test_writes_fill_phone_e164(self):
+        result = schema.execute('''
+            mutation { createCustomer(input: {name: "Bob", email: "bob@example.com", phone: "123-456-7890"}) {
+                customer { phone phoneE164 }
+            } }
+        ''')
+        self.assertEqual(result.data['createCustomer']['customer'], {'phone': "123-456-7890", 'phoneE164': "+11234567890"})
+        customer = Customer.objects.get()
+        customer.phone = "+447946000000"
+        customer.save(update_fields=['phone'])
+        self.assertEqual(Customer.objects.get().phone_e164, "+447946000000")
+
+        jobs.import_customers([{'name': "Carol", 'email': "carol@example.com", 'phone': "555-123-4567"}], 0)
+        self.assertEqual(Customer.objects.get(name="Carol").phone_e164, "+15551234567")
+
+    def test_phone_pattern_is_a_prefix_on_the_normalized_number(self):
+        for name, phone in [("Alice", "+1234567890"), ("Bob", "123-456-7890"), ("Carol", "+9876543210"), ("David", "")]:
+            Customer.objects.create(name=name, email=f"{name.lower()}@example.com", phone=phone)
+
+        def names(pattern):
+            result = schema.execute(
+                'query($p: String) { allCustomers(phonePattern: $p) { edges { node { name } } } }',
+                variable_values={'p': pattern},
+            )
+            return [edge['node']['name'] for edge in result.data['allCustomers']['edges']]
+
+        self.assertEqual(names("+1"), ["Alice", "Bob"])
+        self.assertEqual(names("123"), ["Bob"])
+        self.assertEqual(names("+98"), ["Carol"])
+        self.assertEqual(names("x"), [])
+
+    def test_backfill_command(self):
+        Customer.objects.create(name="Alice", email="alice@example.com", phone="123-456-7890")
+        Customer.objects.create(name="Bob", email="bob@example.com", phone="")
+        Customer.objects.update(phone_e164=None)
+        call_command('backfill_phones', batch_size=1, stdout=io.StringIO())
+        self.assertEqual(
+            dict(Customer.objects.values_list('name', 'phone_e164')), {"Alice": "+11234567890", "Bob": None}
+        )
+
+
+class PhoneBackfillMigrationTests(TransactionTestCase):
+    BEFORE = [('crm', '0008_customer_email_ci_unique')]
+
+    def test_migration_fills_existing_rows(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.BEFORE)
+        OldCustomer = executor.loader.project_state(self.BEFORE).apps.get_model('crm', 'Customer')
+        OldCustomer.objects.create(name="Alice", email="alice@example.com", phone="123-456-7890")
+        OldCustomer.objects.create(name="Bob", email="bob@example.com", phone="")
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+        self.assertEqual(
+            dict(Customer.objects.values_list('name', 'phone_e164')), {"Alice": "+11234567890", "Bob": None}
+        )
+
+
+class FilterPlanTests(TestCase):
+    def test_plan_is_cached_per_argument_names(self):
+        plan = CustomerFilter.get_plan(frozenset(['name']))
+        self.assertIs(CustomerFilter.get_plan(frozenset(['name'])), plan)
+        self.assertIsNot(CustomerFilter.get_plan(frozenset(['name', 'email'])), plan)
+        self.assertEqual(list(plan.form_class.base_fields), ['name'])
+
+        filterset = CustomerFilter(data={'name': "Ali"}, queryset=Customer.objects.all())
+        self.assertEqual(list(filterset.filters), ['name'])
+        self.assertIs(filterset.get_form_class(), plan.form_class)
+
+    def test_planned_filters_match_django_filter(self):
+        Customer.objects.create(name="Alice", email="alice@example.com", phone="+1234567890")
+        Customer.objects.create(name="Bob", email="bob@example.com", phone="+447946000000")
+        data = {'name': "", 'phone_pattern': "+1", 'created_at__gte': timezone.now() - timedelta(days=1)}
+
+        planned = CustomerFilter(data=data, queryset=Customer.objects.all())
+        # A (blank) form prefix takes django-filter's own path
+        unplanned = CustomerFilter(data=data, queryset=Customer.objects.all(), prefix='')
+        self.assertIsNotNone(planned._plan)
+        self.assertIsNone(unplanned._plan)
+        self.assertEqual(str(planned.qs.query), str(unplanned.qs.query))
+        self.assertEqual([c.name for c in planned.qs], ["Alice"])
+
+    def test_method_filters_are_bound_per_request(self):
+        first = CustomerFilter(data={'phone_pattern': "+1"}, queryset=Customer.objects.all())
+        second = CustomerFilter(data={'phone_pattern': "+44"}, queryset=Customer.objects.all())
+        self.assertIs(first.filters['phone_pattern'].parent, first)
+        self.assertIs(second.filters['phone_pattern'].parent, second)
+        self.assertIn("+1:", str(first.qs.query))
+        self.assertIn("+44:", str(second.qs.query))
+
+    def test_invalid_values_are_reported(self):
+        filterset = CustomerFilter(data={'created_at__gte': "yesterday"}, queryset=Customer.objects.all())
+        self.assertFalse(filterset.is_valid())
+        self.assertIn('created_at__gte', filterset.errors)
+
+
+@override_settings(CRM_COUNT_LOCAL_CACHE_TTL=300)
+class TotalCountTests(TransactionTestCase):
+    # Counts are only cached outside transactions, so this case commits its writes.
+    # The test process is the only worker, so its local cache may hold exact counts.
+    PRODUCTS = '''
+        query($gte: Decimal, $approximate: Boolean) {
+            allProducts(price_Gte: $gte, first: 2) {
+                totalCount(approximate: $approximate)
+                edges { node { name } }
+                pageInfo { hasNextPage }
+            }
+        }
+    '''
+
+    def setUp(self):
+        cache.clear()
+        for index, price in enumerate(["10.00", "60.00", "70.00", "80.00"]):
+            Product.objects.create(name=f"Product {index}", price=Decimal(price), stock=1)
+
+    def products(self, gte=None, approximate=False):
+        result = schema.execute(self.PRODUCTS, variable_values={'gte': gte, 'approximate': approximate})
+        self.assertIsNone(result.errors)
+        return result.data['allProducts']
+
+    def test_pages_are_not_counted(self):
+        with self.assertNumQueries(1):
+            result = schema.execute('''{
+                allProducts(first: 2, offset: 1) { edges { node { name } } pageInfo { hasNextPage } }
+            }''')
+        self.assertEqual(
+            [edge['node']['name'] for edge in result.data['allProducts']['edges']], ["Product 1", "Product 2"]
+        )
+        self.assertTrue(result.data['allProducts']['pageInfo']['hasNextPage'])
+        last = schema.execute('{ allProducts(first: 2, offset: 2) { pageInfo { hasNextPage } } }')
+        self.assertFalse(last.data['allProducts']['pageInfo']['hasNextPage'])
+
+    def test_exact_count_is_cached_per_filter_and_invalidated_by_writes(self):
+        self.assertEqual(self.products("50")['totalCount'], 3)
+        with self.assertNumQueries(1):
+            # 50 and 50.0 filter the same rows; only the page is queried
+            self.assertEqual(self.products("50.0")['totalCount'], 3)
+        self.assertEqual(self.products()['totalCount'], 4)
+
+        Product.objects.create(name="Product 4", price=Decimal("90.00"), stock=1)
+        self.assertEqual(self.products("50")['totalCount'], 4)
+
+    @override_settings(CRM_COUNT_APPROXIMATE_MIN_ROWS=3, CRM_COUNT_SAMPLE_SIZE=2)
+    def test_approximate_count(self):
+        self.assertEqual(self.products(approximate=True)['totalCount'], 4)
+        Product.objects.create(name="Product 4", price=Decimal("5.00"), stock=1)
+        with self.assertNumQueries(1):
+            # The row counter follows committed creates without recounting
+            self.assertEqual(self.products(approximate=True)['totalCount'], 5)
+        # One of the two newest products costs at least 50: half of 5 rows
+        self.assertEqual(self.products("50", approximate=True)['totalCount'], 2)
+        self.assertEqual(self.products("50")['totalCount'], 3)
+        self.assertEqual(self.products("50", approximate=True)['totalCount'], 3)
+
+    def test_small_tables_are_counted_exactly(self):
+        self.assertEqual(self.products("50", approximate=True)['totalCount'], 3)
+
+    @override_settings(CRM_COUNT_LOCAL_CACHE_TTL=0)
+    def test_exact_counts_are_not_cached_per_process(self):
+        self.assertFalse(counting.shared_cache())
+        self.assertEqual(self.products("50")['totalCount'], 3)
+        # Another worker's write sends no version bump to this process
+        Product.objects.bulk_create([Product(name="Product 4", price=Decimal("90.00"), stock=1)])
+        with self.assertNumQueries(2):
+            self.assertEqual(self.products("50")['totalCount'], 4)
+
+    def test_exact_counts_are_cached_in_a_shared_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            shared = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory}}
+            with override_settings(CACHES=shared, CRM_COUNT_LOCAL_CACHE_TTL=0):
+                self.assertTrue(counting.shared_cache())
+                self.assertEqual(self.products("50")['totalCount'], 3)
+                with self.assertNumQueries(1):
+                    self.assertEqual(self.products("50")['totalCount'], 3)
+
+
+class OrderingTests(TestCase):
+    def execute(self, query):
+        result = schema.execute(query)
+        return result.data, result.errors
+
+    def query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            return str(cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall())
+
+    def test_orderings_are_served_by_an_index(self):
+        self.assertIn('TEMP B-TREE', self.query_plan(Product.objects.order_by('stock', 'name')))
+        for filterset_class in (CustomerFilter, ProductFilter, OrderFilter):
+            model = filterset_class._meta.model
+            querysets = [model.objects.all()] + ([ArchivedOrder.objects.all()] if model is Order else [])
+            for ordering in filterset_class.base_filters['order_by'].orderings:
+                for variant in (ordering, reverse_ordering(ordering)):
+                    for queryset in querysets:
+                        plan = self.query_plan(queryset.order_by(*variant))
+                        self.assertNotIn('TEMP B-TREE', plan, (queryset.model, variant))
+
+    def test_order_by_argument(self):
+        customer = Customer.objects.create(name="Alice", email="alice@example.com")
+        for index, total in enumerate(["50.00", "75.00", "75.00", "20.00"]):
+            Order.objects.create(customer=customer, total_amount=Decimal(total))
+
+        data, errors = self.execute('{ allOrders(orderBy: "-totalAmount, id") { edges { node { id totalAmount } } } }')
+        self.assertIsNone(errors)
+        totals = [edge['node']['totalAmount'] for edge in data['allOrders']['edges']]
+        self.assertEqual(totals, ["75.00", "75.00", "50.00", "20.00"])
+        ids = [edge['node']['id'] for edge in data['allOrders']['edges']]
+
+        reversed_data, _ = self.execute('{ allOrders(orderBy: "totalAmount") { edges { node { id } } } }')
+        self.assertEqual([edge['node']['id'] for edge in reversed_data['allOrders']['edges']], ids[::-1])
+
+        page, _ = self.execute('{ allOrders(orderBy: "-totalAmount", first: 2, offset: 1) { edges { node { id } } } }')
+        self.assertEqual([edge['node']['id'] for edge in page['allOrders']['edges']], ids[1:3])
+
+    def test_unindexed_orderings_are_rejected(self):
+        for ordering in ("stock,name", "customer__name", "price,-name"):
+            data, errors = self.execute('{ allProducts(orderBy: "%s") { edges { node { id } } } }' % ordering)
+            self.assertIn("Unsupported orderBy", errors[0].message)
+
+
+class ProductCatalogTests(TransactionTestCase):
+    # The catalog is only loaded outside transactions, so this case commits its writes
+    ORDER_PRODUCTS = '{ allOrders { edges { node { products%s { edges { node { name price } } } } } } }'
+
+    def setUp(self):
+        cache.clear()
+        catalog.reset()
+        self.addCleanup(catalog.reset)
+        self.customer = Customer.objects.create(name="Alice", email="alice@example.com")
+        self.mouse = Product.objects.create(name="Mouse", price=Decimal("25.50"), stock=50)
+        self.laptop = Product.objects.create(name="Laptop", price=Decimal("999.99"), stock=5)
+
+    def test_lookup_reads_the_catalog(self):
+        self.assertEqual(len(catalog.get_catalog()), 2)
+        with self.assertNumQueries(0):
+            found = catalog.lookup({self.laptop.id, self.mouse.id})
+        self.assertEqual(found[self.laptop.id].price, Decimal("999.99"))
+        self.assertEqual(found[self.mouse.id].name, "Mouse")
+        self.assertEqual(found[self.mouse.id].created_at, self.mouse.created_at)
+
+        sizes = catalog.get_catalog().footprint()
+        self.assertEqual(set(sizes), {'ids', 'names', 'prices', 'stocks', 'created', 'total'})
+        self.assertEqual(sizes['total'], sum(size for name, size in sizes.items() if name != 'total'))
+
+    def test_writes_refresh_the_catalog(self):
+        catalog.get_catalog()
+        self.laptop.price = Decimal("899.00")
+        self.laptop.save()
+        keyboard = Product.objects.create(name="Keyboard", price=Decimal("45.00"), stock=10)
+        mouse_id = self.mouse.id
+        self.mouse.delete()
+
+        found = catalog.lookup({self.laptop.id, keyboard.id, mouse_id})
+        self.assertEqual(found[self.laptop.id].price, Decimal("899.00"))
+        self.assertIn(keyboard.id, found)
+        self.assertNotIn(mouse_id, found)
+        with self.assertNumQueries(0):
+            catalog.lookup({self.laptop.id})
+
+    def test_products_it_does_not_hold_are_loaded(self):
+        catalog.get_catalog()
+        # No signals, like a product created by another process
+        (keyboard,) = Product.objects.bulk_create([Product(name="Keyboard", price=Decimal("45.00"))])
+        with self.assertNumQueries(1):
+            self.assertEqual(catalog.lookup({keyboard.id})[keyboard.id].name, "Keyboard")
+        with self.assertNumQueries(0):
+            catalog.lookup({keyboard.id})
+
+    def test_not_used_inside_transactions(self):
+        with transaction.atomic():
+            self.assertIsNone(catalog.get_catalog())
+            with self.assertNumQueries(1):
+                self.assertEqual(len(catalog.lookup({self.laptop.id, self.mouse.id})), 2)
+
+    def test_create_order_ignores_a_stale_catalog_price(self):
+        catalog.get_catalog()
+        # A queryset update sends no signals, so the catalog keeps the old price
+        Product.objects.filter(pk=self.laptop.pk).update(price=Decimal("899.99"))
+        self.assertEqual(catalog.lookup({self.laptop.id})[self.laptop.id].price, self.laptop.price)
+
+        result = schema.execute(
+            'mutation($input: OrderInput!) { createOrder(input: $input) { success order { totalAmount } } }',
+            variable_values={'input': {
+                'customerId': str(self.customer.id),
+                'lines': [{'productId': str(self.laptop.id), 'quantity': 1}, {'productId': str(self.mouse.id), 'quantity': 2}],
+            }},
+        )
+        self.assertIsNone(result.errors)
+        self.assertEqual(result.data['createOrder']['order']['totalAmount'], '950.99')
+
+    def test_order_products(self):
+        for products in ([self.mouse, self.laptop], [self.mouse]):
+            order = Order.objects.create(customer=self.customer, total_amount=Decimal("0.00"))
+            for product in products:
+                OrderLine.objects.create(order=order, product=product, unit_price=product.price)
+        catalog.get_catalog()
+
+        with self.assertNumQueries(2):
+            # The orders (with their customers) and every order's lines
+            result = schema.execute(self.ORDER_PRODUCTS % '')
+        self.assertIsNone(result.errors)
+        names = [
+            [edge['node']['name'] for edge in order['node']['products']['edges']]
+            for order in result.data['allOrders']['edges']
+        ]
+        self.assertEqual(sorted(names), [["Laptop", "Mouse"], ["Mouse"]])
+
+        # Filtered products are still queried
+        filtered = schema.execute(self.ORDER_PRODUCTS % '(name: "lap")')
+        names = [
+            [edge['node']['name'] for edge in order['node']['products']['edges']]
+            for order in filtered.data['allOrders']['edges']
+        ]
+        self.assertEqual(sorted(names), [[], ["Laptop"]])
+
+
+class NodeTests(TestCase):
+    NODES = '''
+        query($ids: [ID!]!) {
+            nodes(ids: $ids) { __typename id ... on OrderType { totalAmount customer { name } } ... on CustomerType { name } }
+        }
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = Customer.objects.create(name="Node", email="node@example.com")
+        cls.product = Product.objects.create(name="Widget", price=Decimal('2.50'), stock=1)
+        cls.orders = [Order.objects.create(customer=cls.customer, total_amount=Decimal(n)) for n in range(1, 6)]
+        ArchivedOrder.objects.create(
+            id=9000, customer=cls.customer, total_amount=Decimal('7.00'), order_date=timezone.now(),
+        )
+
+    def test_nodes_keep_order_and_batch_by_type(self):
+        ids = [to_global_id('OrderType', order.id) for order in reversed(self.orders)]
+        ids += [
+            to_global_id('CustomerType', self.customer.id), to_global_id('ProductType', self.product.id),
+            to_global_id('OrderType', 9000), to_global_id('OrderType', 123456), 'not-an-id',
+            to_global_id('ImportJobType', 1), ids[0],
+        ]
+        # Orders, archived orders, customers, products
+        with self.assertNumQueries(4):
+            result = schema.execute(self.NODES, variable_values={'ids': ids})
+        self.assertIsNone(result.errors)
+        nodes = result.data['nodes']
+        self.assertEqual([node and node['id'] for node in nodes], ids[:8] + [None, None, None, ids[0]])
+        self.assertEqual(nodes[0]['totalAmount'], '5.00')
+        self.assertEqual(nodes[5]['name'], "Node")
+        self.assertEqual(nodes[7]['customer'], {'name': "Node"})
+
+    def test_node(self):
+        result = schema.execute(
+            'query($id: ID!) { node(id: $id) { id ... on ProductType { name } } }',
+            variable_values={'id': to_global_id('ProductType', self.product.id)},
+        )
+        self.assertEqual(result.data['node']['name'], "Widget")
+
+
+class SchemaConstructionTests(SimpleTestCase):
+    def test_artifact_matches_schema(self):
+        self.assertTrue(schema_artifact.is_current(), "Run manage.py export_schema")
+        self.assertEqual(schema_artifact.ARTIFACT_PATH.read_text(encoding='utf-8'), schema_artifact.render(schema))
+
+    def test_import_does_not_build_schema(self):
+        code = (
+            "import django; django.setup()\n"
+            "import alx_backend_graphql.schema as project, crm.schema as crm\n"
+            "assert project.get_schema.cache_info().currsize == 0\n"
+            "assert crm.get_schema.cache_info().currsize == 0\n"
+            "assert project.schema is project.get_schema()\n"
+        )
+        subprocess.run(
+            [sys.executable, '-c', code], check=True, cwd=schema_artifact.BASE_DIR,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'alx_backend_graphql.settings'},
+        )
+
+
+@override_settings(CRM_IMPORT_WORKERS=0)
+class PublishTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(pubsub, 'has_subscribers', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def published(self, topic, run):
+        with mock.patch.object(pubsub, 'publish') as publish:
+            with self.captureOnCommitCallbacks() as callbacks:
+                run()
+            publish.assert_not_called()
+            for callback in callbacks:
+                callback()
+        return [call.args[1] for call in publish.call_args_list if call.args[0] == topic]
+
+    def test_order_created_after_commit_with_lines(self):
+        customer = Customer.objects.create(name="Buyer", email="buyer@example.com")
+        product = Product.objects.create(name="Cable", price=Decimal('5.00'), stock=10)
+        messages = self.published(pubsub.ORDER_CREATED, lambda: schema.execute(
+            'mutation($input: OrderInput!) { createOrder(input: $input) { success } }',
+            variable_values={'input': {
+                'customerId': str(customer.id), 'lines': [{'productId': str(product.id), 'quantity': 3}],
+            }},
+        ))
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0]['customer_name'], "Buyer")
+        self.assertEqual(messages[0]['total_amount'], Decimal('15.00'))
+        self.assertEqual(messages[0]['lines'], [
+            {'product_id': product.id, 'product_name': "Cable", 'quantity': 3, 'unit_price': Decimal('5.00')},
+        ])
+
+    def test_imported_rows_are_published(self):
+        customer = Customer.objects.create(name="Buyer", email="buyer@example.com")
+        product = Product.objects.create(name="Cable", price=Decimal('5.00'), stock=10)
+        jobs.enqueue(ImportJob.KIND_PRODUCTS, [{'name': "Plug", 'price': '2.50', 'stock': 4}])
+        jobs.enqueue(ImportJob.KIND_ORDERS, [{'customer_id': str(customer.id), 'product_ids': [str(product.id)]}])
+
+        with mock.patch.object(pubsub, 'publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                run_pending()
+        topics = [call.args for call in publish.call_args_list]
+        self.assertEqual([message['name'] for topic, message in topics if topic == pubsub.STOCK_CHANGED], ["Plug"])
+        self.assertEqual(
+            [message['customer_id'] for topic, message in topics if topic == pubsub.ORDER_CREATED], [customer.id]
+        )
+
+
+class SubscriptionTests(SimpleTestCase):
+    async def open_socket(self):
+        inbox, outbox = asyncio.Queue(), asyncio.Queue()
+        scope = {'type': 'websocket', 'path': '/graphql', 'subprotocols': ['graphql-transport-ws']}
+        task = asyncio.ensure_future(GraphQLWebSocket(schema)(scope, inbox.get, outbox.put))
+        await inbox.put({'type': 'websocket.connect'})
+        self.assertEqual((await outbox.get())['subprotocol'], 'graphql-transport-ws')
+
+        async def send(message):
+            await inbox.put({'type': 'websocket.receive', 'text': json.dumps(message)})
+
+        async def receive():
+            return json.loads((await asyncio.wait_for(outbox.get(), 1))['text'])
+
+        await send({'type': 'connection_init'})
+        self.assertEqual(await receive(), {'type': 'connection_ack'})
+        return task, inbox, send, receive
+
+    async def test_stock_changed_threshold(self):
+        task, inbox, send, receive = await self.open_socket()
+        await send({'id': '1', 'type': 'subscribe', 'payload': {
+            'query': 'subscription { stockChanged(threshold: 10) { name stock previousStock } }',
+        }})
+        await asyncio.sleep(0.05)
+        base = {'id': 1, 'price': Decimal('5.00')}
+        pubsub.publish(pubsub.STOCK_CHANGED, {**base, 'name': "Plenty", 'stock': 50, 'previous_stock': 40})
+        pubsub.publish(pubsub.STOCK_CHANGED, {**base, 'name': "Low", 'stock': 3, 'previous_stock': 12})
+        message = await receive()
+        self.assertEqual(message['type'], 'next')
+        self.assertEqual(message['payload']['data']['stockChanged'], {'name': "Low", 'stock': 3, 'previousStock': 12})
+
+        await send({'id': '1', 'type': 'complete'})
+        await inbox.put({'type': 'websocket.disconnect'})
+        await task
+        self.assertFalse(pubsub.has_subscribers(pubsub.STOCK_CHANGED))
+
+    async def test_query_and_protocol_errors(self):
+        task, inbox, send, receive = await self.open_socket()
+        await send({'id': 'q', 'type': 'subscribe', 'payload': {'query': '{ hello }'}})
+        self.assertEqual((await receive())['payload'], {'data': {'hello': "Hello, GraphQL!"}})
+        self.assertEqual(await receive(), {'id': 'q', 'type': 'complete'})
+        await send({'type': 'ping'})
+        self.assertEqual(await receive(), {'type': 'pong'})
+        await send({'type': 'connection_init'})
+        await task
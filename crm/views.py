@@ -1,3 +1,125 @@
-from django.shortcuts import render
+import json
+import time
 
-# Create your views here.
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from graphene_django.views import GraphQLView, HttpError
+
+from . import encoding, metrics, outbox, routers, slow_log
+from .incremental import CONTENT_TYPE, IncrementalOperation, accepts_multipart, multipart, uses_directives
+from .instrumentation import QueryRecorder, operation_label, operation_type
+from .query_budget import check_operation
+
+
+class CRMGraphQLView(GraphQLView):
+    """GraphQL endpoint with per-operation SQL instrumentation"""
+
+    def dispatch(self, request, *args, **kwargs):
+        response = self.incremental_response(request)
+        if response is not None:
+            return response
+        return super().dispatch(request, *args, **kwargs)
+
+    def incremental_response(self, request):
+        """Stream ``@defer``/``@stream`` queries as ``multipart/mixed`` when the client accepts it"""
+        if self.batch or request.method not in ('GET', 'POST') or not accepts_multipart(request):
+            return None
+        try:
+            data = self.parse_body(request)
+            query, variables, operation_name, _ = self.get_graphql_params(request, data)
+        except HttpError:
+            return None
+        if not query or not uses_directives(query):
+            return None
+        operation = IncrementalOperation.prepare(
+            self.schema, query, variables, operation_name,
+            root_value=self.get_root_value(request),
+            context_value=self.get_context(request),
+            middleware=self.get_middleware(request),
+        )
+        if operation is None:
+            return None
+
+        label = operation_label(query, operation_name)
+
+        def payloads():
+            # Every pass (initial, deferred, stream chunks) is recorded in
+            # the operation's budget check and slow-log entry
+            sampled = slow_log.should_sample()
+            start = time.perf_counter()
+            with QueryRecorder() as recorder:
+                yield from operation.payloads()
+            self.observe_operation(
+                label, variables, sampled, start, recorder, operation.errors, executions=operation.executions
+            )
+
+        return StreamingHttpResponse(multipart(payloads()), content_type=CONTENT_TYPE)
+
+    def observe_operation(self, label, variables, sampled, start, recorder, errors, executions=1):
+        """Check the query budget, write the slow log and record metrics for one operation"""
+        duration_ms = (time.perf_counter() - start) * 1000
+        check_operation(label, recorder, executions)
+        if sampled:
+            slow_log.record_if_slow(label, variables, duration_ms, recorder)
+        metrics.observe_operation(label, duration_ms, len(recorder), errors)
+
+    def json_encode(self, request, d, pretty=False):
+        if encoding.wants_normalized(request):
+            d = encoding.normalize(d)
+        encoded = encoding.encode(d, pretty=bool(self.pretty or pretty or request.GET.get('pretty')))
+        # Batched responses are joined as text by GraphQLView.dispatch
+        return encoded.decode('utf-8') if self.batch else encoded
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        if not query:
+            return super().execute_graphql_request(
+                request, data, query, variables, operation_name, show_graphiql
+            )
+
+        if operation_type(query, operation_name) == 'mutation':
+            # Mutations validate against and write to the primary, and the
+            # rest of the request keeps reading from it
+            routers.pin_primary()
+
+        sampled = slow_log.should_sample()
+        start = time.perf_counter()
+        with QueryRecorder() as recorder:
+            result = super().execute_graphql_request(
+                request, data, query, variables, operation_name, show_graphiql
+            )
+        self.observe_operation(
+            operation_label(query, operation_name), variables, sampled, start, recorder,
+            len(result.errors or []) if result else 0,
+        )
+        return result
+
+
+def metrics_view(request):
+    """Expose collected metrics in the Prometheus text format"""
+    return HttpResponse(
+        metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
+@require_GET
+def changes_stream_view(request):
+    """Stream change feed events as newline-delimited JSON.
+
+    ``?since=<cursor>`` resumes after a cursor from ``changes`` or a previous
+    line; ``?follow=<seconds>`` keeps the response open that long, sending
+    new events as they are committed. Every line carries the cursor to
+    resume after its event.
+    """
+    since = request.GET.get('since') or None
+    try:
+        outbox.decode_cursor(since)
+        follow = min(float(request.GET.get('follow', 0)), settings.CRM_OUTBOX_STREAM_MAX_SECONDS)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    def lines():
+        for event, cursor in outbox.iter_changes(since, follow=max(follow, 0.0)):
+            yield json.dumps({'cursor': cursor, 'event': outbox.event_to_dict(event)}) + '\n'
+
+    return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
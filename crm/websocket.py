@@ -0,0 +1,198 @@
+"""
+GraphQL over WebSocket (the ``graphql-transport-ws`` protocol) as a plain
+ASGI application, mounted by ``alx_backend_graphql/asgi.py`` at ``/graphql``.
+
+Subscriptions stream events from ``crm.pubsub``. Queries and mutations sent
+over the socket run in a worker thread, since the ORM is synchronous, and
+complete after one result.
+"""
+import asyncio
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from graphql import ExecutionResult, GraphQLError
+
+from . import routers
+from .instrumentation import operation_type
+
+logger = logging.getLogger('crm.websocket')
+
+PROTOCOL = 'graphql-transport-ws'
+
+# Close codes defined by the protocol
+BAD_REQUEST = 4400
+UNAUTHORIZED = 4401
+SUBSCRIBER_EXISTS = 4409
+INIT_TIMEOUT = 4408
+TOO_MANY_INIT = 4429
+SUBPROTOCOL_NOT_ACCEPTABLE = 4406
+
+CONNECTION_INIT_TIMEOUT = 10
+
+
+class GraphQLWebSocket:
+    """ASGI application serving one schema over ``graphql-transport-ws``.
+
+    ``schema`` may also be a callable returning the schema, which is then
+    only built when the first connection arrives.
+    """
+
+    def __init__(self, schema):
+        self._schema = schema
+
+    @property
+    def schema(self):
+        if callable(self._schema):
+            self._schema = self._schema()
+        return self._schema
+
+    async def __call__(self, scope, receive, send):
+        event = await receive()
+        if event['type'] != 'websocket.connect':
+            return
+        if PROTOCOL not in scope.get('subprotocols', []):
+            await send({'type': 'websocket.close', 'code': SUBPROTOCOL_NOT_ACCEPTABLE})
+            return
+        await send({'type': 'websocket.accept', 'subprotocol': PROTOCOL})
+        await Connection(self.schema, scope, receive, send).run()
+
+
+class Connection:
+    def __init__(self, schema, scope, receive, send):
+        self.schema = schema
+        self.scope = scope
+        self.receive = receive
+        self._send = send
+        self.send_lock = asyncio.Lock()
+        self.acknowledged = False
+        self.closed = False
+        self.operations = {}
+        self.tasks = set()
+
+    async def send(self, message):
+        async with self.send_lock:
+            if not self.closed:
+                await self._send({'type': 'websocket.send', 'text': json.dumps(message)})
+
+    async def close(self, code, reason=''):
+        async with self.send_lock:
+            if not self.closed:
+                self.closed = True
+                await self._send({'type': 'websocket.close', 'code': code, 'reason': reason})
+
+    async def run(self):
+        init_timeout = asyncio.get_running_loop().call_later(
+            CONNECTION_INIT_TIMEOUT, lambda: asyncio.ensure_future(self.close_if_unacknowledged())
+        )
+        try:
+            while not self.closed:
+                event = await self.receive()
+                if event['type'] == 'websocket.disconnect':
+                    self.closed = True
+                    break
+                if event['type'] == 'websocket.receive':
+                    await self.handle(event.get('text') or (event.get('bytes') or b'').decode('utf-8'))
+        finally:
+            init_timeout.cancel()
+            tasks = list(self.tasks)
+            for task in tasks:
+                task.cancel()
+            # Let the operations unsubscribe before the connection goes away
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def close_if_unacknowledged(self):
+        if not self.acknowledged:
+            await self.close(INIT_TIMEOUT, "Connection initialisation timeout")
+
+    async def handle(self, text):
+        try:
+            message = json.loads(text)
+            message_type = message['type']
+        except (ValueError, KeyError, TypeError):
+            await self.close(BAD_REQUEST, "Invalid message received")
+            return
+
+        if message_type == 'connection_init':
+            if self.acknowledged:
+                await self.close(TOO_MANY_INIT, "Too many initialisation requests")
+                return
+            self.acknowledged = True
+            await self.send({'type': 'connection_ack'})
+        elif message_type == 'ping':
+            await self.send({'type': 'pong'})
+        elif message_type == 'pong':
+            pass
+        elif message_type == 'subscribe':
+            await self.subscribe(message)
+        elif message_type == 'complete':
+            task = self.operations.pop(message.get('id'), None)
+            if task is not None:
+                task.cancel()
+        else:
+            await self.close(BAD_REQUEST, f"Unknown message type {message_type!r}")
+
+    async def subscribe(self, message):
+        if not self.acknowledged:
+            await self.close(UNAUTHORIZED, "Unauthorized")
+            return
+        operation_id = message.get('id')
+        payload = message.get('payload') or {}
+        if not operation_id or not isinstance(payload.get('query'), str):
+            await self.close(BAD_REQUEST, "Invalid subscribe message")
+            return
+        if operation_id in self.operations:
+            await self.close(SUBSCRIBER_EXISTS, f"Subscriber for {operation_id} already exists")
+            return
+        task = asyncio.ensure_future(self.execute(operation_id, payload))
+        self.operations[operation_id] = task
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def execute(self, operation_id, payload):
+        query = payload['query']
+        variables = payload.get('variables')
+        operation_name = payload.get('operationName')
+        try:
+            if operation_type(query, operation_name) == 'subscription':
+                result = await self.schema.subscribe(
+                    query, variable_values=variables, operation_name=operation_name
+                )
+                if isinstance(result, ExecutionResult):
+                    await self.send_result(operation_id, result)
+                else:
+                    try:
+                        async for item in result:
+                            await self.send_result(operation_id, item)
+                    finally:
+                        await result.aclose()
+            else:
+                result = await sync_to_async(self.execute_sync)(query, variables, operation_name)
+                await self.send_result(operation_id, result)
+            if operation_id in self.operations:
+                await self.send({'id': operation_id, 'type': 'complete'})
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            logger.exception("WebSocket operation %s failed", operation_id)
+            await self.send({'id': operation_id, 'type': 'error', 'payload': [GraphQLError(str(error)).formatted]})
+        finally:
+            # The id may already belong to a newer operation
+            if self.operations.get(operation_id) is asyncio.current_task():
+                del self.operations[operation_id]
+
+    def execute_sync(self, query, variables, operation_name):
+        with routers.request_scope():
+            if operation_type(query, operation_name) == 'mutation':
+                routers.pin_primary()
+            return self.schema.execute(query, variable_values=variables, operation_name=operation_name)
+
+    async def send_result(self, operation_id, result):
+        if result.data is None and result.errors:
+            # Request errors (parse/validation) end the operation with "error"
+            await self.send({
+                'id': operation_id, 'type': 'error', 'payload': [error.formatted for error in result.errors],
+            })
+            self.operations.pop(operation_id, None)
+            return
+        await self.send({'id': operation_id, 'type': 'next', 'payload': result.formatted})
@@ -10,7 +10,7 @@ import django
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_backend_graphql.settings')
 django.setup()
 
-from crm.models import Customer, Product, Order
+from crm.models import Customer, Product, Order, OrderLine
 from decimal import Decimal
 from django.db import transaction
 
@@ -91,7 +91,10 @@ def seed_orders(customers, products):
             customer=customer,
             total_amount=total_amount
         )
-        order.products.set(products_list)
+        OrderLine.objects.bulk_create([
+            OrderLine(order=order, product=product, unit_price=product.price)
+            for product in products_list
+        ])
         
         created_orders.append(order)
         product_names = ", ".join([p.name for p in products_list])